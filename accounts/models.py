@@ -1,7 +1,12 @@
+from io import BytesIO
+
 from django.contrib.auth.models import AbstractUser
+from django.core.files.base import ContentFile
 from django.db import models
 from PIL import Image
 
+from core.imaging import PROFILE_WIDTHS, schedule_derivatives
+
 
 class User(AbstractUser):
     phone_number = models.CharField(max_length=15, blank=True)
@@ -9,17 +14,27 @@ class User(AbstractUser):
     profile_picture = models.ImageField(upload_to='profile_pics/', null=True, blank=True)
     
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        
-        if self.profile_picture and hasattr(self.profile_picture, 'path'):
+        picture = self.profile_picture
+        uploaded = bool(picture) and not picture._committed
+        if uploaded:
+            # Shrink before storing: stored media is named by its content
+            # and must never be rewritten in place.
             try:
-                img = Image.open(self.profile_picture.path)
+                img = Image.open(picture)
+                image_format = img.format
                 if img.height > 300 or img.width > 300:
                     output_size = (300, 300)
                     img.thumbnail(output_size)
-                    img.save(self.profile_picture.path)
+                    buffer = BytesIO()
+                    img.save(buffer, format=image_format)
+                    picture.save(picture.name, ContentFile(buffer.getvalue()), save=False)
             except Exception:
                 pass
+        
+        super().save(*args, **kwargs)
+        
+        if uploaded:
+            schedule_derivatives(self.profile_picture, PROFILE_WIDTHS)
 
 
 class Address(models.Model):
@@ -0,0 +1,7 @@
+from .services import cached_count
+
+
+def cart(request):
+    if not hasattr(request, 'user'):
+        return {}
+    return {'cart_count': cached_count(request)}
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cart.models import Cart
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored item count and subtotal of every cart from its items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Carts per transaction')
+
+    def handle(self, *args, **options):
+        checked = repaired = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                batch = Cart.objects.filter(pk__gt=last_pk).order_by('pk')[:options['batch_size']]
+                before = dict(
+                    (pk, (count, subtotal)) for pk, count, subtotal in batch.values_list('pk', 'item_count', 'subtotal')
+                )
+                if not before:
+                    break
+                carts = Cart.objects.filter(pk__in=before)
+                carts.sync_summary()
+                for pk, count, subtotal in carts.values_list('pk', 'item_count', 'subtotal'):
+                    if before[pk] != (count, subtotal):
+                        repaired += 1
+            checked += len(before)
+            last_pk = max(before)
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} carts, repaired {repaired}'))
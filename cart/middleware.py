@@ -0,0 +1,24 @@
+from django.conf import settings
+
+from .services import COOKIE_NAME, COOKIE_SALT, cookie_max_age, encode_cookie_cart
+
+
+class CartCookieMiddleware:
+    """Writes back an anonymous cart changed during the request (CART_STORAGE = 'cookie')."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        cart = getattr(request, '_cart_cookie', None)
+        if cart is None:
+            return response
+        if cart:
+            response.set_signed_cookie(
+                COOKIE_NAME, encode_cookie_cart(cart), salt=COOKIE_SALT, max_age=cookie_max_age(),
+                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+            )
+        else:
+            response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        return response
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.24 on 2026-10-17 23:44
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_cart_summary(apps, schema_editor):
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    Cart.objects.update(
+        item_count=Coalesce(Subquery(items.annotate(n=Sum('quantity')).values('n')), 0),
+        subtotal=Coalesce(
+            Subquery(items.annotate(
+                total=Sum(F('quantity') * F('product__effective_price'), output_field=DecimalField())
+            ).values('total')),
+            Decimal('0'),
+            output_field=DecimalField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+        ('products', '0004_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_cart_summary, migrations.RunPython.noop),
+    ]
@@ -1,23 +1,112 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import connection, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.utils import timezone
 from products.models import Product
 
 
+class CartQuerySet(models.QuerySet):
+    def adjust_summary(self, quantity, amount):
+        """Apply an item change to the stored summary in one UPDATE."""
+        return self.update(item_count=F('item_count') + quantity, subtotal=F('subtotal') + amount)
+    
+    def add_to_summary(self, user, product_id, quantity):
+        """
+        Count ``quantity`` units of a product, at its current price, into the
+        user's cart summary and return the new (item_count, subtotal), in
+        one UPDATE ... RETURNING statement.
+        """
+        qn = connection.ops.quote_name
+        sql = f'''
+            UPDATE {qn(Cart._meta.db_table)}
+            SET item_count = item_count + %s,
+                subtotal = subtotal + %s * (SELECT effective_price FROM {qn(Product._meta.db_table)} WHERE id = %s)
+            WHERE user_id = %s
+            RETURNING item_count, subtotal
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [quantity, quantity, product_id, user.pk])
+            item_count, subtotal = cursor.fetchone()
+        # SQLite hands NUMERIC arithmetic back as int or float
+        return item_count, Decimal(str(subtotal)).quantize(Decimal('0.01'))
+    
+    def sync_summary(self):
+        """Recompute item_count and subtotal from the items at current prices."""
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        return self.update(
+            item_count=Coalesce(Subquery(items.annotate(n=Sum('quantity')).values('n')), 0),
+            subtotal=Coalesce(
+                Subquery(items.annotate(
+                    total=Sum(F('quantity') * F('product__effective_price'), output_field=DecimalField())
+                ).values('total')),
+                Decimal('0'),
+                output_field=DecimalField(),
+            ),
+        )
+
+
 class Cart(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Kept up to date by cart.services in the same transaction as every
+    # item change, so totals are read without touching the items. Price
+    # changes after an item was added leave subtotal stale until the cart
+    # page or reconcile_carts re-syncs it.
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CartQuerySet.as_manager()
+    
     def __str__(self):
         return f"Cart for {self.user.username}"
     
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
     
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.subtotal
+    
+    def clear(self):
+        """Delete every item and zero the summary."""
+        self.items.all().delete()
+        Cart.objects.filter(pk=self.pk).update(item_count=0, subtotal=0)
+
+
+class CartItemQuerySet(models.QuerySet):
+    def add_units(self, user, product_id, quantity):
+        """
+        Add ``quantity`` of a product to the user's cart in one INSERT ... ON
+        CONFLICT ... RETURNING statement: insert the item, or increment it if
+        the cart already has one, but only while the product is active and
+        the new quantity is in stock.
+        Returns the item's new quantity, or None if nothing was written
+        (no cart yet, unknown or inactive product, or not enough stock).
+        """
+        qn = connection.ops.quote_name
+        item = qn(CartItem._meta.db_table)
+        cart_table = qn(Cart._meta.db_table)
+        product = qn(Product._meta.db_table)
+        sql = f'''
+            INSERT INTO {item} (cart_id, product_id, quantity, added_at)
+            SELECT c.id, p.id, %s, %s FROM {cart_table} c, {product} p
+            WHERE c.user_id = %s AND p.id = %s AND p.is_active AND p.stock_quantity >= %s
+            ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {item}.quantity + excluded.quantity
+            WHERE {item}.quantity + excluded.quantity <= (
+                SELECT stock_quantity FROM {product} WHERE id = excluded.product_id
+            )
+            RETURNING quantity
+        '''
+        with connection.cursor() as cursor:
+            added_at = connection.ops.adapt_datetimefield_value(timezone.now())
+            cursor.execute(sql, [quantity, added_at, user.pk, product_id, quantity])
+            row = cursor.fetchone()
+        return row[0] if row else None
 
 
 class CartItem(models.Model):
@@ -26,6 +115,8 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
     
+    objects = CartItemQuerySet.as_manager()
+    
     class Meta:
         unique_together = ('cart', 'product')
     
@@ -34,4 +125,4 @@ class CartItem(models.Model):
     
     @property
     def total_price(self):
-        return self.product.discounted_price * self.quantity
+        return self.product.effective_price * self.quantity
@@ -0,0 +1,519 @@
+"""
+Cart operations for signed-in and anonymous shoppers.
+
+CartService puts the user's Cart rows and the session's {product id:
+quantity} dict behind one interface. Lines are read with one query for the
+cart rows (none for a session cart) and one in_bulk() query for their
+products, joined to their primary image, and held in slotted CartLine
+objects. Every operation therefore costs a fixed number of queries,
+whatever the size of the cart.
+
+Stored carts carry their item count and subtotal on the Cart row. Each
+write adjusts them with an F() update in the same transaction as the item
+change, so count() and total() are a single-row read for JSON responses.
+
+The navbar badge reads a per-user count from the CART_COUNT_CACHE_ALIAS
+cache instead (session carts count from the session, which is loaded
+anyway). Writes update the cached count once they commit, so rendering the
+badge costs no query. A process-local cache (the default LocMemCache)
+would show each worker's own stale count, so without a shared backend the
+badge reads Cart.item_count, a single-row query.
+
+Anonymous carts live in the session by default. With CART_STORAGE =
+'cookie' they are kept in a signed cookie instead, as "id:qty,id:qty",
+so anonymous shopping never writes to the session table. The cookie is
+checked against the in-process catalog snapshot on every read, and
+CartCookieMiddleware writes it back when the cart changed.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+
+from products.models import Product
+from products.snapshot import get_snapshot
+from .models import Cart, CartItem
+
+SESSION_KEY = 'cart'
+COOKIE_NAME = 'cart'
+COOKIE_SALT = 'cart.cookie'
+# Keeps the signed cookie well under the 4KB browsers accept
+MAX_COOKIE_LINES = 50
+
+# Most operations one batch request may carry
+MAX_BATCH_OPERATIONS = 100
+# Largest values the id and quantity columns hold
+MAX_ID = 2 ** 63 - 1
+MAX_QUANTITY = 2 ** 31 - 1
+
+
+def count_cache():
+    """The cache shared by all workers for badge counts, or None if there is none."""
+    cache = caches[getattr(settings, 'CART_COUNT_CACHE_ALIAS', 'default')]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        return None
+    return cache
+
+
+def count_key(user_id):
+    return f'cart-count:{user_id}'
+
+
+def uses_cookie():
+    return getattr(settings, 'CART_STORAGE', 'session') == 'cookie'
+
+
+def cookie_max_age():
+    return getattr(settings, 'CART_COOKIE_AGE', 60 * 60 * 24 * 30)
+
+
+def encode_cookie_cart(cart):
+    return ','.join(f'{pid}:{quantity}' for pid, quantity in cart.items())
+
+
+def read_cookie_cart(request):
+    """
+    The anonymous {product id: quantity} cart from the signed cookie, keeping
+    only active, available products. Quantities are checked against the
+    stock level itself when lines are changed and when the cart is merged.
+    """
+    if hasattr(request, '_cart_cookie'):
+        return dict(request._cart_cookie)
+    value = request.get_signed_cookie(COOKIE_NAME, default='', salt=COOKIE_SALT, max_age=cookie_max_age())
+    products = get_snapshot().products
+    cart = {}
+    for entry in value.split(',')[:MAX_COOKIE_LINES] if value else []:
+        try:
+            pid, quantity = (int(part) for part in entry.split(':'))
+        except ValueError:
+            continue
+        product = products.get(pid)
+        if product is not None and product.in_stock and quantity > 0:
+            cart[str(pid)] = quantity
+    return cart
+
+
+def has_anonymous_cart(request):
+    if uses_cookie():
+        return COOKIE_NAME in request.COOKIES
+    return bool(request.session.get(SESSION_KEY))
+
+
+def cached_count(request):
+    """Units in the visitor's cart, for the navbar badge."""
+    if not request.user.is_authenticated:
+        if uses_cookie():
+            return sum(read_cookie_cart(request).values())
+        return sum(request.session.get(SESSION_KEY, {}).values())
+    cache = count_cache()
+    key = count_key(request.user.pk)
+    count = cache.get(key) if cache is not None else None
+    if count is None:
+        count = Cart.objects.filter(user=request.user).values_list('item_count', flat=True).first() or 0
+        if cache is not None:
+            cache.set(key, count)
+    return count
+
+
+def set_cached_count(user_id, count):
+    cache = count_cache()
+    if cache is not None:
+        transaction.on_commit(lambda: cache.set(count_key(user_id), count))
+
+
+def adjust_cached_count(user_id, delta):
+    cache = count_cache()
+
+    def apply():
+        try:
+            cache.incr(count_key(user_id), delta)
+        except ValueError:
+            # Not cached; the next badge read loads it
+            pass
+    if cache is not None and delta:
+        transaction.on_commit(apply)
+
+
+class CartError(Exception):
+    """A cart operation that cannot be applied; the message is shown to the shopper."""
+
+
+class InvalidCartChange(CartError):
+    """A batch change that is malformed rather than refused."""
+
+
+class CartLine:
+    __slots__ = ('id', 'product', 'quantity')
+
+    def __init__(self, id, product, quantity):
+        # Cart item id for stored carts, product id for session carts
+        self.id = id
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def total_price(self):
+        return self.product.effective_price * self.quantity
+
+
+def product_queryset():
+    return Product.objects.filter(is_active=True).select_related('category', 'primary_image')
+
+
+class CartService:
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user if request.user.is_authenticated else None
+        self._lines = None
+        self._summary = None
+
+    # Reading
+
+    def lines(self):
+        if self._lines is None:
+            if self.user:
+                rows = list(
+                    CartItem.objects.filter(cart__user=self.user).order_by('added_at', 'id')
+                    .values_list('id', 'product_id', 'quantity')
+                )
+            else:
+                rows = [(int(pid), int(pid), quantity) for pid, quantity in self._session_cart().items()]
+            products = product_queryset().in_bulk([product_id for line_id, product_id, quantity in rows])
+            self._lines = [
+                CartLine(line_id, products[product_id], quantity)
+                for line_id, product_id, quantity in rows if product_id in products
+            ]
+            if self.user and len(self._lines) == len(rows):
+                self._heal_summary()
+        return self._lines
+
+    def summary(self):
+        """(item count, subtotal) without loading the lines."""
+        if self._summary is None:
+            if self._lines is not None:
+                self._summary = self._line_summary()
+            elif self.user:
+                self._summary = Cart.objects.filter(user=self.user).values_list(
+                    'item_count', 'subtotal'
+                ).first() or (0, Decimal('0'))
+            else:
+                self._summary = self._line_summary()
+        return self._summary
+
+    def count(self):
+        if not self.user and self._lines is None:
+            return sum(self._session_cart().values())
+        return self.summary()[0]
+
+    def total(self):
+        return self.summary()[1]
+
+    def line(self, line_id):
+        for line in self.lines():
+            if line.id == line_id:
+                return line
+        return None
+
+    # Writing
+
+    def add(self, product_id, quantity):
+        if quantity < 1:
+            raise CartError('Quantity must be at least 1')
+        if self.user and connection.features.can_return_columns_from_insert:
+            return self._add_stored(product_id, quantity)
+
+        product = self._product(product_id)
+        self._check_available(product, quantity)
+        if self.user:
+            with transaction.atomic():
+                cart, created = Cart.objects.get_or_create(user=self.user)
+                item, created = CartItem.objects.select_for_update().get_or_create(
+                    cart=cart, product=product, defaults={'quantity': quantity}
+                )
+                if not created:
+                    self._check_stock(product, item.quantity + quantity, adding=True)
+                    item.quantity += quantity
+                    item.save(update_fields=['quantity'])
+                self._adjust(cart.pk, product, quantity)
+                adjust_cached_count(self.user.pk, quantity)
+        else:
+            cart = self._session_cart()
+            new_quantity = cart.get(str(product.pk), 0) + quantity
+            self._check_stock(product, new_quantity, adding=True)
+            cart[str(product.pk)] = new_quantity
+            self._save_session_cart(cart)
+        self._reset()
+        return product
+
+    def _add_stored(self, product_id, quantity):
+        # Two statements in one transaction: the upsert checks stock and
+        # increments atomically, so concurrent adds neither lose units nor
+        # oversell, and the summary UPDATE returns the new count and total
+        # for the response. The product for the confirmation message comes
+        # from the catalog snapshot; only a refusal reads it to explain why.
+        # RETURNING needs SQLite 3.35+ (or PostgreSQL), which also has the
+        # ON CONFLICT target syntax.
+        with transaction.atomic():
+            added = CartItem.objects.add_units(self.user, product_id, quantity)
+            if added is None:
+                # Perhaps there was no cart row to insert into yet. Retry even
+                # if a concurrent first add created it: only a second refusal
+                # means the stock is short.
+                Cart.objects.get_or_create(user=self.user)
+                added = CartItem.objects.add_units(self.user, product_id, quantity)
+            if added is None:
+                self._refuse(product_id, quantity)
+            summary = Cart.objects.add_to_summary(self.user, product_id, quantity)
+            adjust_cached_count(self.user.pk, quantity)
+        self._reset()
+        self._summary = summary
+        return get_snapshot().products.get(int(product_id)) or self._product(product_id)
+
+    def update(self, line_id, quantity):
+        if quantity < 1:
+            raise CartError('Quantity must be at least 1')
+        if self.user:
+            with transaction.atomic():
+                item = CartItem.objects.select_for_update().select_related('product').filter(
+                    id=line_id, cart__user=self.user
+                ).first()
+                if item is None:
+                    raise CartError('Item not found in your cart')
+                self._check_stock(item.product, quantity)
+                delta = quantity - item.quantity
+                item.quantity = quantity
+                item.save(update_fields=['quantity'])
+                self._adjust(item.cart_id, item.product, delta)
+                adjust_cached_count(self.user.pk, delta)
+            product = item.product
+        else:
+            cart = self._session_cart()
+            if str(line_id) not in cart:
+                raise CartError('Item not found in your cart')
+            product = self._product(line_id)
+            self._check_stock(product, quantity)
+            cart[str(line_id)] = quantity
+            self._save_session_cart(cart)
+        self._reset()
+        return CartLine(line_id, product, quantity)
+
+    def remove(self, line_id):
+        if self.user:
+            with transaction.atomic():
+                item = CartItem.objects.select_for_update().select_related('product').filter(
+                    id=line_id, cart__user=self.user
+                ).first()
+                if item is not None:
+                    item.delete()
+                    self._adjust(item.cart_id, item.product, -item.quantity)
+                    adjust_cached_count(self.user.pk, -item.quantity)
+        else:
+            cart = self._session_cart()
+            if cart.pop(str(line_id), None) is not None:
+                self._save_session_cart(cart)
+        self._reset()
+
+    def clear(self):
+        if self.user:
+            cart = Cart.objects.filter(user=self.user).first()
+            if cart is not None:
+                with transaction.atomic():
+                    cart.clear()
+            set_cached_count(self.user.pk, 0)
+        else:
+            self._save_session_cart({})
+        self._reset()
+
+    def apply(self, operations):
+        """
+        Apply a list of {'op': 'add', 'product': id, 'quantity': n},
+        {'op': 'update', 'item': id, 'quantity': n} and {'op': 'remove',
+        'item': id} operations in order, all or none. The net change is
+        written with one bulk INSERT, UPDATE and DELETE each.
+        """
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            raise CartError(f'At most {MAX_BATCH_OPERATIONS} changes can be sent at once')
+        with transaction.atomic():
+            if self.user:
+                cart = Cart.objects.get_or_create(user=self.user)[0]
+                rows = list(CartItem.objects.select_for_update().filter(cart=cart).values_list(
+                    'id', 'product_id', 'quantity'
+                ))
+            else:
+                rows = [(int(pid), int(pid), quantity) for pid, quantity in self._session_cart().items()]
+            line_of = {product_id: line_id for line_id, product_id, quantity in rows}
+            product_of = {line_id: product_id for line_id, product_id, quantity in rows}
+            before = {product_id: quantity for line_id, product_id, quantity in rows}
+            after, added = self._replay(operations, before, product_of)
+
+            changed = {pid for pid in before.keys() | after.keys() if before.get(pid) != after.get(pid)}
+            products = Product.objects.in_bulk(changed)
+            for pid in changed:
+                if after.get(pid, 0) > before.get(pid, 0):
+                    product = products.get(pid)
+                    if product is None or not product.is_active:
+                        raise CartError('Product not found')
+                    if pid not in before:
+                        self._check_available(product, after[pid])
+                    self._check_stock(product, after[pid], adding=pid in added)
+
+            if self.user:
+                CartItem.objects.bulk_create([
+                    CartItem(cart=cart, product_id=pid, quantity=quantity)
+                    for pid, quantity in after.items() if pid not in before
+                ])
+                CartItem.objects.bulk_update([
+                    CartItem(id=line_of[pid], quantity=after[pid])
+                    for pid in changed if pid in before and pid in after
+                ], ['quantity'])
+                CartItem.objects.filter(pk__in=[line_of[pid] for pid in changed if pid not in after]).delete()
+                units = sum(after.get(pid, 0) - before.get(pid, 0) for pid in changed)
+                amount = sum(
+                    (products[pid].effective_price * (after.get(pid, 0) - before.get(pid, 0))
+                     for pid in changed if pid in products),
+                    Decimal('0'),
+                )
+                Cart.objects.filter(pk=cart.pk).adjust_summary(units, amount)
+                adjust_cached_count(self.user.pk, units)
+            elif changed:
+                self._save_session_cart({str(pid): quantity for pid, quantity in after.items()})
+        self._reset()
+
+    def _replay(self, operations, before, product_of):
+        """The {product id: quantity} cart after the operations, and the products added to."""
+        after = dict(before)
+        added = set()
+        for operation in operations:
+            try:
+                kind = operation['op']
+                line_id = int(operation['product' if kind == 'add' else 'item'])
+                quantity = int(operation.get('quantity', 1))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                raise InvalidCartChange('Invalid cart change')
+            if kind not in ('add', 'update', 'remove'):
+                raise InvalidCartChange(f'Unknown cart change {kind!r}')
+            if not (0 < line_id <= MAX_ID and abs(quantity) <= MAX_QUANTITY):
+                raise InvalidCartChange('Invalid cart change')
+            product_id = line_id if kind == 'add' else product_of.get(line_id)
+            if kind != 'add' and product_id not in after:
+                raise CartError('Item not found in your cart')
+            if kind != 'remove' and quantity < 1:
+                raise CartError('Quantity must be at least 1')
+            if kind == 'add':
+                after[product_id] = after.get(product_id, 0) + quantity
+                added.add(product_id)
+            elif kind == 'update':
+                after[product_id] = quantity
+            else:
+                del after[product_id]
+        return after, added
+
+    def merge_session_cart(self):
+        """
+        Move the session cart into the signed-in user's stored cart with one
+        bulk upsert. Quantities for products already in the cart are summed
+        and everything is clamped to current stock; unavailable products
+        are dropped. The session key is removed once the merge commits, so
+        a merge that fails leaves the anonymous cart to retry from.
+        """
+        wanted = {int(pid): quantity for pid, quantity in self._session_cart().items()}
+        if not wanted:
+            self._save_session_cart({})
+            return
+        with transaction.atomic():
+            transaction.on_commit(lambda: self._save_session_cart({}))
+            cart = Cart.objects.get_or_create(user=self.user)[0]
+            existing = dict(CartItem.objects.select_for_update().filter(
+                cart=cart, product_id__in=wanted
+            ).values_list('product_id', 'quantity'))
+            products = Product.objects.filter(
+                pk__in=wanted, is_active=True, stock_quantity__gt=0
+            ).only('pk', 'stock_quantity', 'effective_price').in_bulk()
+            merged = {}
+            for pid, quantity in wanted.items():
+                if pid in products:
+                    quantity = min(existing.get(pid, 0) + quantity, products[pid].stock_quantity)
+                    if quantity > existing.get(pid, 0):
+                        merged[pid] = quantity
+            if not merged:
+                return
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, product_id=pid, quantity=quantity) for pid, quantity in merged.items()],
+                update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity'],
+            )
+            units = sum(quantity - existing.get(pid, 0) for pid, quantity in merged.items())
+            amount = sum(
+                (products[pid].effective_price * (quantity - existing.get(pid, 0)) for pid, quantity in merged.items()),
+                Decimal('0'),
+            )
+            Cart.objects.filter(pk=cart.pk).adjust_summary(units, amount)
+            adjust_cached_count(self.user.pk, units)
+        self._reset()
+
+    # Helpers
+
+    def _reset(self):
+        self._lines = None
+        self._summary = None
+
+    def _adjust(self, cart_id, product, quantity):
+        Cart.objects.filter(pk=cart_id).adjust_summary(quantity, product.effective_price * quantity)
+
+    def _line_summary(self):
+        lines = self.lines()
+        return sum(line.quantity for line in lines), sum((line.total_price for line in lines), Decimal('0'))
+
+    def _heal_summary(self):
+        # Price changes since items were added leave the stored subtotal
+        # behind; the page has the lines loaded anyway, so fix it here.
+        actual = self._line_summary()
+        stored = Cart.objects.filter(user=self.user).values_list('item_count', 'subtotal').first()
+        if stored is not None and tuple(stored) != actual:
+            Cart.objects.filter(user=self.user).sync_summary()
+
+    def _product(self, product_id):
+        product = product_queryset().filter(pk=product_id).first()
+        if product is None:
+            raise CartError('Product not found')
+        return product
+
+    def _refuse(self, product_id, quantity):
+        product = self._product(product_id)
+        self._check_available(product, quantity)
+        in_cart = CartItem.objects.filter(cart__user=self.user, product=product).values_list(
+            'quantity', flat=True
+        ).first() or 0
+        self._check_stock(product, in_cart + quantity, adding=True)
+        # Stock moved between the upsert and these reads
+        raise CartError(f'Only {product.stock_quantity} items available')
+
+    def _check_available(self, product, quantity):
+        if not product.in_stock:
+            raise CartError('Product is out of stock')
+        if quantity > product.stock_quantity:
+            raise CartError(f'Only {product.stock_quantity} items available')
+
+    def _check_stock(self, product, quantity, adding=False):
+        if quantity > product.stock_quantity:
+            if adding:
+                raise CartError(f'Cannot add more. Only {product.stock_quantity} items available')
+            raise CartError(f'Only {product.stock_quantity} items available')
+
+    def _session_cart(self):
+        if uses_cookie():
+            return read_cookie_cart(self.request)
+        return dict(self.request.session.get(SESSION_KEY, {}))
+
+    def _save_session_cart(self, cart):
+        if uses_cookie():
+            if len(cart) > MAX_COOKIE_LINES:
+                raise CartError(f'Your cart can hold at most {MAX_COOKIE_LINES} different items')
+            # Written to the response by CartCookieMiddleware
+            self.request._cart_cookie = dict(cart)
+        elif cart:
+            self.request.session[SESSION_KEY] = cart
+        else:
+            self.request.session.pop(SESSION_KEY, None)
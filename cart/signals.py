@@ -0,0 +1,12 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .services import CartService, has_anonymous_cart
+
+
+@receiver(user_logged_in)
+def merge_session_cart(sender, request, user, **kwargs):
+    # Covers every way in, including a shopper who registers and then logs
+    # in with the session they built the cart in
+    if request is not None and has_anonymous_cart(request):
+        CartService(request).merge_session_cart()
@@ -1,3 +1,357 @@
-from django.test import TestCase
+import tempfile
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from products import snapshot
+from products.models import Category, Product
+from .context_processors import cart as cart_context
+from .middleware import CartCookieMiddleware
+from .models import Cart, CartItem, CartItemQuerySet, CartQuerySet
+from .services import (
+    COOKIE_NAME, COOKIE_SALT, CartError, CartService, count_cache, count_key, read_cookie_cart,
+)
+
+
+def make_request(user=None, path='/'):
+    request = RequestFactory().get(path)
+    request.user = user or AnonymousUser()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+    return request
+
+
+class CartTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', password='secret')
+        category = Category.objects.create(name='Rings')
+        cls.ring, cls.band, cls.chain = (
+            Product.objects.create(
+                name=name, category=category, description='', price=price, stock_quantity=stock, material='gold',
+            )
+            for name, price, stock in (('Gold Ring', 300, 5), ('Gold Band', 120, 2), ('Gold Chain', 80, 10))
+        )
+        cls.sold_out = Product.objects.create(
+            name='Gold Anklet', category=category, description='', price=60, stock_quantity=0, material='gold',
+        )
+
+    def setUp(self):
+        # Versions restart with every test's rollback, so drop any catalog
+        # snapshot an earlier test left behind
+        snapshot._snapshot = None
+
+    def service(self, user=None):
+        return CartService(make_request(user))
+
+
+class CartServiceTests(CartTestCase):
+    def check_cart(self, service, line_id):
+        """Shared add/update/remove walk; ``line_id`` maps a product to its line id."""
+        service.add(self.ring.pk, 2)
+        service.add(self.ring.pk, 1)
+        service.add(self.band.pk, 1)
+        self.assertEqual([(line.product, line.quantity) for line in service.lines()], [(self.ring, 3), (self.band, 1)])
+        self.assertEqual((service.count(), service.total()), (4, Decimal('1020.00')))
+
+        service.update(line_id(self.ring), 1)
+        service.remove(line_id(self.band))
+        self.assertEqual([(line.product, line.quantity) for line in service.lines()], [(self.ring, 1)])
+        self.assertEqual((service.count(), service.total()), (1, Decimal('300.00')))
+        service.clear()
+        self.assertEqual((service.lines(), service.count()), ([], 0))
+
+    def test_stored_cart(self):
+        service = self.service(self.user)
+        self.check_cart(service, lambda product: CartItem.objects.get(cart__user=self.user, product=product).pk)
+
+    def test_session_cart(self):
+        service = self.service()
+        self.check_cart(service, lambda product: product.pk)
+        self.assertNotIn('cart', service.request.session)
+
+    def test_stock_and_availability_are_enforced(self):
+        for service in (self.service(self.user), self.service()):
+            with self.subTest(stored=service.user is not None):
+                with self.assertRaisesMessage(CartError, 'Only 2 items available'):
+                    service.add(self.band.pk, 3)
+                service.add(self.band.pk, 2)
+                with self.assertRaisesMessage(CartError, 'Cannot add more. Only 2 items available'):
+                    service.add(self.band.pk, 1)
+                with self.assertRaisesMessage(CartError, 'out of stock'):
+                    service.add(self.sold_out.pk, 1)
+                with self.assertRaisesMessage(CartError, 'Product not found'):
+                    service.add(0, 1)
+                with self.assertRaisesMessage(CartError, 'at least 1'):
+                    service.add(self.ring.pk, 0)
+                self.assertEqual(service.count(), 2)
+
+    def test_reading_lines_costs_the_same_for_any_cart_size(self):
+        service = self.service(self.user)
+        service.add(self.ring.pk, 1)
+        # Cart rows, their products, and the stored summary check
+        with self.assertNumQueries(3):
+            CartService(service.request).lines()
+        service.add(self.band.pk, 1)
+        service.add(self.chain.pk, 1)
+        with self.assertNumQueries(3):
+            self.assertEqual(len(CartService(service.request).lines()), 3)
+
+    def test_other_shoppers_lines_cannot_be_changed(self):
+        other = get_user_model().objects.create_user('other', password='secret')
+        self.service(other).add(self.ring.pk, 1)
+        item = CartItem.objects.get(cart__user=other)
+        service = self.service(self.user)
+        with self.assertRaisesMessage(CartError, 'Item not found'):
+            service.update(item.pk, 2)
+        service.remove(item.pk)
+        self.assertTrue(CartItem.objects.filter(pk=item.pk).exists())
+        self.assertEqual(Cart.objects.get(user=other).item_count, 1)
+
+
+class CartSummaryTests(CartTestCase):
+    def stored(self, user=None):
+        return tuple(Cart.objects.filter(user=user or self.user).values_list('item_count', 'subtotal').get())
+
+    def test_writes_keep_the_stored_summary_current(self):
+        service = self.service(self.user)
+        service.add(self.ring.pk, 2)
+        service.add(self.chain.pk, 1)
+        service.update(CartItem.objects.get(product=self.chain).pk, 3)
+        self.assertEqual(self.stored(), (5, Decimal('840.00')))
+        service.apply([
+            {'op': 'add', 'product': self.band.pk},
+            {'op': 'remove', 'item': CartItem.objects.get(product=self.ring).pk},
+        ])
+        self.assertEqual(self.stored(), (4, Decimal('360.00')))
+        service.remove(CartItem.objects.get(product=self.band).pk)
+        self.assertEqual(self.stored(), (3, Decimal('240.00')))
+        # Totals for JSON responses come from the summary row alone
+        fresh = CartService(service.request)
+        with self.assertNumQueries(1):
+            self.assertEqual((fresh.count(), fresh.total()), (3, Decimal('240.00')))
+        service.clear()
+        self.assertEqual(self.stored(), (0, Decimal('0.00')))
+
+    def test_price_changes_are_healed_by_the_cart_page(self):
+        service = self.service(self.user)
+        service.add(self.ring.pk, 2)
+        self.ring.price = 250
+        self.ring.save()
+        self.assertEqual(self.stored(), (2, Decimal('600.00')))
+        self.assertEqual(CartService(service.request).total(), Decimal('600.00'))
+        CartService(service.request).lines()
+        self.assertEqual(self.stored(), (2, Decimal('500.00')))
+
+    def test_reconcile_carts_repairs_drifted_summaries(self):
+        other = get_user_model().objects.create_user('other', password='secret')
+        self.service(self.user).add(self.ring.pk, 2)
+        self.service(other).add(self.chain.pk, 1)
+        Cart.objects.filter(user=self.user).update(item_count=7, subtotal=1)
+        stdout = StringIO()
+        call_command('reconcile_carts', '--batch-size', '1', stdout=stdout)
+        self.assertIn('Checked 2 carts, repaired 1', stdout.getvalue())
+        self.assertEqual(self.stored(), (2, Decimal('600.00')))
+        self.assertEqual(self.stored(other), (1, Decimal('80.00')))
+
+
+class CartBadgeTests(CartTestCase):
+    def badge(self):
+        return cart_context(make_request(self.user))['cart_count']
+
+    def test_process_local_caches_fall_back_to_the_stored_count(self):
+        self.assertIsNone(count_cache())
+        service = self.service(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            service.add(self.ring.pk, 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.badge(), 2)
+
+    def test_shared_cache_serves_the_badge_without_queries(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        caches_setting = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'counts': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name},
+        }
+        with override_settings(CACHES=caches_setting, CART_COUNT_CACHE_ALIAS='counts'):
+            service = self.service(self.user)
+            with self.captureOnCommitCallbacks(execute=True):
+                service.add(self.ring.pk, 2)
+            self.assertEqual(self.badge(), 2)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.badge(), 2)
+            # Writes adjust the shared count once they commit
+            with self.captureOnCommitCallbacks(execute=True):
+                service.add(self.chain.pk, 3)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.badge(), 5)
+            with self.captureOnCommitCallbacks(execute=True):
+                service.clear()
+            self.assertEqual(count_cache().get(count_key(self.user.pk)), 0)
+
+
+class StoredAddTests(CartTestCase):
+    def test_add_is_an_upsert_and_a_summary_update(self):
+        service = self.service(self.user)
+        service.add(self.ring.pk, 1)  # creates the cart row
+        with self.assertNumQueries(4):  # savepoint, upsert, summary, release
+            product = service.add(self.ring.pk, 2)
+            self.assertEqual((service.count(), service.total()), (3, Decimal('900.00')))
+        self.assertEqual(product.name, 'Gold Ring')
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 3)
+
+    def test_losing_the_race_to_create_the_cart_still_adds(self):
+        add_units = CartItemQuerySet.add_units
+
+        def raced(queryset, user, product_id, quantity):
+            # A concurrent first add creates the cart between our upsert and get_or_create
+            if not Cart.objects.filter(user=user).exists():
+                Cart.objects.create(user=user)
+                return None
+            return add_units(queryset, user, product_id, quantity)
+
+        with mock.patch.object(CartItemQuerySet, 'add_units', raced):
+            self.service(self.user).add(self.ring.pk, 2)
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 2)
+        self.assertEqual(Cart.objects.get(user=self.user).item_count, 2)
+
+    def test_refused_adds_write_nothing(self):
+        service = self.service(self.user)
+        service.add(self.band.pk, 2)
+        with self.assertRaisesMessage(CartError, 'Cannot add more'):
+            service.add(self.band.pk, 1)
+        with self.assertRaisesMessage(CartError, 'out of stock'):
+            service.add(self.sold_out.pk, 1)
+        self.assertEqual(
+            Cart.objects.filter(user=self.user).values_list('item_count', 'subtotal').get(), (2, Decimal('240.00'))
+        )
+
+
+class BatchCartViewTests(CartTestCase):
+    def post(self, body):
+        return self.client.post(reverse('cart:batch'), body, content_type='application/json')
+
+    def test_changes_are_applied_together(self):
+        self.client.force_login(self.user)
+        response = self.post({'operations': [
+            {'op': 'add', 'product': self.ring.pk, 'quantity': 2}, {'op': 'add', 'product': self.chain.pk},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['success'], response.json()['cart_count']), (True, 3))
+
+    def test_malformed_changes_are_bad_requests(self):
+        self.client.force_login(self.user)
+        for operations in (
+            [{'op': 'add', 'product': self.ring.pk, 'quantity': 'two'}],
+            [{'op': 'update', 'quantity': 2}],
+            [{'op': 'move', 'item': 1}],
+            ['add'],
+            [{'op': 'add', 'product': 2 ** 70}],
+            [{'op': 'add', 'product': self.ring.pk, 'quantity': 2 ** 40}],
+        ):
+            with self.subTest(operations=operations):
+                self.assertEqual(self.post({'operations': operations}).status_code, 400)
+        self.assertEqual(self.post('[]').status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_refused_changes_send_the_current_state(self):
+        response = self.post({'operations': [{'op': 'add', 'product': self.band.pk, 'quantity': 3}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['success'], response.json()['lines']), (False, []))
+
+
+class LoginMergeTests(CartTestCase):
+    def setUp(self):
+        super().setUp()
+        session = self.client.session
+        session['cart'] = {str(self.ring.pk): 2, str(self.band.pk): 5, str(self.sold_out.pk): 1}
+        session.save()
+
+    def stored_lines(self):
+        return dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def test_logging_in_merges_the_session_cart(self):
+        self.service(self.user).add(self.ring.pk, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('accounts:login'), {'username': 'shopper', 'password': 'secret'})
+        # Summed and clamped to stock; the sold out anklet is dropped
+        self.assertEqual(self.stored_lines(), {self.ring.pk: 3, self.band.pk: 2})
+        self.assertEqual(Cart.objects.get(user=self.user).item_count, 5)
+
+    def test_session_cart_is_kept_until_the_merge_commits(self):
+        request = make_request(self.user)
+        request.session['cart'] = {str(self.ring.pk): 2}
+        with self.captureOnCommitCallbacks() as callbacks:
+            CartService(request).merge_session_cart()
+        self.assertIn('cart', request.session)
+        for callback in callbacks:
+            callback()
+        self.assertNotIn('cart', request.session)
+
+    def test_failed_merge_keeps_the_session_cart(self):
+        request = make_request(self.user)
+        request.session['cart'] = {str(self.ring.pk): 2}
+        with mock.patch.object(CartQuerySet, 'adjust_summary', side_effect=DatabaseError), \
+                self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError):
+                CartService(request).merge_session_cart()
+        self.assertEqual(request.session['cart'], {str(self.ring.pk): 2})
+        self.assertEqual(self.stored_lines(), {})
+
+
+@override_settings(CART_STORAGE='cookie')
+class CookieCartTests(CartTestCase):
+    def signed(self, value):
+        return signing.get_cookie_signer(salt=COOKIE_NAME + COOKIE_SALT).sign(value)
+
+    def cookie_request(self, value, user=None):
+        request = make_request(user)
+        request.COOKIES[COOKIE_NAME] = value
+        return request
+
+    def test_tampered_cookies_read_as_an_empty_cart(self):
+        signed = self.signed(f'{self.ring.pk}:2')
+        self.assertEqual(read_cookie_cart(self.cookie_request(signed)), {str(self.ring.pk): 2})
+        for value in (signed.replace(':2', ':9', 1), f'{self.ring.pk}:9', 'garbage'):
+            with self.subTest(value=value):
+                self.assertEqual(read_cookie_cart(self.cookie_request(value)), {})
+        self.client.cookies[COOKIE_NAME] = signed.replace(':2', ':9', 1)
+        self.assertEqual(self.client.get(reverse('cart:view')).context['cart_count'], 0)
+
+    @mock.patch('cart.services.MAX_COOKIE_LINES', 2)
+    def test_oversized_cookies_are_cut_to_the_line_limit(self):
+        value = f'{self.ring.pk}:1,{self.band.pk}:1,{self.chain.pk}:1'
+        request = self.cookie_request(self.signed(value))
+        self.assertEqual(read_cookie_cart(request), {str(self.ring.pk): 1, str(self.band.pk): 1})
+        with self.assertRaisesMessage(CartError, 'at most 2 different items'):
+            CartService(request).add(self.chain.pk, 1)
+        # The limit counts entries as sent, so padding cannot make the read any longer
+        request = self.cookie_request(self.signed(f'x,{self.ring.pk}:0,{self.band.pk}:1'))
+        self.assertEqual(read_cookie_cart(request), {})
+
+    def test_cookie_cart_moves_into_the_stored_cart_at_login(self):
+        self.client.cookies[COOKIE_NAME] = self.signed(f'{self.ring.pk}:2,{self.band.pk}:5')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('accounts:login'), {'username': 'shopper', 'password': 'secret'})
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')),
+            {self.ring.pk: 2, self.band.pk: 2},
+        )
+        # Once the merge commits the middleware deletes the cookie
+        request = self.cookie_request(self.signed(f'{self.ring.pk}:1'), self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            CartService(request).merge_session_cart()
+        response = CartCookieMiddleware(lambda request: HttpResponse())(request)
+        self.assertEqual(response.cookies[COOKIE_NAME]['max-age'], 0)
+        self.assertEqual(CartItem.objects.get(cart__user=self.user, product=self.ring).quantity, 3)
@@ -9,4 +9,5 @@ urlpatterns = [
     path('remove/<int:item_id>/', views.RemoveFromCartView.as_view(), name='remove'),
     path('update/<int:item_id>/', views.UpdateCartView.as_view(), name='update'),
     path('clear/', views.ClearCartView.as_view(), name='clear'),
+    path('batch/', views.BatchCartView.as_view(), name='batch'),
 ]
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Responsive image derivatives.
+
+Every uploaded image gets resized copies at a few widths, each as WebP plus
+a JPEG fallback, stored under ``derivatives/`` next to the original in
+MEDIA_ROOT. Rendering happens in a process pool after the upload's
+transaction commits, so requests and management commands never wait on
+Pillow. The ``responsive_image`` template tag (core.templatetags.image_tags)
+then emits a <picture> with srcset/sizes over whichever derivatives exist,
+falling back to the original until they do.
+
+The pool is created lazily on first use in each process. A pool inherited
+across fork() (gunicorn --preload, multiprocessing) is unusable in the
+child, so the fork hook drops it and the child starts its own.
+"""
+import logging
+import os
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+from PIL import Image
+
+DERIVATIVE_DIR = 'derivatives'
+
+# Cards are at most ~300 CSS px wide, so these cover 1x-3x screens
+PRODUCT_WIDTHS = (320, 640, 960)
+PROFILE_WIDTHS = (120, 240)
+
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def derivative_name(name, width, ext):
+    root, _ = posixpath.splitext(name)
+    return posixpath.join(DERIVATIVE_DIR, f'{root}-{width}w.{ext}')
+
+
+def render_derivatives(source_path, media_root, name, widths):
+    """
+    Write the derivatives of one image and return the names written. Runs in
+    a worker process, so it only touches the filesystem.
+    """
+    written = []
+    with Image.open(source_path) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        source_mtime = os.path.getmtime(source_path)
+        for width in widths:
+            # Never upscale: widths past the original are re-encoded at its
+            # own size so every name in the srcset exists.
+            size = (min(width, image.width), max(1, round(image.height * min(width, image.width) / image.width)))
+            resized = image.resize(size, Image.LANCZOS) if size != image.size else image
+            for ext, options in FORMATS.items():
+                derivative = derivative_name(name, width, ext)
+                path = os.path.join(media_root, derivative)
+                if os.path.exists(path) and os.path.getmtime(path) >= source_mtime:
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                output = resized
+                if options['format'] == 'JPEG' and output.mode == 'RGBA':
+                    output = Image.new('RGB', output.size, (255, 255, 255))
+                    output.paste(resized, mask=resized.getchannel('A'))
+                tmp_path = f'{path}.tmp'
+                output.save(tmp_path, **options)
+                os.replace(tmp_path, path)
+                written.append(derivative)
+    return written
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2))
+    return _executor
+
+
+def _forget_executor():
+    global _executor
+    _executor = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_executor)
+
+
+def _log_failure(name, future):
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error('Rendering derivatives of %s failed', name, exc_info=error)
+
+
+def submit(fieldfile, widths):
+    """Queue derivative rendering for ``fieldfile`` now; returns the future."""
+    future = get_executor().submit(
+        render_derivatives, fieldfile.path, str(settings.MEDIA_ROOT), fieldfile.name, tuple(widths)
+    )
+    future.add_done_callback(lambda done: _log_failure(fieldfile.name, done))
+    return future
+
+
+def schedule_derivatives(fieldfile, widths):
+    """Render derivatives for ``fieldfile`` once the current transaction commits."""
+    if fieldfile:
+        transaction.on_commit(lambda: submit(fieldfile, widths))
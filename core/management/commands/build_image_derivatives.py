@@ -0,0 +1,31 @@
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+from core import imaging
+from products.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Renders the responsive WebP/JPEG derivatives for existing product and profile images'
+
+    def handle(self, *args, **options):
+        jobs = [
+            (image.image, imaging.PRODUCT_WIDTHS)
+            for image in ProductImage.objects.only('image')
+        ] + [
+            (user.profile_picture, imaging.PROFILE_WIDTHS)
+            for user in User.objects.exclude(profile_picture='').exclude(profile_picture=None).only('profile_picture')
+        ]
+        futures = {imaging.submit(fieldfile, widths): fieldfile.name for fieldfile, widths in jobs}
+        written = failed = 0
+        for future in as_completed(futures):
+            try:
+                written += len(future.result())
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f'{futures[future]}: {exc}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {len(jobs)} images, wrote {written} derivatives ({failed} failed)'
+        ))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import scale_data
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a deterministic, realistically skewed store for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', choices=sorted(scale_data.PRESETS), default='small')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=scale_data.BATCH_SIZE, help='Rows per INSERT')
+        for name in ('categories', 'products', 'users', 'orders'):
+            parser.add_argument(f'--{name}', type=int, help=f'Override the preset number of {name}')
+        parser.add_argument('--images-per-product', type=int, default=2, help='Up to N images each (0 for none)')
+
+    def handle(self, *args, **options):
+        if Product.objects.exists():
+            # Generated names and order numbers would collide with a previous run
+            raise CommandError('The database already has products; run this on an empty database (see flush)')
+        sizes = dict(scale_data.PRESETS[options['preset']])
+        sizes.update({name: options[name] for name in sizes if options[name] is not None})
+        started = time.monotonic()
+        scale_data.generate(
+            **sizes,
+            images_per_product=options['images_per_product'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {options['preset']} data set in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,147 @@
+"""
+Anonymous full-page cache for the catalog pages.
+
+Rendered responses for anonymous visitors are cached per path and
+normalized query string. Each entry records the versions of the catalog
+tags it depends on; views declare them with tag_page(), and pages that
+declare none fall back to the whole-catalog tag. Tags are narrow, so an
+edit only purges the pages showing what changed:
+
+    product:<id>, related:<id>    one product, its related-product cards
+    category:<id>                 one category's name and description
+    listing:<id>, listing         the products listed in one category, or all
+    facets, categories            sidebar counts, the category list and tiles
+    recent:<n>, featured:<n>      the first n newest or featured products
+
+An entry whose tags have moved since it was rendered is purged on read, so
+edits never serve stale pages. Tag versions come from the worker's catalog
+snapshot, so a purge reaches every worker within CATALOG_SNAPSHOT_POLL
+seconds.
+
+Entries older than PAGE_CACHE_TTL, but with unchanged tags, are still
+served for up to PAGE_CACHE_STALE more seconds. Meanwhile one request,
+chosen through a cache.add() lock, re-renders the page in a background
+thread.
+"""
+import hashlib
+import threading
+import time
+from io import BytesIO
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage import default_storage as default_message_storage
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.module_loading import import_string
+
+CACHEABLE_VIEWS = {'core:home', 'products:list', 'products:by_category', 'products:detail'}
+
+CATALOG_TAG = 'catalog'
+
+# Query parameters that never change the rendered page
+IGNORED_PARAMS = {'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'fbclid', 'gclid'}
+
+
+def tag_page(request, *tags):
+    """Declare catalog tags the page being rendered depends on."""
+    request.page_cache_tags = set(tags)
+
+
+def page_key(request):
+    params = sorted(
+        (key, value) for key, values in request.GET.lists() if key not in IGNORED_PARAMS
+        for value in values if value != ''
+    )
+    raw = f'{request.path}?{urlencode(params)}'
+    return 'page:' + hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+
+
+def tag_versions(tags):
+    from products.snapshot import get_snapshot
+    catalog = get_snapshot()
+    return {tag: catalog.tag_version(tag) for tag in tags}
+
+
+class PageCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cache = caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+        self.ttl = getattr(settings, 'PAGE_CACHE_TTL', 60)
+        self.stale = getattr(settings, 'PAGE_CACHE_STALE', 600)
+
+    def __call__(self, request):
+        if not self.is_cacheable_request(request):
+            return self.get_response(request)
+
+        key = page_key(request)
+        entry = self.cache.get(key)
+        if entry is not None:
+            if tag_versions(entry['tags']) != entry['tags']:
+                # Something the page shows has changed
+                self.cache.delete(key)
+            elif time.time() < entry['created'] + self.ttl:
+                return self.build_response(entry, 'hit')
+            else:
+                if self.cache.add(f'{key}:lock', 1, 30):
+                    self.revalidate(request, key)
+                return self.build_response(entry, 'stale')
+
+        response = self.get_response(request)
+        self.store(request, key, response)
+        response['X-Page-Cache'] = 'miss'
+        return response
+
+    def is_cacheable_request(self, request):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return False
+        # Pages rendered for a visitor with a cart or pending flash messages
+        # are personal
+        if (request.session.get('cart') or 'cart' in request.COOKIES
+                or request.session.get('_messages') or 'messages' in request.COOKIES):
+            return False
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        return match.view_name in CACHEABLE_VIEWS
+
+    def store(self, request, key, response):
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return
+        tags = getattr(request, 'page_cache_tags', None) or {CATALOG_TAG}
+        entry = {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'tags': tag_versions(tags),
+            'created': time.time(),
+        }
+        self.cache.set(key, entry, self.ttl + self.stale)
+
+    def build_response(self, entry, state):
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        response['X-Page-Cache'] = state
+        return response
+
+    def revalidate(self, request, key):
+        # The original request is finished with once we return, so render
+        # from a copy of its environ as a fresh anonymous visitor.
+        environ = {k: v for k, v in request.META.items() if k != 'HTTP_COOKIE'}
+        environ['wsgi.input'] = BytesIO()
+
+        def render():
+            fresh = WSGIRequest(environ)
+            fresh.user = AnonymousUser()
+            fresh.session = import_string(settings.SESSION_ENGINE).SessionStore()
+            fresh._messages = default_message_storage(fresh)
+            try:
+                self.store(fresh, key, self.get_response(fresh))
+            finally:
+                self.cache.delete(f'{key}:lock')
+                connections.close_all()
+
+        threading.Thread(target=render, daemon=True).start()
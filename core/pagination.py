@@ -0,0 +1,212 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of COUNT(*) plus OFFSET, each page is fetched with a WHERE clause
+that continues after the last row of the previous page on the active sort
+key, with the primary key as tie-breaker. Page cost stays constant however
+deep the visitor goes; the trade-off is that only next/previous navigation
+is possible.
+"""
+import datetime
+import json
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+
+CURSOR_SALT = 'core.pagination.cursor'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorMismatch(InvalidCursor):
+    """A genuine cursor issued for another ordering, e.g. before a sort change."""
+
+
+def _encode_value(value):
+    # Full precision: DjangoJSONEncoder would truncate microseconds and
+    # break ties between rows created in the same millisecond.
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+def _row_value(row, name):
+    # Rows may be model instances or values() dicts
+    if isinstance(row, dict):
+        return row['id' if name == 'pk' else name]
+    return getattr(row, name)
+
+
+def estimate_count(queryset):
+    """Planner row estimate for ``queryset``, or None where unavailable."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class CursorPage:
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1], 'next')
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0], 'previous')
+        return None
+
+    @property
+    def estimated_total(self):
+        return self.paginator.estimated_total
+
+
+class CursorPaginator:
+    def __init__(self, queryset, ordering, per_page, estimate_total=False):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.estimate_total = estimate_total
+        self.fields = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        if not any(name in ('pk', 'id') for name, descending in self.fields):
+            self.fields.append(('pk', self.fields[0][1] if self.fields else False))
+
+    @property
+    def estimated_total(self):
+        if not self.estimate_total:
+            return None
+        if not hasattr(self, '_estimated_total'):
+            self._estimated_total = estimate_count(self.queryset)
+        return self._estimated_total
+
+    def _ordering(self, reverse=False):
+        return [
+            f"{'-' if descending != reverse else ''}{name}"
+            for name, descending in self.fields
+        ]
+
+    def _seek(self, values, reverse=False):
+        """Rows strictly after ``values`` in (possibly reversed) sort order."""
+        condition = Q()
+        for index, (name, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending != reverse else 'gt'
+            clause = Q(**{f'{name}__{lookup}': values[index]})
+            for previous in range(index):
+                clause &= Q(**{self.fields[previous][0]: values[previous]})
+            condition |= clause
+        # The redundant inclusive bound on the leading column gives the
+        # planner a plain range to walk the sort index from.
+        name, descending = self.fields[0]
+        bound = 'lte' if descending != reverse else 'gte'
+        return Q(**{f'{name}__{bound}': values[0]}) & condition
+
+    def encode_cursor(self, obj, direction):
+        values = [_encode_value(_row_value(obj, name)) for name, descending in self.fields]
+        # The ordering is signed in too: values for one sort key are
+        # meaningless (or unparseable) bounds for another
+        return signing.dumps({'v': values, 'd': direction, 'o': self._ordering()}, salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, token):
+        try:
+            data = signing.loads(token, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise InvalidCursor('Invalid cursor')
+        if not isinstance(data, dict) or data.get('d') not in ('next', 'previous'):
+            raise InvalidCursor('Invalid cursor')
+        if data.get('o') != self._ordering() or len(data.get('v', [])) != len(self.fields):
+            raise CursorMismatch('Cursor does not match this listing')
+        return data['v'], data['d']
+
+    def page(self, cursor=None):
+        if not cursor:
+            rows = list(self.queryset.order_by(*self._ordering())[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self, len(rows) > self.per_page, False)
+
+        values, direction = self.decode_cursor(cursor)
+        if direction == 'next':
+            rows = list(self.queryset.filter(self._seek(values)).order_by(*self._ordering())[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self, len(rows) > self.per_page, True)
+
+        rows = list(
+            self.queryset.filter(self._seek(values, reverse=True)).order_by(*self._ordering(reverse=True))[:self.per_page + 1]
+        )
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        rows.reverse()
+        return CursorPage(rows, self, True, has_previous)
+
+
+class CursorPaginationMixin:
+    """
+    Keyset pagination for ListView subclasses, keyed on the queryset's own
+    ordering so filtering and sorting logic stays in get_queryset(). Requests
+    with ``?page=`` and orderings on non-column expressions (e.g. search
+    relevance) keep the offset paginator.
+    """
+    cursor_kwarg = 'cursor'
+    cursor_estimate_total = False
+
+    def get_cursor_ordering(self, queryset):
+        query = queryset.query
+        ordering = list(query.order_by or (query.get_meta().ordering if query.default_ordering else []))
+        concrete = {field.attname for field in queryset.model._meta.concrete_fields if not field.is_relation}
+        concrete.add('pk')
+        if not ordering or any(
+            not isinstance(field, str) or field.lstrip('-') not in concrete for field in ordering
+        ):
+            return None
+        return ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        if not getattr(settings, 'CURSOR_PAGINATION', True) or self.page_kwarg in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        ordering = self.get_cursor_ordering(queryset)
+        if ordering is None:
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = CursorPaginator(queryset, ordering, page_size, estimate_total=self.cursor_estimate_total)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except CursorMismatch:
+            # Left over from another sort; start the new one from the top
+            page = paginator.page()
+        except InvalidCursor:
+            raise Http404('Invalid page cursor.')
+        return (paginator, page, page.object_list, page.has_other_pages())
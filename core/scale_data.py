@@ -0,0 +1,282 @@
+"""
+Deterministic scale data.
+
+generate() fills the database with a synthetic store that is shaped like a
+real one: categories follow a long tail, product popularity is Zipf-like so
+a few items account for most orders, customers repeat, and orders hold a
+few items each. The same seed always produces the same rows. Everything is
+written with bulk_create in batches of ``batch_size``, so millions of rows
+build in minutes; the model signals are bypassed and the derived tables
+(image summaries, search index, facets, catalog version) are rebuilt once
+at the end.
+
+The query-plan tests seed their catalog with it, and benchmarks should use
+one of the PRESETS so results stay comparable.
+"""
+import contextlib
+import itertools
+import math
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files import File
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import Address, User
+from cart.models import Cart, CartItem
+from orders.models import Order, OrderItem
+from products import facets, search
+from products.models import Category, Product, ProductImage
+from products.snapshot import catalog_changed
+
+PRESETS = {
+    'small': dict(categories=40, products=5000, users=1000, orders=5000),
+    'medium': dict(categories=200, products=100000, users=50000, orders=250000),
+    'large': dict(categories=500, products=1000000, users=500000, orders=2000000),
+}
+
+BATCH_SIZE = 5000
+
+# Rough shape of the distributions
+CATEGORY_SKEW = 1.1
+POPULARITY_SKEW = 1.2
+CUSTOMER_SKEW = 0.8
+MAX_ORDER_ITEMS = 12
+HISTORY_DAYS = 730
+
+KINDS = ['Necklaces', 'Earrings', 'Rings', 'Bracelets', 'Bangles', 'Anklets', 'Pendants', 'Chains',
+         'Nose Pins', 'Brooches', 'Cufflinks', 'Mangalsutras', 'Maang Tikkas', 'Toe Rings', 'Charms']
+STYLES = ['Antique', 'Bridal', 'Classic', 'Contemporary', 'Temple', 'Kundan', 'Minimalist', 'Vintage',
+          'Statement', 'Everyday', 'Festive', 'Oxidised', 'Polki', 'Filigree', 'Layered', 'Kids']
+STONES = ['', '', 'Ruby', 'Emerald', 'Pearl', 'Sapphire', 'Zircon', 'Opal', 'Topaz', 'Onyx']
+CITIES = [('Mumbai', 'Maharashtra'), ('Delhi', 'Delhi'), ('Bengaluru', 'Karnataka'), ('Chennai', 'Tamil Nadu'),
+          ('Kolkata', 'West Bengal'), ('Hyderabad', 'Telangana'), ('Pune', 'Maharashtra'), ('Jaipur', 'Rajasthan')]
+
+# Median price by material; prices are log-normal around it
+MEDIAN_PRICE = {'gold': 450, 'silver': 90, 'artificial': 25, 'diamond': 1500, 'platinum': 900, 'other': 40}
+MATERIAL_WEIGHTS = {'gold': 30, 'silver': 25, 'artificial': 30, 'diamond': 5, 'platinum': 3, 'other': 7}
+# How each material reads in a product name
+MATERIAL_WORDS = {'gold': 'Gold', 'silver': 'Silver', 'artificial': '', 'diamond': 'Diamond', 'platinum': 'Platinum', 'other': ''}
+
+ORDER_STATUSES = [  # (status, payment status, weight)
+    ('delivered', 'paid', 60), ('shipped', 'paid', 10), ('processing', 'paid', 5),
+    ('confirmed', 'paid', 5), ('pending', 'pending', 10), ('cancelled', 'refunded', 10),
+]
+TAX_RATE = Decimal('0.08')
+CENT = Decimal('0.01')
+
+
+def zipf_weights(n, skew):
+    """Cumulative weights of a Zipf distribution over n ranks, for Random.choices."""
+    return list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, n + 1)))
+
+
+@contextlib.contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk_create write the given auto_now_add fields from the objects."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class Generator:
+    def __init__(self, seed, batch_size, log):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.log = log
+        self.now = timezone.now()
+
+    def past(self, days=HISTORY_DAYS, recent_bias=2.0):
+        # Skewed towards the present, like a growing store
+        return self.now - timedelta(seconds=int(days * 86400 * self.rng.random() ** recent_bias))
+
+    def bulk(self, model, objs):
+        written = []
+        for batch in batched(objs, self.batch_size):
+            model.objects.bulk_create(batch)
+            written.extend(batch)
+        self.log(f'{model.__name__}: {len(written)}')
+        return written
+
+    def categories(self, count):
+        names = KINDS[:count] + [f'{style} {kind}' for style in STYLES for kind in KINDS]
+        names += [f'Collection {i}' for i in range(max(0, count - len(names)))]
+        return self.bulk(Category, (
+            Category(name=name, description=f'{name} in every style', is_active=i % 10 != 0)
+            for i, name in enumerate(names[:count])
+        ))
+
+    def products(self, count, categories):
+        rng = self.rng
+        category_ids = [category.pk for category in categories]
+        category_weights = zipf_weights(len(category_ids), CATEGORY_SKEW)
+        materials = list(MATERIAL_WEIGHTS)
+        material_weights = list(itertools.accumulate(MATERIAL_WEIGHTS.values()))
+        kind_of = {
+            category.pk: next((kind for kind in KINDS if category.name.endswith(kind)), 'Jewelry')
+            for category in categories
+        }
+
+        def build(i):
+            material = rng.choices(materials, cum_weights=material_weights)[0]
+            category_id = rng.choices(category_ids, cum_weights=category_weights)[0]
+            stone = rng.choice(STONES)
+            word = MATERIAL_WORDS[material]
+            name = ' '.join(part for part in (rng.choice(STYLES), word, stone, kind_of[category_id]) if part)
+            price = Decimal(min(max(rng.lognormvariate(math.log(MEDIAN_PRICE[material]), 0.6), 5), 50000)).quantize(CENT)
+            product = Product(
+                name=name,
+                category_id=category_id,
+                description=' '.join(part for part in (
+                    'Handcrafted', word.lower(), 'jewelry', stone and f'set with {stone.lower()}',
+                ) if part) + f'. Item {i}.',
+                price=price,
+                discount_percentage=Decimal(rng.choice([0, 0, 0, 0, 5, 10, 15, 25])),
+                stock_quantity=0 if rng.random() < 0.15 else rng.randint(1, 100),
+                material=material,
+                is_featured=rng.random() < 0.05,
+                is_active=rng.random() < 0.95,
+                created_at=self.past(),
+            )
+            product.refresh_effective_price()
+            return product
+
+        with explicit_timestamps(Product._meta.get_field('created_at')):
+            return self.bulk(Product, (build(i) for i in range(count)))
+
+    def images(self, products, per_product):
+        if not per_product:
+            return []
+        # A small pool of real files shared by every product
+        field = ProductImage._meta.get_field('image')
+        pool = []
+        for path in sorted((settings.BASE_DIR / 'static' / 'images').glob('*.png')):
+            with open(path, 'rb') as f:
+                pool.append(field.storage.save(field.generate_filename(None, path.name), File(f, path.name)))
+        if not pool:
+            return []
+        images = self.bulk(ProductImage, (
+            ProductImage(product_id=product.pk, image=self.rng.choice(pool), alt_text=product.name, is_primary=n == 0)
+            for product in products for n in range(self.rng.randint(1, per_product))
+        ))
+        Product.objects.sync_image_summary()
+        return images
+
+    def users(self, count):
+        # Hashing once keeps this from being dominated by PBKDF2
+        password = make_password('password')
+        users = self.bulk(User, (
+            User(
+                username=f'customer{i}', email=f'customer{i}@example.com', password=password,
+                first_name=f'Customer{i}', date_joined=self.past(),
+            )
+            for i in range(count)
+        ))
+        rng = self.rng
+
+        def addresses(user):
+            for n in range(rng.choice([1, 1, 1, 2, 2, 3])):
+                city, state = rng.choice(CITIES)
+                yield Address(
+                    user_id=user.pk, street_address=f'{rng.randint(1, 999)} {rng.choice(STYLES)} Road',
+                    city=city, state=state, zip_code=f'{rng.randint(110000, 860000)}', is_default=n == 0,
+                )
+
+        self.bulk(Address, (address for user in users for address in addresses(user)))
+        return users
+
+    def carts(self, users, products, share=0.2):
+        rng = self.rng
+        carts = self.bulk(Cart, (Cart(user_id=user.pk) for user in users if rng.random() < share))
+        self.bulk(CartItem, (
+            CartItem(cart_id=cart.pk, product_id=product_id, quantity=rng.randint(1, 3))
+            for cart in carts
+            for product_id in {rng.choice(products).pk for _ in range(rng.randint(1, 5))}
+        ))
+        Cart.objects.sync_summary()
+        return carts
+
+    def orders(self, count, users, products):
+        rng = self.rng
+        ranked = products[:]
+        rng.shuffle(ranked)
+        popularity = zipf_weights(len(ranked), POPULARITY_SKEW)
+        customers = users[:]
+        rng.shuffle(customers)
+        loyalty = zipf_weights(len(customers), CUSTOMER_SKEW)
+        statuses = [(status, payment) for status, payment, weight in ORDER_STATUSES]
+        status_weights = list(itertools.accumulate(weight for status, payment, weight in ORDER_STATUSES))
+        addresses = {address.user_id: str(address) for address in Address.objects.filter(is_default=True).iterator()}
+
+        order_date = Order._meta.get_field('order_date')
+        written = 0
+        for start in range(0, count, self.batch_size):
+            orders, items = [], []
+            for i in range(start, min(start + self.batch_size, count)):
+                user = rng.choices(customers, cum_weights=loyalty)[0]
+                # Geometric basket sizes: mostly one or two items, sometimes many
+                size = min(1 + int(rng.expovariate(0.7)), MAX_ORDER_ITEMS)
+                basket = {product.pk: product for product in rng.choices(ranked, cum_weights=popularity, k=size)}
+                lines = [(product, rng.choice([1, 1, 1, 2, 3])) for product in basket.values()]
+                subtotal = sum(product.effective_price * quantity for product, quantity in lines)
+                tax = (subtotal * TAX_RATE).quantize(CENT)
+                status, payment = rng.choices(statuses, cum_weights=status_weights)[0]
+                placed = self.past()
+                orders.append(Order(
+                    user_id=user.pk, order_number=f'SCL{i:010d}', total_amount=subtotal + tax, tax_amount=tax,
+                    status=status, payment_status=payment,
+                    payment_method=rng.choice(['card', 'card', 'upi', 'netbanking', 'wallet']),
+                    shipping_address=addresses.get(user.pk, ''), order_date=placed,
+                    delivery_date=placed + timedelta(days=rng.randint(2, 9)) if status == 'delivered' else None,
+                ))
+                items.append(lines)
+            with explicit_timestamps(order_date):
+                Order.objects.bulk_create(orders)
+            OrderItem.objects.bulk_create([
+                OrderItem(order_id=order.pk, product_id=product.pk, quantity=quantity, price=product.effective_price)
+                for order, lines in zip(orders, items) for product, quantity in lines
+            ])
+            written += len(orders)
+        self.log(f'Order: {written}')
+        return written
+
+
+def generate(categories=40, products=4000, users=0, orders=0, images_per_product=0, carts=0.2,
+             seed=1, batch_size=BATCH_SIZE, rebuild=True, log=lambda message: None):
+    """
+    Write a synthetic store; returns the created categories and products.
+    ``carts`` is the share of users with an open cart. With ``rebuild`` the
+    search index, facet counts and catalog version are brought up to date.
+    """
+    generator = Generator(seed, batch_size, log)
+    with transaction.atomic():
+        category_objs = generator.categories(categories)
+        product_objs = generator.products(products, category_objs)
+        generator.images(product_objs, images_per_product)
+        on_sale = [product for product in product_objs if product.is_active]
+        if users and on_sale:
+            user_objs = generator.users(users)
+            generator.carts(user_objs, on_sale, carts)
+            if orders:
+                generator.orders(orders, user_objs, on_sale)
+    if rebuild:
+        search.rebuild_index(Product.objects.all())
+        facets.rebuild()
+        catalog_changed()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return category_objs, product_objs
@@ -0,0 +1,53 @@
+"""
+Content-addressed media storage.
+
+Uploads are stored as ``<upload_to>/<sha256 of the bytes><ext>``: identical
+files share one copy, and a name always refers to the same bytes, so media
+URLs can be served with ``Cache-Control: immutable`` and a changed image
+simply gets a new URL.
+"""
+import hashlib
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{64}(-\d+w)?\.\w+$')
+
+# A year, the longest max-age caches are expected to honour
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def is_content_addressed(name):
+    """Whether ``name`` (or a derivative of it) is a hashed, never-rewritten file."""
+    return bool(HASHED_NAME_RE.search(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        ext = posixpath.splitext(name)[1].lower()
+        name = posixpath.join(directory, content_hash(content) + ext)
+        if self.exists(name):
+            # Same bytes already stored; share the file. A writer racing us
+            # to the same name falls back to a suffixed (unhashed) copy.
+            return name
+        return super().save(name, content, max_length=max_length)
@@ -0,0 +1,83 @@
+"""
+Versioned fragment caching.
+
+    {% load fragment_tags %}
+    {% fragment 'product-card' product product.category %}...{% endfragment %}
+
+The cache key is built from the fragment name and the *versions* of the
+values it varies on: a model instance (or catalog snapshot record)
+contributes its pk and updated_at, lists and tuples contribute their items,
+anything else its repr. Every write path bumps updated_at, so an edited
+product gets a new key on its next render while untouched cards keep
+hitting the cache; nothing needs to be deleted, and because versions come
+from the rows themselves the keys agree across worker processes. Stale keys
+simply age out.
+"""
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models
+
+register = template.Library()
+
+# Rendering inside a fragment can mark it uncacheable through this context
+# variable (see image_tags.responsive_image).
+STATE_VAR = 'fragment_state'
+
+
+def fragment_version(value):
+    if hasattr(value, 'cache_version'):
+        # Snapshot records (products.snapshot) version themselves
+        return value.cache_version
+    if isinstance(value, models.Model):
+        updated_at = getattr(value, 'updated_at', None)
+        stamp = updated_at.isoformat() if updated_at else ''
+        return f'{value._meta.label_lower}:{value.pk}:{stamp}'
+    if isinstance(value, (list, tuple, models.QuerySet)):
+        return '[' + ','.join(fragment_version(item) for item in value) + ']'
+    return repr(value)
+
+
+def fragment_key(name, vary_on):
+    digest = hashlib.md5(
+        '|'.join(fragment_version(value) for value in vary_on).encode(), usedforsecurity=False
+    ).hexdigest()
+    return f'fragment:{name}:{digest}'
+
+
+def mark_uncacheable(context):
+    state = context.get(STATE_VAR)
+    if state is not None:
+        state['cacheable'] = False
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        key = fragment_key(name, [value.resolve(context) for value in self.vary_on])
+        cache = caches[getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'default')]
+        content = cache.get(key)
+        if content is None:
+            state = {'cacheable': True}
+            with context.push(**{STATE_VAR: state}):
+                content = self.nodelist.render(context)
+            if state['cacheable']:
+                cache.set(key, content, getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24))
+        return content
+
+
+@register.tag('fragment')
+def do_fragment(parser, token):
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name")
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(nodelist, parser.compile_filter(bits[1]), [parser.compile_filter(bit) for bit in bits[2:]])
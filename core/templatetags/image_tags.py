@@ -0,0 +1,65 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from core.imaging import FORMATS, PRODUCT_WIDTHS, derivative_name
+from core.templatetags.fragment_tags import mark_uncacheable
+
+register = template.Library()
+
+# Derivatives never disappear once written, so only hits are remembered;
+# misses are re-checked until the background render lands.
+_available = set()
+
+
+def _exists(storage, name):
+    if name in _available:
+        return True
+    if storage.exists(name):
+        _available.add(name)
+        return True
+    return False
+
+
+def _srcset(fieldfile, widths, ext):
+    storage = fieldfile.storage
+    candidates = []
+    for width in widths:
+        name = derivative_name(fieldfile.name, width, ext)
+        if _exists(storage, name):
+            candidates.append((storage.url(name), width))
+    return candidates
+
+
+@register.simple_tag(takes_context=True)
+def responsive_image(context, fieldfile, sizes='100vw', widths=None, **attrs):
+    """
+    <picture> for an ImageField value with WebP and JPEG srcsets over its
+    derivatives, e.g. {% responsive_image product.primary_image.image sizes="25vw" alt=product.name class="card-img-top" %}.
+    Extra keyword arguments become <img> attributes.
+    """
+    if not fieldfile:
+        return ''
+    widths = widths or PRODUCT_WIDTHS
+    if isinstance(widths, str):
+        widths = [int(width) for width in widths.split(',')]
+    attrs.setdefault('alt', '')
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    img_attrs = format_html_join('', ' {}="{}"', sorted((key.replace('_', '-'), value) for key, value in attrs.items()))
+
+    sources = {ext: _srcset(fieldfile, widths, ext) for ext in FORMATS}
+    if not sources['jpg']:
+        # Derivatives are still rendering; don't let a fragment cache pin
+        # the full-size fallback.
+        mark_uncacheable(context)
+        return format_html('<img src="{}"{}>', fieldfile.url, img_attrs)
+    webp = ''
+    if sources['webp']:
+        webp = format_html(
+            '<source type="image/webp" srcset="{}" sizes="{}">',
+            ', '.join(f'{url} {width}w' for url, width in sources['webp']), sizes,
+        )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        webp, sources['jpg'][0][0], ', '.join(f'{url} {width}w' for url, width in sources['jpg']), sizes, img_attrs,
+    )
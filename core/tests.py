@@ -1,3 +1,345 @@
-from django.test import TestCase
+import hashlib
+import os
+import tempfile
+from concurrent.futures import Future
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from cart.models import Cart
+from orders import reservations
+from orders.models import Order
+from products import snapshot
+from products.facets import aggregate_cells
+from products.models import CatalogVersion, Category, FacetCount, Product, ProductImage
+from . import imaging
+from .scale_data import generate
+from .middleware import PageCacheMiddleware, page_key
+from .pagination import CursorMismatch, CursorPaginator, InvalidCursor
+from .storage import IMMUTABLE_CACHE_CONTROL, ContentAddressedStorage, is_content_addressed
+from .views import serve_media
+
+
+class CursorPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Rings')
+        # Repeated prices so pages break inside runs of equal sort keys
+        for index in range(11):
+            Product.objects.create(
+                name=f'Ring {index:02d}', category=category, description='', price=Decimal(100 + 10 * (index % 3)),
+                stock_quantity=5, material='gold',
+            )
+        cls.queryset = Product.objects.all()
+
+    def walk(self, ordering):
+        paginator = CursorPaginator(self.queryset, ordering, 4)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return paginator, pages
+
+    def test_next_pages_cover_every_row_once_in_order(self):
+        for ordering in (['price'], ['-price'], ['-created_at'], ['name']):
+            with self.subTest(ordering=ordering):
+                paginator, pages = self.walk(ordering)
+                expected = list(self.queryset.order_by(*ordering, 'pk' if ordering[0][0] != '-' else '-pk'))
+                self.assertEqual([product for page in pages for product in page], expected)
+                self.assertEqual([len(page) for page in pages], [4, 4, 3])
+                self.assertFalse(pages[0].has_previous())
+                self.assertTrue(all(page.has_previous() for page in pages[1:]))
+
+    def test_previous_cursor_returns_the_page_before(self):
+        paginator, pages = self.walk(['price'])
+        for earlier, later in zip(pages, pages[1:]):
+            previous = paginator.page(later.previous_cursor)
+            self.assertEqual(list(previous), list(earlier))
+            self.assertTrue(previous.has_next())
+            self.assertEqual(previous.has_previous(), earlier.has_previous())
+
+    def test_tampered_or_foreign_cursors_are_rejected(self):
+        paginator, pages = self.walk(['price'])
+        with self.assertRaises(InvalidCursor):
+            paginator.page(pages[0].next_cursor + 'x')
+        with self.assertRaises(InvalidCursor):
+            CursorPaginator(self.queryset, ['price', 'name'], 4).page(pages[0].next_cursor)
+        # Same number of values, different ordering
+        with self.assertRaises(CursorMismatch):
+            CursorPaginator(self.queryset, ['name'], 4).page(pages[0].next_cursor)
+        with self.assertRaises(CursorMismatch):
+            CursorPaginator(self.queryset, ['-price'], 4).page(pages[0].next_cursor)
+
+    def test_list_view_links_pages_by_cursor(self):
+        category = Category.objects.get()
+        for index in range(3):
+            Product.objects.create(
+                name=f'Band {index}', category=category, description='', price=90, stock_quantity=5, material='gold',
+            )
+        first = self.client.get('/products/', {'sort': 'price'})
+        page = first.context['page_obj']
+        self.assertTrue(page.is_cursor)
+        self.assertContains(first, 'cursor=')
+        second = self.client.get('/products/', {'sort': 'price', 'cursor': page.next_cursor})
+        listed = list(first.context['products']) + list(second.context['products'])
+        self.assertEqual(listed, list(Product.objects.order_by('effective_price', 'pk')))
+        back = self.client.get('/products/', {'sort': 'price', 'cursor': second.context['page_obj'].previous_cursor})
+        self.assertEqual(list(back.context['products']), list(first.context['products']))
+        self.assertEqual(self.client.get('/products/', {'cursor': 'garbage'}).status_code, 404)
+        # Changing the sort on a later page starts the new ordering from the top
+        newest = self.client.get('/products/', {'sort': '-created_at'}).context['page_obj'].next_cursor
+        for sort in ('price', '-price', 'name'):
+            with self.subTest(sort=sort):
+                cache.clear()
+                top = list(self.client.get('/products/', {'sort': sort}).context['products'])
+                resorted = self.client.get('/products/', {'sort': sort, 'cursor': newest})
+                self.assertFalse(resorted.context['page_obj'].has_previous())
+                self.assertEqual(list(resorted.context['products']), top)
+        # Legacy numbered links keep the offset paginator
+        self.assertFalse(getattr(self.client.get('/products/', {'page': 1}).context['page_obj'], 'is_cursor', False))
+
+
+class ImagingTests(SimpleTestCase):
+    def test_failed_renders_are_logged(self):
+        future = Future()
+        future.set_exception(FileNotFoundError('products/missing.jpg'))
+        with self.assertLogs('core.imaging', 'ERROR') as logs:
+            imaging._log_failure('products/missing.jpg', future)
+        self.assertIn('products/missing.jpg', logs.output[0])
+        done = Future()
+        done.set_result(['derivatives/products/ring-320w.webp'])
+        with self.assertNoLogs('core.imaging'):
+            imaging._log_failure('products/ring.jpg', done)
+
+    def test_children_do_not_inherit_the_pool(self):
+        self.addCleanup(setattr, imaging, '_executor', imaging._executor)
+        imaging._executor = object()
+        imaging._forget_executor()
+        self.assertIsNone(imaging._executor)
+
+
+class RenderCounter:
+    """Counts how often a fragment body actually renders."""
+    calls = 0
+
+    def tick(self):
+        self.calls += 1
+        return ''
+
+
+class FragmentCacheTests(TestCase):
+    template = Template(
+        "{% load fragment_tags %}{% fragment 'card' product product.category %}"
+        "{{ product.name }}/{{ product.category.name }}/{{ product.effective_price }}{{ renders.tick }}"
+        "{% endfragment %}"
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Rings')
+        cls.product = Product.objects.create(
+            name='Gold Ring', category=cls.category, description='', price=300, stock_quantity=5, material='gold',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.renders = RenderCounter()
+
+    def render(self):
+        product = Product.objects.select_related('category').get(pk=self.product.pk)
+        return self.template.render(Context({'product': product, 'renders': self.renders}))
+
+    def test_fragment_is_reused_until_what_it_varies_on_changes(self):
+        self.assertEqual(self.render(), 'Gold Ring/Rings/300.00')
+        self.render()
+        self.assertEqual(self.renders.calls, 1)
+
+        self.product.name = 'Gold Band'
+        self.product.save()
+        self.assertEqual(self.render(), 'Gold Band/Rings/300.00')
+        # Queryset updates bump updated_at as well
+        Product.objects.filter(pk=self.product.pk).apply_discount(10)
+        self.assertEqual(self.render(), 'Gold Band/Rings/270.00')
+        self.category.name = 'Bands'
+        self.category.save()
+        self.assertEqual(self.render(), 'Gold Band/Bands/270.00')
+        self.assertEqual(self.renders.calls, 4)
+
+
+@override_settings(CATALOG_SNAPSHOT_POLL=0)
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rings = Category.objects.create(name='Rings')
+        cls.chains = Category.objects.create(name='Chains')
+        cls.ring = Product.objects.create(
+            name='Gold Ring', category=cls.rings, description='', price=300, stock_quantity=5, material='gold',
+        )
+        cls.chain = Product.objects.create(
+            name='Silver Chain', category=cls.chains, description='', price=80, stock_quantity=5, material='silver',
+        )
+
+    def setUp(self):
+        cache.clear()
+        # Versions restart with every test's rollback
+        snapshot._snapshot = None
+
+    def state(self, path):
+        return self.client.get(path)['X-Page-Cache']
+
+    def test_edits_purge_only_the_pages_showing_them(self):
+        rings, chains = f'/products/category/{self.rings.pk}/', f'/products/category/{self.chains.pk}/'
+        ring_page, chain_page = f'/products/{self.ring.pk}/', f'/products/{self.chain.pk}/'
+        pages = [rings, chains, ring_page, chain_page]
+        self.assertEqual([self.state(path) for path in pages], ['miss'] * 4)
+        self.assertEqual([self.state(path) for path in pages], ['hit'] * 4)
+
+        # A stock change that leaves the chain available touches no page
+        self.chain.stock_quantity = 4
+        self.chain.save(update_fields=['stock_quantity'])
+        self.assertEqual([self.state(path) for path in pages], ['hit'] * 4)
+
+        self.chain.description = 'Fine links'
+        self.chain.save()
+        self.assertEqual([self.state(path) for path in pages], ['hit', 'miss', 'hit', 'miss'])
+
+    def test_detail_pages_show_availability_not_stock_counts(self):
+        path = f'/products/{self.ring.pk}/'
+        self.assertEqual(self.state(path), 'miss')
+        user = get_user_model().objects.create_user('shopper', password='x')
+        with self.captureOnCommitCallbacks(execute=True):
+            reservations.commit(user, {self.ring.pk: 2})
+        response = self.client.get(path)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'In Stock')
+        self.assertNotContains(response, 'In Stock (')
+        self.assertNotContains(response, 'max=')
+
+        # Selling out moves the catalog version and purges the page
+        ring = Product.objects.get(pk=self.ring.pk)
+        ring.stock_quantity = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            ring.save(update_fields=['stock_quantity'])
+        response = self.client.get(path)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'out of stock')
+
+    def test_expired_pages_are_served_stale_while_one_request_revalidates(self):
+        self.assertEqual(self.state('/products/'), 'miss')
+        key = page_key(self.client.get('/products/').wsgi_request)
+        entry = cache.get(key)
+        entry['created'] -= 3600
+        cache.set(key, entry)
+        with mock.patch.object(PageCacheMiddleware, 'revalidate') as revalidate:
+            self.assertEqual(self.state('/products/'), 'stale')
+            self.assertEqual(self.state('/products/'), 'stale')
+        revalidate.assert_called_once()
+
+    def test_personal_requests_bypass_the_cache(self):
+        self.client.cookies['cart'] = 'signed'
+        self.assertIsNone(self.client.get('/products/').get('X-Page-Cache'))
+
+
+class ScaleDataTests(TestCase):
+    SIZE = {'categories': 6, 'products': 150, 'users': 15, 'orders': 80}
+
+    def fingerprint(self):
+        return (
+            sorted(Product.objects.values_list(
+                'name', 'category__name', 'price', 'discount_percentage', 'stock_quantity', 'material', 'is_active',
+            )),
+            sorted(Order.objects.values_list('order_number', 'user__username', 'status', 'total_amount')),
+            sorted(Cart.objects.values_list('user__username', 'item_count', 'subtotal')),
+        )
+
+    def clear(self):
+        Order.objects.all().delete()
+        Cart.objects.all().delete()
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        get_user_model().objects.all().delete()
+
+    def test_same_seed_writes_the_same_store(self):
+        generate(**self.SIZE, seed=7)
+        first = self.fingerprint()
+        self.clear()
+        generate(**self.SIZE, seed=7)
+        self.assertEqual(self.fingerprint(), first)
+        self.clear()
+        generate(**self.SIZE, seed=8)
+        self.assertNotEqual(self.fingerprint(), first)
+
+    def test_derived_tables_are_rebuilt(self):
+        generate(**self.SIZE)
+        self.assertEqual(
+            set(FacetCount.objects.filter(count__gt=0).values_list('category_id', 'material', 'price_band', 'count')),
+            set(aggregate_cells(Product.objects.filter(is_active=True))),
+        )
+        for cart in Cart.objects.prefetch_related('items__product'):
+            self.assertEqual(cart.item_count, sum(item.quantity for item in cart.items.all()))
+
+
+class ContentAddressedMediaTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        override = override_settings(MEDIA_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_identical_content_is_stored_once_under_its_hash(self):
+        storage = ContentAddressedStorage()
+        first = storage.save('products/ring.PNG', ContentFile(b'ring bytes'))
+        second = storage.save('products/other-name.png', ContentFile(b'ring bytes'))
+        self.assertEqual(first, second)
+        self.assertEqual(first, f"products/{hashlib.sha256(b'ring bytes').hexdigest()}.png")
+        self.assertEqual(os.listdir(os.path.join(self.root, 'products')), [os.path.basename(first)])
+        self.assertNotEqual(storage.save('products/ring.jpg', ContentFile(b'other bytes')), first)
+
+    def test_only_hashed_names_are_served_as_immutable(self):
+        storage = ContentAddressedStorage()
+        hashed = storage.save('products/ring.png', ContentFile(b'ring bytes'))
+        FileSystemStorage().save('products/legacy.png', ContentFile(b'legacy bytes'))
+        request = RequestFactory().get('/media/')
+        response = serve_media(request, hashed, document_root=self.root)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        derivative = hashed.replace('.png', '-320w.webp')
+        self.assertTrue(is_content_addressed(derivative))
+        response = serve_media(request, 'products/legacy.png', document_root=self.root)
+        self.assertNotIn('immutable', response.get('Cache-Control', ''))
+
+    @mock.patch('core.management.commands.rehash_media.call_command')
+    def test_rehash_media_is_idempotent_and_publishes_the_new_urls(self, build_derivatives):
+        category = Category.objects.create(name='Rings')
+        product = Product.objects.create(
+            name='Gold Ring', category=category, description='', price=300, stock_quantity=5, material='gold',
+        )
+        legacy = FileSystemStorage().save('products/ring.png', ContentFile(b'ring bytes'))
+        # bulk_create skips the signal that would render derivatives
+        ProductImage.objects.bulk_create([ProductImage(product=product, image=legacy, is_primary=True)])
+        updated_at = Product.objects.get(pk=product.pk).updated_at
+        version = CatalogVersion.current()
+
+        stdout = StringIO()
+        call_command('rehash_media', stdout=stdout)
+        self.assertIn('Renamed 1 files (0 missing)', stdout.getvalue())
+        name = ProductImage.objects.get().image.name
+        self.assertTrue(is_content_addressed(name))
+        self.assertEqual(CatalogVersion.current(), version + 1)
+        self.assertGreater(Product.objects.get(pk=product.pk).updated_at, updated_at)
+        build_derivatives.assert_called_once()
+
+        stdout = StringIO()
+        call_command('rehash_media', stdout=stdout)
+        self.assertIn('Renamed 0 files (0 missing)', stdout.getvalue())
+        self.assertEqual(ProductImage.objects.get().image.name, name)
+        self.assertEqual(CatalogVersion.current(), version + 1)
+        build_derivatives.assert_called_once()
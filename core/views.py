@@ -2,8 +2,11 @@ from django.shortcuts import render
 from django.views.generic import TemplateView, CreateView
 from django.contrib import messages
 from django.urls import reverse_lazy
+from django.views.static import serve
 from .models import Contact
 from .forms import ContactForm
+from .middleware import tag_page
+from .storage import IMMUTABLE_CACHE_CONTROL, is_content_addressed
 
 
 class HomeView(TemplateView):
@@ -12,20 +15,14 @@ class HomeView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Import here to avoid circular imports
-        from products.models import Product, Category
+        from products.snapshot import get_snapshot
         
-        # Get featured products for carousel
-        context['featured_products'] = Product.objects.filter(
-            is_active=True, is_featured=True
-        ).select_related('category').prefetch_related('images')[:8]
-        
-        # Get recent products for carousel
-        context['recent_products'] = Product.objects.filter(
-            is_active=True
-        ).select_related('category').prefetch_related('images').order_by('-created_at')[:8]
-        
-        # Get categories for display
-        context['categories'] = Category.objects.filter(is_active=True)[:6]
+        # Served from this worker's catalog snapshot, no queries
+        catalog = get_snapshot()
+        context['featured_products'] = catalog.featured[:8]
+        context['recent_products'] = catalog.recent[:8]
+        context['categories'] = catalog.categories[:6]
+        tag_page(self.request, 'featured:8', 'recent:8', 'categories')
         
         return context
 
@@ -59,3 +56,11 @@ class TermsView(TemplateView):
 
 class ShippingView(TemplateView):
     template_name = 'core/shipping.html'
+
+
+def serve_media(request, path, document_root=None):
+    """Development media server; hashed uploads are cached for good."""
+    response = serve(request, path, document_root=document_root)
+    if is_content_addressed(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
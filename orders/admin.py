@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderItem
+from .models import Order, OrderItem, StockReservation
 
 
 class OrderItemInline(admin.TabularInline):
@@ -33,3 +33,10 @@ class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['order', 'product', 'quantity', 'price', 'total_price']
     list_filter = ['order__status', 'order__order_date']
     search_fields = ['order__order_number', 'product__name']
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'user', 'quantity', 'expires_at']
+    search_fields = ['product__name', 'user__username']
+    raw_id_fields = ['product', 'user']
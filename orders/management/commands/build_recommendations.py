@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders.models import OrderItem
+from orders.recommendations import TOP_N, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Builds the co-purchase "related products" table from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since-hours', type=float,
+            help='Only rebuild products ordered in the last N hours (default: rebuild everything)',
+        )
+        parser.add_argument('--top', type=int, default=TOP_N, help='Neighbours kept per product')
+
+    def handle(self, *args, **options):
+        product_ids = None
+        if options['since_hours'] is not None:
+            since = timezone.now() - timedelta(hours=options['since_hours'])
+            product_ids = set(
+                OrderItem.objects.filter(order__order_date__gte=since).values_list('product_id', flat=True)
+            )
+            if not product_ids:
+                self.stdout.write('No recent orders')
+                return
+        written = build_recommendations(product_ids, top_n=options['top'])
+        scope = f'{len(product_ids)} products' if product_ids is not None else 'all products'
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} recommendations for {scope}'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders.models import StockReservation
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired stock reservations in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Reservations deleted per statement')
+
+    def handle(self, *args, **options):
+        # Expired holds already stop counting against stock; this only
+        # keeps the table and its index small.
+        now = timezone.now()
+        deleted = 0
+        while True:
+            batch = list(
+                StockReservation.objects.filter(expires_at__lte=now).order_by('expires_at')
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            deleted += StockReservation.objects.filter(pk__in=batch).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired reservations'))
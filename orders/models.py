@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models import Sum
 from django.conf import settings
+from django.utils import timezone
 from products.models import Product
 import uuid
 
@@ -78,3 +80,40 @@ class OrderItem(models.Model):
     @property
     def total_price(self):
         return self.price * self.quantity
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def live(self):
+        return self.filter(expires_at__gt=timezone.now())
+    
+    def held(self, product_ids, exclude_user=None):
+        """{product id: units held by live reservations}."""
+        holds = self.live().filter(product_id__in=product_ids)
+        if exclude_user is not None:
+            holds = holds.exclude(user=exclude_user)
+        return dict(holds.values_list('product_id').annotate(units=Sum('quantity')).order_by())
+
+
+class StockReservation(models.Model):
+    """Units of a product held for a shopper between checkout and payment."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = StockReservationQuerySet.as_manager()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='reservation_user_product_uniq'),
+        ]
+        # Live holds per product are summed from the index alone; the
+        # sweeper walks expires_at.
+        indexes = [
+            models.Index(fields=['product', 'expires_at', 'quantity'], name='reservation_product_live_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.product} held for {self.user}"
@@ -0,0 +1,130 @@
+"""
+Co-purchase recommendations.
+
+Products bought in the same order are counted into a sparse co-occurrence
+matrix (a dict of Counters keyed by product id), and each pair is scored by
+cosine similarity over the orders containing them:
+
+    score(a, b) = orders(a and b) / sqrt(orders(a) * orders(b))
+
+The top neighbours of every product are written to products.RelatedProduct,
+which the product page reads with one indexed lookup. A full build reads
+every order once; an incremental build only recomputes the rows of products
+that appear in recent orders.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+
+from products.models import Product, RelatedProduct
+from products.snapshot import catalog_changed
+from .models import OrderItem
+
+TOP_N = 8
+
+# Very large orders (bulk or wholesale) say little about which items go
+# together and cost O(n^2) pairs, so they are left out.
+MAX_BASKET_SIZE = 50
+
+EXCLUDED_STATUSES = ('cancelled',)
+
+
+def order_items(product_ids=None):
+    items = OrderItem.objects.exclude(order__status__in=EXCLUDED_STATUSES)
+    if product_ids is not None:
+        items = items.filter(
+            order__in=OrderItem.objects.filter(product_id__in=product_ids).values('order_id')
+        )
+    return items
+
+
+def baskets(items):
+    """Yield the set of product ids in each order."""
+    current, basket = None, set()
+    for order_id, product_id in items.order_by('order_id').values_list('order_id', 'product_id').iterator(chunk_size=5000):
+        if order_id != current:
+            if basket:
+                yield basket
+            current, basket = order_id, set()
+        basket.add(product_id)
+    if basket:
+        yield basket
+
+
+def co_occurrence(basket_iter, rows=None):
+    """
+    Sparse co-occurrence matrix and per-product order counts. With ``rows``
+    only those products' rows of the matrix are kept.
+    """
+    matrix = defaultdict(Counter)
+    frequency = Counter()
+    for basket in basket_iter:
+        if len(basket) > MAX_BASKET_SIZE:
+            continue
+        frequency.update(basket)
+        for product_id in basket:
+            if rows is not None and product_id not in rows:
+                continue
+            row = matrix[product_id]
+            for other in basket:
+                if other != product_id:
+                    row[other] += 1
+    return matrix, frequency
+
+
+def order_frequency(product_ids):
+    """
+    Number of (non-excluded) orders containing each product, leaving out
+    baskets over MAX_BASKET_SIZE as co_occurrence() does.
+    """
+    small_orders = (
+        OrderItem.objects.values('order_id').annotate(size=Count('product_id', distinct=True))
+        .filter(size__lte=MAX_BASKET_SIZE).values('order_id')
+    )
+    return Counter(dict(
+        order_items().filter(product_id__in=product_ids, order_id__in=small_orders).values_list('product_id')
+        .annotate(n=Count('order_id', distinct=True)).order_by()
+    ))
+
+
+def top_neighbours(matrix, frequency, active_ids, top_n=TOP_N):
+    for product_id, row in matrix.items():
+        scored = (
+            (count / math.sqrt(frequency[product_id] * frequency[other]), other)
+            for other, count in row.items() if other in active_ids
+        )
+        yield product_id, heapq.nlargest(top_n, scored)
+
+
+def build_recommendations(product_ids=None, top_n=TOP_N):
+    """
+    Rebuild RelatedProduct rows for ``product_ids``, or for every product
+    when None. Returns the number of rows written.
+    """
+    rows = set(product_ids) if product_ids is not None else None
+    matrix, frequency = co_occurrence(baskets(order_items(rows)), rows)
+    if rows is not None:
+        # The restricted read only saw orders containing the given products,
+        # so neighbour frequencies are undercounted; read them exactly.
+        neighbours = set().union(*matrix.values()) | rows
+        frequency = order_frequency(neighbours)
+    active_ids = set(Product.objects.filter(
+        is_active=True, pk__in=set().union(*matrix.values())
+    ).values_list('pk', flat=True)) if matrix else set()
+
+    objs = [
+        RelatedProduct(product_id=product_id, related_id=other, score=score, rank=rank)
+        for product_id, neighbours in top_neighbours(matrix, frequency, active_ids, top_n)
+        for rank, (score, other) in enumerate(neighbours)
+    ]
+    with transaction.atomic():
+        stale = RelatedProduct.objects.all()
+        if rows is not None:
+            stale = stale.filter(product_id__in=rows)
+        stale.delete()
+        RelatedProduct.objects.bulk_create(objs, batch_size=1000)
+        catalog_changed()
+    return len(objs)
@@ -0,0 +1,100 @@
+"""
+Stock reservations.
+
+Entering checkout holds the cart's units for STOCK_HOLD_TTL seconds in
+StockReservation rows, one per shopper and product. A product's available
+stock is its stock_quantity minus the live holds of other shoppers, summed
+from the (product, expires_at, quantity) index. Holds are never released
+eagerly: they lapse when they expire, and expire_reservations deletes the
+dead rows in batches.
+
+Placing the order commits the units with one conditional UPDATE per product
+that only decrements while the stock covers the other shoppers' holds, so
+the final step needs no SELECT ... FOR UPDATE pass over the products.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from products.models import Product
+from products.snapshot import stock_changed
+from .models import StockReservation
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product, available):
+        super().__init__(f'{product.name} is not available in the requested quantity')
+        self.product = product
+        self.available = available
+
+
+def hold_ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_HOLD_TTL', 15 * 60))
+
+
+def available_stock(product_ids, user=None):
+    """{product id: units other shoppers have not reserved}."""
+    held = StockReservation.objects.held(product_ids, exclude_user=user)
+    return {
+        pid: max(stock - held.get(pid, 0), 0)
+        for pid, stock in Product.objects.filter(pk__in=product_ids).values_list('pk', 'stock_quantity')
+    }
+
+
+def reserve(user, quantities):
+    """
+    Hold {product id: quantity} for the user, replacing their earlier holds.
+    Raises InsufficientStock, without holding anything, if a product lacks
+    the units once other shoppers' holds are taken out.
+    """
+    with transaction.atomic():
+        # Locking the products in a fixed order serializes competing
+        # reservations for the same units
+        products = Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').in_bulk()
+        available = available_stock(list(products), user)
+        for pid, quantity in quantities.items():
+            product = products.get(pid)
+            if product is None or not product.is_active or quantity > available.get(pid, 0):
+                raise InsufficientStock(product or Product(pk=pid, name='A product'), available.get(pid, 0))
+        StockReservation.objects.filter(user=user).exclude(product_id__in=quantities).delete()
+        expires_at = timezone.now() + hold_ttl()
+        StockReservation.objects.bulk_create(
+            [StockReservation(user=user, product_id=pid, quantity=quantity, expires_at=expires_at)
+             for pid, quantity in quantities.items()],
+            update_conflicts=True, unique_fields=['user', 'product'], update_fields=['quantity', 'expires_at'],
+        )
+
+
+def commit(user, quantities):
+    """
+    Take {product id: quantity} out of stock for a placed order and drop the
+    user's holds. Must run inside the order's transaction; raises
+    InsufficientStock if a product no longer covers the units, which
+    should roll the order back.
+    """
+    others = Subquery(
+        StockReservation.objects.live().filter(product=OuterRef('pk')).exclude(user=user)
+        .values('product').annotate(units=Sum('quantity')).values('units'),
+        output_field=IntegerField(),
+    )
+    now = timezone.now()
+    for pid, quantity in quantities.items():
+        updated = Product.objects.filter(
+            pk=pid, is_active=True, stock_quantity__gte=Coalesce(others, Value(0)) + quantity
+        ).update(stock_quantity=F('stock_quantity') - quantity, updated_at=now)
+        if not updated:
+            product = Product.objects.filter(pk=pid).first() or Product(pk=pid, name='A product')
+            raise InsufficientStock(product, available_stock([pid], user).get(pid, 0))
+    StockReservation.objects.filter(user=user).delete()
+    # The snapshot and cached pages only show availability, so the catalog
+    # version moves only when one of these products sold out. The rows are
+    # locked by the UPDATEs above, so adding the units back gives the stock
+    # they were taken from.
+    stock_changed({
+        pid: (stock + quantities[pid], stock)
+        for pid, stock in Product.objects.filter(pk__in=quantities).values_list('pk', 'stock_quantity')
+    })
@@ -1,3 +1,175 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import transaction
 from django.test import TestCase
+from django.utils import timezone
+
+from products import snapshot
+from products.models import CatalogVersion, Category, Product, RelatedProduct
+from . import reservations
+from .models import Order, OrderItem, StockReservation
+from .recommendations import build_recommendations
+from .reservations import InsufficientStock
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', password='x')
+        category = Category.objects.create(name='Rings')
+        cls.a, cls.b, cls.c, cls.d = (
+            Product.objects.create(
+                name=f'Ring {name}', category=category, description='', price=100, stock_quantity=5, material='gold',
+            )
+            for name in 'ABCD'
+        )
+        for basket in ([cls.a, cls.b], [cls.a, cls.b], [cls.a, cls.c], [cls.b, cls.d]):
+            cls.order(basket)
+        cls.order([cls.a, cls.d], status='cancelled')
+
+    @classmethod
+    def order(cls, products, status='pending'):
+        order = Order.objects.create(user=cls.user, total_amount=100, shipping_address='Home', status=status)
+        OrderItem.objects.bulk_create(OrderItem(order=order, product=p, quantity=1, price=p.price) for p in products)
+
+    def neighbours(self):
+        return {
+            product.pk: [related.related_id for related in RelatedProduct.objects.filter(product=product)]
+            for product in (self.a, self.b, self.c, self.d)
+        }
+
+    def test_neighbours_are_ranked_by_cosine_similarity(self):
+        build_recommendations()
+        self.assertEqual(self.neighbours(), {
+            self.a.pk: [self.b.pk, self.c.pk],
+            self.b.pk: [self.a.pk, self.d.pk],
+            self.c.pk: [self.a.pk],
+            self.d.pk: [self.b.pk],
+        })
+        # Two of A's three orders include B: 2 / sqrt(3 * 3)
+        self.assertAlmostEqual(RelatedProduct.objects.get(product=self.a, rank=0).score, 2 / 3)
+
+    def test_inactive_products_are_not_recommended(self):
+        Product.objects.filter(pk=self.c.pk).update(is_active=False)
+        build_recommendations()
+        self.assertEqual(self.neighbours()[self.a.pk], [self.b.pk])
+
+    def test_rebuilds_move_the_catalog_version_once(self):
+        build_recommendations()
+        before = CatalogVersion.current()
+        build_recommendations()
+        build_recommendations({self.a.pk})
+        self.assertEqual(CatalogVersion.current(), before + 2)
+
+    def related_rows(self, products):
+        return list(RelatedProduct.objects.filter(product__in=products).values_list(
+            'product_id', 'related_id', 'rank', 'score'
+        ))
+
+    def test_incremental_build_matches_a_full_build(self):
+        build_recommendations()
+        self.order([self.c, self.d])
+        build_recommendations({self.c.pk, self.d.pk})
+        incremental = self.related_rows([self.c, self.d])
+        build_recommendations()
+        self.assertEqual(incremental, self.related_rows([self.c, self.d]))
+
+    @mock.patch('orders.recommendations.MAX_BASKET_SIZE', 3)
+    def test_incremental_build_skips_large_baskets_like_a_full_build(self):
+        self.order([self.a, self.b, self.c, self.d])
+        self.order([self.c, self.d])
+        build_recommendations({self.c.pk, self.d.pk})
+        incremental = self.related_rows([self.c, self.d])
+        build_recommendations()
+        self.assertEqual(incremental, self.related_rows([self.c, self.d]))
+
+
+class ReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = get_user_model().objects.create_user('alice', password='x')
+        cls.bob = get_user_model().objects.create_user('bob', password='x')
+        category = Category.objects.create(name='Rings')
+        cls.last, cls.plenty = (
+            Product.objects.create(
+                name=name, category=category, description='', price=100, stock_quantity=stock, material='gold',
+            )
+            for name, stock in (('Last Ring', 1), ('Gold Band', 5))
+        )
+
+    def setUp(self):
+        # Versions restart with every test's rollback
+        snapshot._snapshot = None
+
+    def stock(self, product):
+        return Product.objects.values_list('stock_quantity', flat=True).get(pk=product.pk)
+
+    def test_competing_holds_on_the_last_unit(self):
+        reservations.reserve(self.alice, {self.last.pk: 1})
+        with self.assertRaises(InsufficientStock) as raised:
+            reservations.reserve(self.bob, {self.last.pk: 1, self.plenty.pk: 1})
+        self.assertEqual(raised.exception.available, 0)
+        # A refused reservation holds nothing at all
+        self.assertFalse(StockReservation.objects.filter(user=self.bob).exists())
+        self.assertEqual(reservations.available_stock([self.last.pk], self.alice), {self.last.pk: 1})
+        with self.assertRaises(InsufficientStock):
+            reservations.commit(self.bob, {self.last.pk: 1})
+        reservations.commit(self.alice, {self.last.pk: 1})
+        self.assertEqual(self.stock(self.last), 0)
+
+    def test_expired_holds_release_their_stock(self):
+        reservations.reserve(self.alice, {self.last.pk: 1})
+        self.assertEqual(reservations.available_stock([self.last.pk], self.bob), {self.last.pk: 0})
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(reservations.available_stock([self.last.pk], self.bob), {self.last.pk: 1})
+        reservations.reserve(self.bob, {self.last.pk: 1})
+        stdout = StringIO()
+        call_command('expire_reservations', stdout=stdout)
+        self.assertIn('Deleted 1 expired reservations', stdout.getvalue())
+        self.assertEqual(list(StockReservation.objects.values_list('user__username', flat=True)), ['bob'])
+
+    def test_a_shortfall_at_commit_rolls_the_order_back(self):
+        reservations.reserve(self.alice, {self.last.pk: 1})
+        with self.assertRaises(InsufficientStock):
+            with transaction.atomic():
+                Order.objects.create(user=self.bob, total_amount=200, shipping_address='Home')
+                # The band is taken out first, then the held ring falls short
+                reservations.commit(self.bob, {self.plenty.pk: 1, self.last.pk: 1})
+        self.assertEqual((self.stock(self.plenty), self.stock(self.last)), (5, 1))
+        self.assertFalse(Order.objects.exists())
+
+    def test_only_selling_out_moves_the_catalog_version(self):
+        CatalogVersion.bump()
+        before = CatalogVersion.current()
+        with self.captureOnCommitCallbacks(execute=True):
+            reservations.commit(self.alice, {self.plenty.pk: 2})
+        self.assertEqual(CatalogVersion.current(), before)
+        with self.captureOnCommitCallbacks(execute=True):
+            reservations.commit(self.alice, {self.last.pk: 1})
+        self.assertEqual(CatalogVersion.current(), before + 1)
+
+    def test_sell_outs_are_seen_without_reading_the_snapshot(self):
+        snapshot.get_snapshot()
+        # Another worker's edit leaves this worker's snapshot stale
+        CatalogVersion.bump()
+        snapshot.expire()
+        before = CatalogVersion.current()
+        with mock.patch.object(snapshot, 'CatalogSnapshot', side_effect=AssertionError('rebuilt in the order')):
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    reservations.commit(self.alice, {self.last.pk: 1})
+                    self.assertEqual(CatalogVersion.current(), before)
+        self.assertEqual(CatalogVersion.current(), before + 1)
 
-# Create your tests here.
+    def test_rolled_back_orders_leave_the_version_alone(self):
+        before = CatalogVersion.current()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    reservations.commit(self.alice, {self.last.pk: 1})
+                    raise RuntimeError('payment capture failed')
+        self.assertEqual((CatalogVersion.current(), self.stock(self.last)), (before, 1))
@@ -10,8 +10,12 @@ from django.db import transaction
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from cart.models import Cart, CartItem
+from cart.services import set_cached_count
+from core.pagination import CursorPaginationMixin
 from products.models import Product
 from .models import Order, OrderItem
+from . import reservations
+from .reservations import InsufficientStock
 from decimal import Decimal
 import json
 import razorpay
@@ -28,14 +32,21 @@ class CheckoutView(LoginRequiredMixin, View):
     def get(self, request):
         try:
             cart, created = Cart.objects.get_or_create(user=request.user)
-            cart_items = cart.items.all().select_related('product', 'product__category').prefetch_related('product__images')
+            cart_items = cart.items.all().select_related('product', 'product__category', 'product__primary_image')
             
             if not cart_items.exists():
                 messages.warning(request, 'Your cart is empty. Add some items before checkout.')
                 return redirect('cart:view')
             
+            # Hold the units while the shopper fills in the form and pays
+            try:
+                reservations.reserve(request.user, {item.product_id: item.quantity for item in cart_items})
+            except InsufficientStock as e:
+                messages.error(request, f'{e} (only {e.available} left). Please update your cart.')
+                return redirect('cart:view')
+            
             # Calculate totals
-            subtotal = sum(item.get_total_price() for item in cart_items)
+            subtotal = sum(item.total_price for item in cart_items)
             tax_rate = Decimal('0.08')  # 8% tax
             tax_amount = subtotal * tax_rate
             shipping = Decimal('0.00')  # Free shipping
@@ -48,6 +59,7 @@ class CheckoutView(LoginRequiredMixin, View):
                 'tax_rate': tax_rate * 100,  # Convert to percentage
                 'shipping': shipping,
                 'total': total,
+                'hold_minutes': int(reservations.hold_ttl().total_seconds() // 60),
             }
             
             return render(request, self.template_name, context)
@@ -62,20 +74,11 @@ class OrderCreateView(LoginRequiredMixin, View):
         try:
             with transaction.atomic():
                 cart, created = Cart.objects.get_or_create(user=request.user)
-                cart_items = cart.items.select_for_update().select_related('product')
+                cart_items = list(cart.items.select_for_update().select_related('product'))
                 
-                if not cart_items.exists():
+                if not cart_items:
                     return JsonResponse({'success': False, 'message': 'Your cart is empty'})
                 
-                # Validate stock availability with database locks
-                for item in cart_items:
-                    product = Product.objects.select_for_update().get(id=item.product.id)
-                    if not product.in_stock or item.quantity > product.stock_quantity:
-                        return JsonResponse({
-                            'success': False, 
-                            'message': f'{product.name} is not available in the requested quantity'
-                        })
-                
                 # Get form data
                 shipping_address = request.POST.get('shipping_address', '').strip()
                 billing_address = request.POST.get('billing_address', '').strip()
@@ -90,7 +93,7 @@ class OrderCreateView(LoginRequiredMixin, View):
                     billing_address = shipping_address  # Use shipping as billing if not provided
                 
                 # Calculate totals
-                subtotal = sum(item.get_total_price() for item in cart_items)
+                subtotal = sum(item.total_price for item in cart_items)
                 tax_rate = Decimal('0.08')
                 tax_amount = subtotal * tax_rate
                 shipping_cost = Decimal('0.00')
@@ -109,24 +112,17 @@ class OrderCreateView(LoginRequiredMixin, View):
                     special_instructions=special_instructions
                 )
                 
-                # Create order items and update stock atomically
-                for item in cart_items:
-                    # Get locked product instance
-                    product = Product.objects.select_for_update().get(id=item.product.id)
-                    
-                    OrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        quantity=item.quantity,
-                        price=product.discounted_price
-                    )
-                    
-                    # Update product stock atomically
-                    product.stock_quantity -= item.quantity
-                    product.save()
+                # Take the reserved units out of stock; a shortfall rolls
+                # the order back
+                reservations.commit(request.user, {item.product_id: item.quantity for item in cart_items})
+                OrderItem.objects.bulk_create([
+                    OrderItem(order=order, product=item.product, quantity=item.quantity, price=item.product.effective_price)
+                    for item in cart_items
+                ])
                 
                 # Clear cart
-                cart.items.all().delete()
+                cart.clear()
+                set_cached_count(request.user.pk, 0)
                 
                 # DEMO ONLY: Mark as paid for demonstration purposes
                 # In production, integrate with Stripe/PayPal and verify payment
@@ -141,6 +137,8 @@ class OrderCreateView(LoginRequiredMixin, View):
                     'redirect_url': f'/orders/confirmation/{order.id}/'
                 })
                 
+        except InsufficientStock as e:
+            return JsonResponse({'success': False, 'message': str(e)})
         except Exception as e:
             return JsonResponse({'success': False, 'message': 'An error occurred while processing your order'})
 
@@ -153,7 +151,7 @@ class OrderSuccessView(LoginRequiredMixin, DetailView):
     
     def get_queryset(self):
         return Order.objects.filter(user=self.request.user).prefetch_related(
-            'items__product__images', 'items__product__category'
+            'items__product__primary_image', 'items__product__category'
         )
 
 
@@ -178,8 +176,14 @@ class CreateRazorpayOrderView(LoginRequiredMixin, View):
             if not shipping_address:
                 return JsonResponse({'error': 'Shipping address is required'}, status=400)
             
+            # Hold the units until the payment comes back
+            try:
+                reservations.reserve(request.user, {item.product_id: item.quantity for item in cart_items})
+            except InsufficientStock as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            
             # Calculate order total
-            subtotal = sum(item.get_total_price() for item in cart_items)
+            subtotal = sum(item.total_price for item in cart_items)
             tax_rate = Decimal('0.08')  # 8% tax
             tax_amount = subtotal * tax_rate
             total = subtotal + tax_amount
@@ -285,28 +289,22 @@ class RazorpayPaymentHandlerView(View):
                 with transaction.atomic():
                     cart, created = Cart.objects.get_or_create(user=request.user)
                     
-                    # Calculate totals and validate products
+                    # Calculate totals
                     subtotal = Decimal('0')
                     cart_items = []
+                    products = Product.objects.in_bulk([item['product_id'] for item in pending_order['cart_items']])
                     
                     for item_data in pending_order['cart_items']:
-                        try:
-                            product = Product.objects.select_for_update().get(id=item_data['product_id'])
-                            quantity = item_data['quantity']
-                            
-                            if not product.in_stock or quantity > product.stock_quantity:
-                                return JsonResponse({'error': f'{product.name} is out of stock'}, status=400)
-                            
-                            cart_items.append({
-                                'product': product,
-                                'quantity': quantity,
-                                'price': product.discounted_price
-                            })
-                            
-                            subtotal += product.discounted_price * quantity
-                            
-                        except Product.DoesNotExist:
+                        product = products.get(item_data['product_id'])
+                        if product is None:
                             return JsonResponse({'error': f'Product not found'}, status=400)
+                        quantity = item_data['quantity']
+                        cart_items.append({
+                            'product': product,
+                            'quantity': quantity,
+                            'price': product.effective_price
+                        })
+                        subtotal += product.effective_price * quantity
                     
                     tax_rate = Decimal('0.08')
                     tax_amount = subtotal * tax_rate
@@ -319,6 +317,15 @@ class RazorpayPaymentHandlerView(View):
                             'error': f'Payment amount mismatch. Expected: ₹{total}, Paid: ₹{paid_amount}'
                         }, status=400)
                     
+                    # Take the reserved units out of stock before capturing
+                    try:
+                        reservations.commit(
+                            request.user, {item['product'].pk: item['quantity'] for item in cart_items}
+                        )
+                    except InsufficientStock as e:
+                        transaction.set_rollback(True)
+                        return JsonResponse({'error': str(e)}, status=400)
+                    
                     # Manually capture the payment after stock validation
                     try:
                         capture_result = razorpay_client.payment.capture(
@@ -326,8 +333,10 @@ class RazorpayPaymentHandlerView(View):
                             paid_amount_paise
                         )
                         if capture_result.get('status') != 'captured':
+                            transaction.set_rollback(True)
                             return JsonResponse({'error': 'Payment capture failed'}, status=400)
                     except Exception as capture_error:
+                        transaction.set_rollback(True)
                         return JsonResponse({
                             'error': f'Payment capture failed: {str(capture_error)}'
                         }, status=400)
@@ -351,21 +360,14 @@ class RazorpayPaymentHandlerView(View):
                         razorpay_amount_paid=paid_amount
                     )
                     
-                    # Create order items and update stock
-                    for item in cart_items:
-                        OrderItem.objects.create(
-                            order=order,
-                            product=item['product'],
-                            quantity=item['quantity'],
-                            price=item['price']
-                        )
-                        
-                        # Update product stock
-                        item['product'].stock_quantity -= item['quantity']
-                        item['product'].save()
+                    OrderItem.objects.bulk_create([
+                        OrderItem(order=order, product=item['product'], quantity=item['quantity'], price=item['price'])
+                        for item in cart_items
+                    ])
                     
                     # Clear cart
-                    cart.items.all().delete()
+                    cart.clear()
+                    set_cached_count(request.user.pk, 0)
                     
                     # Clear session
                     if 'pending_order' in request.session:
@@ -388,7 +390,7 @@ class RazorpayPaymentHandlerView(View):
     
 
 
-class OrderHistoryView(LoginRequiredMixin, ListView):
+class OrderHistoryView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     model = Order
     template_name = 'orders/order_history.html'
     context_object_name = 'orders'
@@ -397,7 +399,7 @@ class OrderHistoryView(LoginRequiredMixin, ListView):
     
     def get_queryset(self):
         return Order.objects.filter(user=self.request.user).prefetch_related(
-            'items__product__images'
+            'items__product__primary_image'
         )
 
 
@@ -409,6 +411,6 @@ class OrderDetailView(LoginRequiredMixin, DetailView):
     
     def get_queryset(self):
         return Order.objects.filter(user=self.request.user).prefetch_related(
-            'items__product__images', 'items__product__category'
+            'items__product__primary_image', 'items__product__category'
         )
 
@@ -57,6 +57,8 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'cart.middleware.CartCookieMiddleware',
+    'core.middleware.PageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -73,6 +75,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'cart.context_processors.cart',
             ],
         },
     },
@@ -142,6 +145,59 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads are named by content hash, so their URLs never change meaning and
+# are served with an immutable Cache-Control (see core.views.serve_media;
+# a front-end server should send the same header for hashed names).
+STORAGES = {
+    'default': {'BACKEND': 'core.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Worker processes that render resized WebP/JPEG copies of uploaded images
+IMAGE_DERIVATIVE_WORKERS = int(os.environ.get('IMAGE_DERIVATIVE_WORKERS', 2))
+
+# Catalog and order listings page with keyset cursors instead of
+# COUNT(*) + OFFSET; set to False to restore numbered pages.
+CURSOR_PAGINATION = True
+
+# Product card and category fragments are keyed by row versions, so the
+# timeout only bounds how long superseded entries linger.
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Seconds a worker serves its in-process catalog snapshot before checking
+# the catalog version again. An edit reaches every worker within this delay
+# plus the time a background rebuild takes.
+CATALOG_SNAPSHOT_POLL = 5
+
+# Anonymous catalog pages are served from cache for PAGE_CACHE_TTL seconds,
+# then served stale for up to PAGE_CACHE_STALE more while one request
+# re-renders them in the background. Catalog edits purge them regardless.
+PAGE_CACHE_TTL = 60
+PAGE_CACHE_STALE = 600
+
+# Searches finding fewer products than this are retried with misspelled
+# words replaced by their closest catalog word ("did you mean").
+SEARCH_FUZZY_MIN_RESULTS = 3
+
+# Seconds the autocomplete ranking (units sold per product) is reused
+# before the index is rebuilt with fresh sales figures.
+AUTOCOMPLETE_POPULARITY_TTL = 60 * 60
+
+# Cache alias for signed-in shoppers' navbar cart counts. It must be shared
+# by every worker (Redis, Memcached); with a process-local backend such as
+# the default LocMemCache the badge reads the cart's stored count instead.
+CART_COUNT_CACHE_ALIAS = 'default'
+
+# Where anonymous carts are kept: 'session', or 'cookie' for a signed,
+# size-bounded cookie that spares the session table a write per click.
+# Cookie carts expire after CART_COOKIE_AGE seconds.
+CART_STORAGE = 'session'
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+
+# Seconds checkout holds a cart's units for the shopper. Expired holds stop
+# counting at once; expire_reservations deletes their rows.
+STOCK_HOLD_TTL = 15 * 60
+
 # Crispy forms configuration
 CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
@@ -17,17 +17,17 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'price', 'discounted_price', 'stock_quantity', 'is_featured', 'is_active']
+    list_display = ['name', 'category', 'price', 'effective_price', 'stock_quantity', 'is_featured', 'is_active']
     list_filter = ['category', 'material', 'is_featured', 'is_active', 'created_at']
-    search_fields = ['name', 'description']
+    search_fields = ['name', 'sku', 'description']
     inlines = [ProductImageInline]
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['effective_price', 'created_at', 'updated_at']
     fieldsets = (
         ('Basic Information', {
-            'fields': ('name', 'category', 'description', 'material')
+            'fields': ('name', 'sku', 'category', 'description', 'material')
         }),
         ('Pricing & Stock', {
-            'fields': ('price', 'discount_percentage', 'stock_quantity')
+            'fields': ('price', 'discount_percentage', 'effective_price', 'stock_quantity')
         }),
         ('Product Details', {
             'fields': ('size', 'weight')
@@ -0,0 +1,283 @@
+"""
+Read-only JSON catalog API.
+
+Responses are built from values() rows, never model instances, and only
+the columns behind the requested ``fields=`` are selected. Every response
+carries a strong ETag and Last-Modified derived from Product.updated_at
+(through the catalog snapshot for collections), so a conditional GET is
+answered with a 304 before any rows are read.
+"""
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
+
+from core.pagination import CursorMismatch, CursorPaginator, InvalidCursor
+from .autocomplete import MAX_SUGGESTIONS, suggest
+from .models import Product, ProductImage
+from .search import spelling_correction
+from .snapshot import get_snapshot
+from .views import SORT_OPTIONS, filter_products
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+MAX_SEARCH_RESULTS = 50
+
+
+def _image_url(name, catalog):
+    return ProductImage._meta.get_field('image').storage.url(name) if name else None
+
+
+def _product_url(pk, catalog):
+    return reverse('products:detail', kwargs={'pk': pk})
+
+
+def _category_name(category_id, catalog):
+    category = catalog.category(category_id)
+    return category and category.name
+
+
+# Public field name -> (values() lookup, optional transform)
+PRODUCT_FIELDS = {
+    'id': ('id', None),
+    'name': ('name', None),
+    'url': ('id', _product_url),
+    'description': ('description', None),
+    'category': ('category_id', None),
+    # Names come from the snapshot rather than a join on category
+    'category_name': ('category_id', _category_name),
+    'price': ('price', None),
+    'discount_percentage': ('discount_percentage', None),
+    'effective_price': ('effective_price', None),
+    'stock_quantity': ('stock_quantity', None),
+    'in_stock': ('stock_quantity', lambda quantity, catalog: quantity > 0),
+    'material': ('material', None),
+    'size': ('size', None),
+    'weight': ('weight', None),
+    'is_featured': ('is_featured', None),
+    'image': ('primary_image__image', _image_url),
+    'image_count': ('image_count', None),
+    'created_at': ('created_at', None),
+    'updated_at': ('updated_at', None),
+}
+DEFAULT_PRODUCT_FIELDS = (
+    'id', 'name', 'url', 'category', 'category_name', 'price', 'effective_price', 'discount_percentage',
+    'in_stock', 'material', 'image', 'updated_at',
+)
+
+CATEGORY_FIELDS = ('id', 'name', 'description', 'product_count', 'updated_at')
+
+
+class BadRequest(Exception):
+    pass
+
+
+def requested_fields(request, available, default):
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(default)
+    fields = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise BadRequest(f"Unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def check_filters(request):
+    """Reject filter parameters filter_products() cannot apply."""
+    category = request.GET.get('category')
+    if category and not category.isdigit():
+        raise BadRequest('category must be a category id')
+    for name in ('min_price', 'max_price'):
+        value = request.GET.get(name)
+        if not value:
+            continue
+        try:
+            if Decimal(value).is_finite():
+                continue
+        except InvalidOperation:
+            pass
+        raise BadRequest(f'{name} must be a number')
+
+
+def product_rows(queryset, fields, extra=()):
+    """values() rows for ``fields`` plus any ``extra`` lookups (e.g. sort keys)."""
+    lookups = dict.fromkeys([PRODUCT_FIELDS[name][0] for name in fields] + list(extra))
+    return queryset.values(*lookups)
+
+
+def serialize_product(row, fields, catalog):
+    data = {}
+    for name in fields:
+        lookup, transform = PRODUCT_FIELDS[name]
+        value = row[lookup]
+        data[name] = transform(value, catalog) if transform else value
+    return data
+
+
+def page_url(request, cursor):
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f'{request.path}?{params.urlencode()}'
+
+
+def error_response(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+# Conditional GET support. Collections are versioned by the catalog
+# snapshot, whose version moves with every catalog write; the query string
+# is part of the tag because it selects the representation. Exact stock
+# levels change with every order without moving the version, so responses
+# that include them are not versioned.
+
+def _catalog_versioned(request):
+    return 'stock_quantity' not in {name.strip() for name in request.GET.get('fields', '').split(',')}
+
+
+def catalog_etag(request, *args, **kwargs):
+    if not _catalog_versioned(request):
+        return None
+    catalog = get_snapshot()
+    raw = f'{catalog.version}:{request.get_full_path()}'
+    return hashlib.sha1(raw.encode(), usedforsecurity=False).hexdigest()
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    if not _catalog_versioned(request):
+        return None
+    return get_snapshot().last_modified
+
+
+def _product_stamp(request, pk):
+    if not hasattr(request, '_product_stamp'):
+        request._product_stamp = Product.objects.filter(pk=pk, is_active=True).values_list(
+            'updated_at', flat=True
+        ).first()
+    return request._product_stamp
+
+
+def product_etag(request, pk):
+    updated_at = _product_stamp(request, pk)
+    if updated_at is None:
+        return None
+    raw = f'{pk}:{updated_at.isoformat()}:{request.GET.urlencode()}'
+    return hashlib.sha1(raw.encode(), usedforsecurity=False).hexdigest()
+
+
+def product_last_modified(request, pk):
+    return _product_stamp(request, pk)
+
+
+@method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified), name='get')
+class ProductListAPIView(View):
+    def get(self, request):
+        try:
+            fields = requested_fields(request, PRODUCT_FIELDS, DEFAULT_PRODUCT_FIELDS)
+            per_page = min(int(request.GET.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+            check_filters(request)
+        except (BadRequest, ValueError) as e:
+            return error_response(str(e))
+        if per_page < 1:
+            return error_response('limit must be positive')
+
+        params = request.GET.copy()
+        # Relevance order has no keyset; free-text queries use the search endpoint
+        params.pop('search', None)
+        if params.get('sort') not in SORT_OPTIONS:
+            params['sort'] = '-created_at'
+        queryset = filter_products(Product.objects.filter(is_active=True), params)
+
+        ordering = [SORT_OPTIONS[params['sort']]]
+        paginator = CursorPaginator(
+            product_rows(queryset, fields, [name.lstrip('-') for name in ordering] + ['id']), ordering, per_page
+        )
+        try:
+            page = paginator.page(request.GET.get('cursor'))
+        except CursorMismatch:
+            return error_response('cursor was issued for a different sort; start again without it')
+        except InvalidCursor as e:
+            return error_response(str(e))
+
+        catalog = get_snapshot()
+        return JsonResponse({
+            'results': [serialize_product(row, fields, catalog) for row in page],
+            'next': page.next_cursor and page_url(request, page.next_cursor),
+            'previous': page.previous_cursor and page_url(request, page.previous_cursor),
+        })
+
+
+@method_decorator(condition(etag_func=product_etag, last_modified_func=product_last_modified), name='get')
+class ProductDetailAPIView(View):
+    def get(self, request, pk):
+        try:
+            fields = requested_fields(request, PRODUCT_FIELDS, PRODUCT_FIELDS)
+        except BadRequest as e:
+            return error_response(str(e))
+        row = product_rows(Product.objects.filter(pk=pk, is_active=True), fields).first()
+        if row is None:
+            raise Http404('No product found matching the query')
+        return JsonResponse(serialize_product(row, fields, get_snapshot()))
+
+
+@method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified), name='get')
+class CategoryListAPIView(View):
+    def get(self, request):
+        try:
+            fields = requested_fields(request, CATEGORY_FIELDS, CATEGORY_FIELDS)
+        except BadRequest as e:
+            return error_response(str(e))
+        # Active categories and their product counts are already in the snapshot
+        return JsonResponse({
+            'results': [
+                {name: getattr(category, name) for name in fields}
+                for category in get_snapshot().categories
+            ],
+        })
+
+
+@method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified), name='get')
+class SearchAPIView(View):
+    def get(self, request):
+        try:
+            fields = requested_fields(request, PRODUCT_FIELDS, DEFAULT_PRODUCT_FIELDS)
+            limit = min(int(request.GET.get('limit', PAGE_SIZE)), MAX_SEARCH_RESULTS)
+            check_filters(request)
+        except (BadRequest, ValueError) as e:
+            return error_response(str(e))
+        query = request.GET.get('q', '').strip()
+        if not query:
+            return JsonResponse({'query': '', 'results': []})
+
+        corrected = None
+        if not request.GET.get('exact'):
+            corrected = spelling_correction(Product.objects.filter(is_active=True), query)
+        params = request.GET.copy()
+        params['search'] = corrected or query
+        queryset = filter_products(Product.objects.filter(is_active=True), params)
+        catalog = get_snapshot()
+        return JsonResponse({
+            'query': query,
+            'corrected_query': corrected,
+            'results': [
+                serialize_product(row, fields, catalog)
+                for row in product_rows(queryset, fields)[:max(limit, 0)]
+            ],
+        })
+
+
+class AutocompleteAPIView(View):
+    def get(self, request):
+        try:
+            limit = min(int(request.GET.get('limit', MAX_SUGGESTIONS)), MAX_SUGGESTIONS)
+        except ValueError as e:
+            return error_response(str(e))
+        query = request.GET.get('q', '')
+        return JsonResponse({
+            'query': query,
+            'suggestions': [suggestion.as_dict() for suggestion in suggest(query, max(limit, 0))],
+        })
@@ -0,0 +1,183 @@
+"""
+In-memory typeahead index.
+
+Product names, category names and material labels are indexed as a sorted
+array of normalized keys, one per word position, so "ban" finds "Gold
+Bangles" as well as "Bangles". A prefix lookup is a bisect to the first
+candidate key followed by a scan of the matching run. Suggestions are
+ranked by popularity: units sold for products, and the summed popularity of
+their products for categories and materials.
+
+The answers for very short prefixes, whose runs cover much of the index,
+are computed once at build time. The index is derived from the worker's
+catalog snapshot, so lookups never touch the database. It is rebuilt on a
+background thread when the snapshot's version moves or the popularity
+ranking, an aggregate over every order line, is older than
+AUTOCOMPLETE_POPULARITY_TTL; lookups keep using the previous index until
+the new one is ready.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Sum
+from django.urls import reverse
+
+from .search import tokenize
+from .snapshot import ProductRecord, get_snapshot
+
+MAX_SUGGESTIONS = 8
+
+# Prefixes up to this length are answered from a precomputed table
+SHORT_PREFIX = 2
+
+
+def normalize(text):
+    return ' '.join(tokenize(text))
+
+
+def popularity():
+    """Units sold per product id."""
+    from orders.recommendations import order_items
+    return Counter(dict(
+        order_items().values_list('product_id').annotate(units=Sum('quantity')).order_by()
+    ))
+
+
+class Suggestion:
+    __slots__ = ('kind', 'label', 'url', 'weight')
+
+    def __init__(self, kind, label, url, weight):
+        self.kind = kind
+        self.label = label
+        self.url = url
+        self.weight = weight
+
+    def as_dict(self):
+        return {'type': self.kind, 'label': self.label, 'url': self.url}
+
+
+class PrefixIndex:
+    def __init__(self, suggestions):
+        self.suggestions = suggestions
+        entries = []
+        for position, suggestion in enumerate(suggestions):
+            words = normalize(suggestion.label).split()
+            for start in range(len(words)):
+                entries.append((' '.join(words[start:]), position))
+        entries.sort()
+        self.keys = [key for key, position in entries]
+        self.positions = [position for key, position in entries]
+
+        short = {}
+        for key, position in entries:
+            for length in range(1, min(SHORT_PREFIX, len(key)) + 1):
+                short.setdefault(key[:length], set()).add(position)
+        self.short = {prefix: self.rank(positions) for prefix, positions in short.items()}
+
+    def rank(self, positions, limit=MAX_SUGGESTIONS):
+        return heapq.nsmallest(
+            limit, positions, key=lambda position: (-self.suggestions[position].weight, position)
+        )
+
+    def lookup(self, query, limit=MAX_SUGGESTIONS):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        if len(prefix) <= SHORT_PREFIX and limit <= MAX_SUGGESTIONS:
+            positions = self.short.get(prefix, [])[:limit]
+        else:
+            matches = set()
+            index = bisect_left(self.keys, prefix)
+            while index < len(self.keys) and self.keys[index].startswith(prefix):
+                matches.add(self.positions[index])
+                index += 1
+            positions = self.rank(matches, limit)
+        return [self.suggestions[position] for position in positions]
+
+
+def build_index(catalog):
+    sold = cached_popularity()
+    category_weight = Counter()
+    material_weight = Counter()
+    suggestions = []
+    for product in catalog.products.values():
+        weight = sold[product.id] + 1
+        category_weight[product.category.id] += weight
+        material_weight[product.material] += weight
+        suggestions.append(Suggestion('product', product.name, product.get_absolute_url(), weight))
+    for category in catalog.categories:
+        suggestions.append(Suggestion(
+            'category', category.name,
+            reverse('products:by_category', kwargs={'category_id': category.id}), category_weight[category.id],
+        ))
+    list_url = reverse('products:list')
+    for material, weight in material_weight.items():
+        label = ProductRecord.material_labels.get(material, material)
+        suggestions.append(Suggestion('material', label, f'{list_url}?material={material}', weight))
+    return PrefixIndex(suggestions)
+
+
+_popularity = None
+_popularity_at = 0.0
+
+_index = None
+_version = None
+_building = False
+_lock = threading.Lock()
+
+
+def _popularity_ttl():
+    return getattr(settings, 'AUTOCOMPLETE_POPULARITY_TTL', 60 * 60)
+
+
+def _popularity_expired():
+    return time.monotonic() - _popularity_at >= _popularity_ttl()
+
+
+def cached_popularity():
+    """popularity(), recomputed at most once per AUTOCOMPLETE_POPULARITY_TTL seconds."""
+    global _popularity, _popularity_at
+    if _popularity is None or _popularity_expired():
+        _popularity = popularity()
+        _popularity_at = time.monotonic()
+    return _popularity
+
+
+def _build_in_background(catalog):
+    global _index, _version, _building
+    try:
+        index = build_index(catalog)
+        with _lock:
+            _index, _version = index, catalog.version
+    finally:
+        with _lock:
+            _building = False
+        connections.close_all()
+
+
+def get_index():
+    """This worker's index; a new snapshot or an expired ranking starts a rebuild."""
+    global _index, _version, _building
+    catalog = get_snapshot()
+    if _index is not None and _version == catalog.version and not _popularity_expired():
+        return _index
+    with _lock:
+        if _index is None or connection.in_atomic_block:
+            # Nothing to serve yet, or a transaction reading its own writes
+            _index = build_index(catalog)
+            _version = catalog.version
+        elif not _building:
+            _building = True
+            threading.Thread(
+                target=_build_in_background, args=(catalog,), name='autocomplete-index', daemon=True
+            ).start()
+        return _index
+
+
+def suggest(query, limit=MAX_SUGGESTIONS):
+    return get_index().lookup(query, limit)
@@ -0,0 +1,204 @@
+"""
+Precomputed facet counts for the product list sidebar.
+
+Active products are counted into FacetCount cells keyed by (category,
+material, price band). The handlers in products.signals move a product
+between cells as it is saved or deleted, so the sidebar can show
+"Gold (124)" style counts for the current filters from a single read of
+the (small) cell table instead of one aggregate per facet.
+"""
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Value, When
+
+from .models import FacetCount, Product
+
+# Half-open [low, high) bands over the effective (discounted) price. Prices
+# carry two decimals so a band can be requested exactly as
+# min_price=low, max_price=high - 0.01.
+PRICE_BANDS = [
+    (Decimal('0'), Decimal('100')),
+    (Decimal('100'), Decimal('250')),
+    (Decimal('250'), Decimal('500')),
+    (Decimal('500'), Decimal('1000')),
+    (Decimal('1000'), None),
+]
+
+PRICE_STEP = Decimal('0.01')
+
+FACET_FIELDS = {'is_active', 'category_id', 'material', 'effective_price'}
+
+
+def price_band_for(price):
+    for band, (low, high) in enumerate(PRICE_BANDS):
+        if high is None or price < high:
+            return band
+    return len(PRICE_BANDS) - 1
+
+
+def price_band_expression(field='effective_price'):
+    return Case(
+        *[When(**{f'{field}__lt': high}, then=Value(band))
+          for band, (low, high) in enumerate(PRICE_BANDS) if high is not None],
+        default=Value(len(PRICE_BANDS) - 1),
+    )
+
+
+def facet_key(product):
+    if not product.is_active:
+        return None
+    return (product.category_id, product.material, price_band_for(Decimal(product.effective_price)))
+
+
+def stored_key(pk):
+    """The cell the stored row for ``pk`` is counted in, read from the database."""
+    row = Product.objects.filter(pk=pk).values_list('is_active', 'category_id', 'material', 'effective_price').first()
+    if row is None or not row[0]:
+        return None
+    _, category_id, material, effective_price = row
+    return (category_id, material, price_band_for(Decimal(effective_price)))
+
+
+def _adjust(key, delta):
+    if key is None:
+        return
+    category_id, material, band = key
+    cells = FacetCount.objects.filter(category_id=category_id, material=material, price_band=band)
+    if cells.update(count=F('count') + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            FacetCount.objects.create(category_id=category_id, material=material, price_band=band, count=delta)
+    except IntegrityError:
+        # Another writer created the cell first
+        cells.update(count=F('count') + delta)
+
+
+def move(old_key, new_key):
+    if old_key == new_key:
+        return
+    with transaction.atomic():
+        _adjust(old_key, -1)
+        _adjust(new_key, 1)
+
+
+def aggregate_cells(queryset):
+    return queryset.order_by().annotate(
+        price_band=price_band_expression()
+    ).values_list('category_id', 'material', 'price_band').annotate(n=Count('id'))
+
+
+def rebuild(category_ids=None):
+    """Recount every cell, or only the cells of ``category_ids``."""
+    cells = FacetCount.objects.all()
+    products = Product.objects.filter(is_active=True)
+    if category_ids is not None:
+        cells = cells.filter(category_id__in=category_ids)
+        products = products.filter(category_id__in=category_ids)
+    with transaction.atomic():
+        cells.delete()
+        FacetCount.objects.bulk_create(
+            FacetCount(category_id=category_id, material=material, price_band=band, count=n)
+            for category_id, material, band, n in aggregate_cells(products)
+        )
+
+
+def _to_decimal(value):
+    try:
+        return Decimal(value) if value not in (None, '') else None
+    except InvalidOperation:
+        return None
+
+
+def parse_filters(params):
+    category = params.get('category')
+    material = params.get('material')
+    return {
+        'category': int(category) if category and category.isdigit() else None,
+        'material': material if material in dict(Product.MATERIAL_CHOICES) else None,
+        'min_price': _to_decimal(params.get('min_price')),
+        'max_price': _to_decimal(params.get('max_price')),
+    }
+
+
+def bands_for_range(min_price, max_price):
+    """Bands exactly covered by the price range, or None if it cuts through one."""
+    lows = [low for low, high in PRICE_BANDS]
+    highs = [high - PRICE_STEP if high is not None else None for low, high in PRICE_BANDS]
+    if min_price is not None and min_price not in lows:
+        return None
+    if max_price is not None and max_price not in highs:
+        return None
+    first = lows.index(min_price) if min_price is not None else 0
+    last = highs.index(max_price) if max_price is not None else len(PRICE_BANDS) - 1
+    return set(range(first, last + 1))
+
+
+def facet_counts(params, queryset=None):
+    """
+    Count active products per category, material and price band under the
+    filters in ``params``. Each facet ignores its own filter so every value
+    shows what selecting it would return.
+
+    ``queryset`` restricts counting to a subset the cells cannot represent,
+    such as search results; it must not have the facet filters applied.
+    """
+    filters = parse_filters(params)
+    bands = bands_for_range(filters['min_price'], filters['max_price'])
+    if queryset is None and bands is not None:
+        cells = FacetCount.objects.filter(count__gt=0).values_list('category_id', 'material', 'price_band', 'count')
+    else:
+        if queryset is None:
+            queryset = Product.objects.filter(is_active=True)
+        if bands is None:
+            # An arbitrary range cannot be answered from the bands
+            if filters['min_price'] is not None:
+                queryset = queryset.filter(effective_price__gte=filters['min_price'])
+            if filters['max_price'] is not None:
+                queryset = queryset.filter(effective_price__lte=filters['max_price'])
+            bands = set(range(len(PRICE_BANDS)))
+        cells = aggregate_cells(queryset)
+
+    categories, materials, price_bands = Counter(), Counter(), Counter()
+    for category_id, material, band, n in cells:
+        in_category = filters['category'] in (None, category_id)
+        in_material = filters['material'] in (None, material)
+        in_band = band in bands
+        if in_material and in_band:
+            categories[category_id] += n
+        if in_category and in_band:
+            materials[material] += n
+        if in_category and in_material:
+            price_bands[band] += n
+    return {'categories': categories, 'materials': materials, 'price_bands': price_bands}
+
+
+def price_band_label(low, high):
+    if low == 0:
+        return f'Under ${high}'
+    if high is None:
+        return f'${low} & above'
+    return f'${low} - ${high}'
+
+
+def facet_context(params, categories, queryset=None):
+    """Template-ready facet lists for the product list sidebar."""
+    counts = facet_counts(params, queryset)
+    filters = parse_filters(params)
+    price_bands = []
+    for band, (low, high) in enumerate(PRICE_BANDS):
+        max_price = high - PRICE_STEP if high is not None else None
+        price_bands.append({
+            'label': price_band_label(low, high),
+            'min_price': low,
+            'max_price': max_price,
+            'count': counts['price_bands'][band],
+            'selected': filters['min_price'] == low and filters['max_price'] == max_price,
+        })
+    return {
+        'category_facets': [(category, counts['categories'][category.id]) for category in categories],
+        'material_facets': [(value, label, counts['materials'][value]) for value, label in Product.MATERIAL_CHOICES],
+        'price_band_facets': price_bands,
+    }
@@ -0,0 +1,338 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.imaging import PRODUCT_WIDTHS, schedule_derivatives
+from products import facets, search
+from products.models import Category, Product, ProductImage
+from products.snapshot import catalog_changed
+
+BATCH_SIZE = 1000
+IMAGE_WORKERS = 8
+
+# Batches written between catalog version bumps; each bump makes every
+# worker rebuild its catalog snapshot.
+BATCHES_PER_VERSION = 10
+
+
+def to_decimal(value):
+    # JSON Lines numbers arrive as floats; their shortest repr is the
+    # literal in the feed, whereas Decimal(float) carries binary noise
+    # that would never compare equal to the stored price.
+    return Decimal(str(value))
+
+
+# Optional product columns and how to parse them; sku, name, category and
+# price are required on every row.
+OPTIONAL_COLUMNS = {
+    'description': str,
+    'discount_percentage': to_decimal,
+    'stock_quantity': int,
+    'material': str,
+    'size': str,
+    'weight': str,
+    'is_featured': lambda value: str(value).strip().lower() in ('1', 'true', 'yes', 'y'),
+    'is_active': lambda value: str(value).strip().lower() in ('1', 'true', 'yes', 'y'),
+}
+
+MATERIALS = {value for value, label in Product.MATERIAL_CHOICES}
+NUMERIC_COLUMNS = ('price', 'discount_percentage', 'stock_quantity')
+
+
+class InvalidRow(Exception):
+    pass
+
+
+def check_number(column, value):
+    """
+    ``value`` as the column will store it, or InvalidRow for values the
+    database would refuse mid-batch: negative, NaN/Infinity, too many digits.
+    """
+    field = Product._meta.get_field(column)
+    if isinstance(value, Decimal):
+        if not value.is_finite() or value < 0:
+            raise InvalidRow(f'invalid {column} {value!r}')
+        try:
+            value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+            field.run_validators(value)
+        except (InvalidOperation, ValidationError):
+            raise InvalidRow(f'{column} {value} does not fit {field.max_digits} digits')
+        return value
+    # The portable range; SQLite reports none but still CHECKs the sign
+    low, high = connection.ops.integer_field_ranges[field.get_internal_type()]
+    if not low <= value <= high:
+        raise InvalidRow(f'invalid {column} {value!r}')
+    return value
+
+
+def parse_row(raw):
+    """Validated model values for one feed row."""
+    if isinstance(raw, InvalidRow):
+        raise raw
+    if not isinstance(raw, dict):
+        raise InvalidRow(f'expected an object, got {type(raw).__name__}')
+    for value in raw.values():
+        try:
+            str(value).encode()
+        except UnicodeEncodeError:
+            raise InvalidRow('not valid UTF-8')
+    values = {}
+    for column in ('sku', 'name', 'category', 'price'):
+        value = raw.get(column)
+        if value is None or str(value).strip() == '':
+            raise InvalidRow(f'missing {column}')
+        values[column] = str(value).strip()
+    columns = [('price', to_decimal)] + list(OPTIONAL_COLUMNS.items())
+    for column, parse in columns:
+        value = raw.get(column)
+        if value is None or value == '':
+            continue
+        try:
+            values[column] = parse(value)
+        except (InvalidOperation, ValueError, TypeError):
+            raise InvalidRow(f'invalid {column} {value!r}')
+        if column in NUMERIC_COLUMNS:
+            values[column] = check_number(column, values[column])
+    if values.get('material', 'artificial') not in MATERIALS:
+        raise InvalidRow(f"unknown material {values['material']!r}")
+    images = raw.get('images') or raw.get('image') or []
+    if isinstance(images, str):
+        images = [name.strip() for name in images.split('|') if name.strip()]
+    return values, images
+
+
+class Command(BaseCommand):
+    help = 'Imports (upserts) categories and products from a CSV or JSON Lines supplier feed, matched by SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='CSV (with a header row) or JSON Lines file')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows written per transaction')
+        parser.add_argument('--image-root', help='Directory image paths are relative to (default: the feed\'s)')
+        parser.add_argument('--image-workers', type=int, default=IMAGE_WORKERS, help='Threads storing images')
+        parser.add_argument('--checkpoint', help='Progress file (default: <source>.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        source = os.path.abspath(options['source'])
+        if not os.path.isfile(source):
+            raise CommandError(f'{source} does not exist')
+        fmt = options['format'] or ('jsonl' if source.endswith(('.jsonl', '.ndjson')) else 'csv')
+        self.image_root = options['image_root'] or os.path.dirname(source)
+        self.image_field = ProductImage._meta.get_field('image')
+        self.category_ids = {}
+        self.totals = dict.fromkeys(('rows', 'created', 'updated', 'unchanged', 'images', 'invalid'), 0)
+        # Batches committed since the catalog version was last bumped
+        self.unpublished = 0
+
+        checkpoint_path = options['checkpoint'] or f'{source}.checkpoint'
+        stat = os.stat(source)
+        state = {'size': stat.st_size, 'mtime': stat.st_mtime, 'offset': 0, 'rows': 0}
+        if os.path.exists(checkpoint_path) and not options['restart']:
+            with open(checkpoint_path) as f:
+                saved = json.load(f)
+            if (saved['size'], saved['mtime']) != (state['size'], state['mtime']):
+                raise CommandError(f'{source} changed since {checkpoint_path} was written; use --restart')
+            state = saved
+            self.stdout.write(f"Resuming after row {state['rows']} (byte {state['offset']})")
+
+        started = time.monotonic()
+        batch = []
+        offset = state['offset']
+        with open(source, 'rb') as handle, ThreadPoolExecutor(options['image_workers']) as pool:
+            for row_number, (raw, offset) in enumerate(self.read(handle, fmt, state['offset']), state['rows'] + 1):
+                try:
+                    batch.append(parse_row(raw))
+                except InvalidRow as e:
+                    self.totals['invalid'] += 1
+                    self.stderr.write(f'Row {row_number}: {e}')
+                if row_number - state['rows'] >= options['batch_size']:
+                    self.write_batch(batch, pool)
+                    state.update(offset=offset, rows=row_number)
+                    self.save_checkpoint(checkpoint_path, state)
+                    self.report(state['rows'], started)
+                    batch = []
+            if batch:
+                self.write_batch(batch, pool)
+            state.update(offset=offset, rows=state['rows'] + len(batch))
+
+        if self.unpublished:
+            with transaction.atomic():
+                catalog_changed()
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        totals = self.totals
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['rows']} rows in {time.monotonic() - started:.1f}s "
+            f"({self.rate(totals['rows'], started):.0f} rows/s): {totals['created']} created, "
+            f"{totals['updated']} updated, {totals['unchanged']} unchanged, {totals['images']} images, "
+            f"{totals['invalid']} invalid"
+        ))
+
+    def read(self, handle, fmt, offset):
+        """
+        Yield (row dict, byte offset just past the row) starting at ``offset``.
+        Lines that are not JSON come through as InvalidRow, and bytes that
+        are not UTF-8 as lone surrogates, for parse_row to reject; either way
+        the row is reported and checkpointed past instead of ending the run.
+        """
+        position = [0]
+
+        def lines():
+            for line in handle:
+                position[0] += len(line)
+                yield line.decode('utf-8-sig', 'surrogateescape')
+
+        if fmt == 'jsonl':
+            handle.seek(offset)
+            position[0] = offset
+            for line in lines():
+                if line.strip():
+                    try:
+                        raw = json.loads(line)
+                    except ValueError as e:
+                        raw = InvalidRow(f'invalid JSON ({e.msg})')
+                    yield raw, position[0]
+            return
+
+        # csv.reader pulls exactly the lines of each record, so the position
+        # after a record is a safe place to resume from.
+        reader = csv.reader(lines())
+        header = [column.strip().lower() for column in next(reader, [])]
+        if offset:
+            handle.seek(offset)
+            position[0] = offset
+            reader = csv.reader(lines())
+        for record in reader:
+            if record:
+                yield dict(zip(header, record)), position[0]
+
+    def resolve_categories(self, names):
+        missing = set(names) - self.category_ids.keys()
+        if missing:
+            self.category_ids.update(Category.objects.filter(name__in=missing).values_list('name', 'pk'))
+            new = missing - self.category_ids.keys()
+            if new:
+                Category.objects.bulk_create([Category(name=name) for name in sorted(new)], ignore_conflicts=True)
+                self.category_ids.update(Category.objects.filter(name__in=new).values_list('name', 'pk'))
+
+    def write_batch(self, batch, pool):
+        # Later rows for the same SKU win
+        rows = {values['sku']: (values, images) for values, images in batch}
+        self.totals['rows'] += len(batch)
+
+        # Image files are hashed and stored in parallel before the
+        # transaction; an interrupted batch only leaves shared, unreferenced
+        # files behind.
+        paths = {path for values, images in rows.values() for path in images}
+        stored = dict(zip(paths, pool.map(self.store_image, paths)))
+
+        with transaction.atomic():
+            self.resolve_categories({values['category'] for values, images in rows.values()})
+            existing = Product.objects.filter(sku__in=rows).in_bulk(field_name='sku')
+            now = timezone.now()
+            to_create, to_update, update_fields = [], [], set()
+            # Categories whose facet cells this batch changes, including the
+            # ones products move out of
+            categories = set()
+            for sku, (values, images) in rows.items():
+                fields = {name: value for name, value in values.items() if name not in ('sku', 'category')}
+                fields['category_id'] = self.category_ids[values['category']]
+                product = existing.get(sku)
+                if product is None:
+                    product = Product(sku=sku, **fields)
+                    product.refresh_effective_price()
+                    to_create.append(product)
+                    categories.add(product.category_id)
+                    continue
+                changed = [name for name, value in fields.items() if getattr(product, name) != value]
+                if not changed:
+                    self.totals['unchanged'] += 1
+                    continue
+                categories.update((product.category_id, fields['category_id']))
+                for name in changed:
+                    setattr(product, name, fields[name])
+                product.refresh_effective_price()
+                product.updated_at = now
+                update_fields.update(changed)
+                to_update.append(product)
+
+            Product.objects.bulk_create(to_create)
+            if to_update:
+                Product.objects.bulk_update(
+                    to_update, sorted(update_fields | {'effective_price', 'updated_at'})
+                )
+            self.totals['created'] += len(to_create)
+            self.totals['updated'] += len(to_update)
+
+            product_ids = dict(Product.objects.filter(sku__in=rows).values_list('sku', 'pk'))
+            self.attach_images(
+                {product_ids[sku]: [stored[path] for path in images if stored[path]] for sku, (values, images) in rows.items()}
+            )
+            touched = [product_ids[product.sku] for product in to_create + to_update]
+            if touched:
+                search.index_products(Product.objects.filter(pk__in=touched))
+            # Bulk writes skip the signals that move facet counts, so the
+            # batch's categories are recounted in its own transaction
+            if categories:
+                facets.rebuild(categories)
+            self.unpublished += 1
+            if self.unpublished >= BATCHES_PER_VERSION:
+                catalog_changed()
+                self.unpublished = 0
+
+    def store_image(self, path):
+        full_path = path if os.path.isabs(path) else os.path.join(self.image_root, path)
+        try:
+            with open(full_path, 'rb') as f:
+                name = self.image_field.generate_filename(None, os.path.basename(full_path))
+                return self.image_field.storage.save(name, File(f, name))
+        except OSError as e:
+            self.stderr.write(f'{path}: {e}')
+            return None
+
+    def attach_images(self, images_by_product):
+        images_by_product = {pk: names for pk, names in images_by_product.items() if names}
+        if not images_by_product:
+            return
+        # Stored names are content hashes, so a name match is the same image
+        have = {}
+        for product_id, name in ProductImage.objects.filter(
+            product_id__in=images_by_product
+        ).values_list('product_id', 'image'):
+            have.setdefault(product_id, set()).add(name)
+        new_images = []
+        for product_id, names in images_by_product.items():
+            existing = have.get(product_id, set())
+            for name in dict.fromkeys(names):
+                if name not in existing:
+                    new_images.append(ProductImage(product_id=product_id, image=name, is_primary=not existing))
+                    existing.add(name)
+        if not new_images:
+            return
+        ProductImage.objects.bulk_create(new_images)
+        Product.objects.filter(pk__in={image.product_id for image in new_images}).sync_image_summary()
+        for image in new_images:
+            schedule_derivatives(image.image, PRODUCT_WIDTHS)
+        self.totals['images'] += len(new_images)
+
+    def save_checkpoint(self, path, state):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def rate(self, rows, started):
+        return rows / max(time.monotonic() - started, 1e-6)
+
+    def report(self, position, started):
+        self.stdout.write(f"Row {position}: {self.rate(self.totals['rows'], started):.0f} rows/s")
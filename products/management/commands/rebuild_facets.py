@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from products import facets
+from products.models import FacetCount
+
+
+class Command(BaseCommand):
+    help = 'Recounts the product list facet cells from the catalog'
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {FacetCount.objects.count()} facet cells'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from products import search
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text product search index from the catalog'
+
+    def handle(self, *args, **options):
+        search.rebuild_index(Product.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'Indexed {Product.objects.count()} products'))
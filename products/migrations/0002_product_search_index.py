@@ -0,0 +1,59 @@
+from django.db import migrations
+
+# The DDL and indexing SQL are frozen here rather than taken from
+# products.search, whose schema moves on in later migrations.
+SEARCH_TABLE = 'products_search_index'
+
+CREATE_SQL = {
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+        f"USING fts5(name, description, category, tokenize='porter unicode61')",
+    ],
+    'postgresql': [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        f"product_id bigint PRIMARY KEY REFERENCES products_product (id) "
+        f"ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+        f"document tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)",
+    ],
+}
+
+INSERT_SQL = {
+    'sqlite': f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, category) VALUES (%s, %s, %s, %s)",
+    'postgresql': (
+        f"INSERT INTO {SEARCH_TABLE} (product_id, document) VALUES (%s, "
+        f"setweight(to_tsvector('english', %s), 'A') || "
+        f"setweight(to_tsvector('english', %s), 'C') || "
+        f"setweight(to_tsvector('english', %s), 'B'))"
+    ),
+}
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_SQL:
+        return
+    for statement in CREATE_SQL[vendor]:
+        schema_editor.execute(statement)
+
+    Product = apps.get_model('products', 'Product')
+    rows = list(Product.objects.values_list('id', 'name', 'description', 'category__name'))
+    if rows:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(INSERT_SQL[vendor], rows)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.24 on 2026-10-17 23:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Case, Value, When
+
+
+# Frozen copy of the price bands when this migration was written; later
+# changes to products.facets must not alter what it computes.
+PRICE_BAND_LIMITS = [100, 250, 500, 1000]
+
+
+def price_band_expression(field):
+    return Case(
+        *[When(**{f'{field}__lt': high}, then=Value(band)) for band, high in enumerate(PRICE_BAND_LIMITS)],
+        default=Value(len(PRICE_BAND_LIMITS)),
+    )
+
+
+def count_products(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    FacetCount = apps.get_model('products', 'FacetCount')
+    cells = Product.objects.filter(is_active=True).order_by().annotate(
+        price_band=price_band_expression('price')
+    ).values_list('category_id', 'material', 'price_band').annotate(n=models.Count('id'))
+    FacetCount.objects.bulk_create(
+        FacetCount(category_id=category_id, material=material, price_band=band, count=n)
+        for category_id, material, band, n in cells
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('material', models.CharField(choices=[('gold', 'Gold'), ('silver', 'Silver'), ('artificial', 'Artificial'), ('diamond', 'Diamond'), ('platinum', 'Platinum'), ('other', 'Other')], max_length=20)),
+                ('price_band', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='products.category')),
+            ],
+            options={
+                'unique_together': {('category', 'material', 'price_band')},
+            },
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.24 on 2026-10-17 23:20
+
+from django.db import migrations, models
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Round
+
+
+# Frozen copy of the price bands when this migration was written; later
+# changes to products.facets must not alter what it computes.
+PRICE_BAND_LIMITS = [100, 250, 500, 1000]
+
+
+def price_band_expression(field):
+    return Case(
+        *[When(**{f'{field}__lt': high}, then=Value(band)) for band, high in enumerate(PRICE_BAND_LIMITS)],
+        default=Value(len(PRICE_BAND_LIMITS)),
+    )
+
+
+def fill_effective_price(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    FacetCount = apps.get_model('products', 'FacetCount')
+    Product.objects.update(
+        effective_price=Round(F('price') - F('price') * F('discount_percentage') / 100, 2)
+    )
+    # Price bands now follow the effective price
+    FacetCount.objects.all().delete()
+    cells = Product.objects.filter(is_active=True).order_by().annotate(
+        price_band=price_band_expression('effective_price')
+    ).values_list('category_id', 'material', 'price_band').annotate(n=models.Count('id'))
+    FacetCount.objects.bulk_create(
+        FacetCount(category_id=category_id, material=material, price_band=band, count=n)
+        for category_id, material, band, n in cells
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_facetcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(fill_effective_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'effective_price'], name='product_active_price_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.24 on 2026-10-17 23:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_image_summary(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductImage = apps.get_model('products', 'ProductImage')
+    images = ProductImage.objects.filter(product=OuterRef('pk'))
+    Product.objects.update(
+        primary_image=Subquery(images.order_by('-is_primary', 'created_at').values('pk')[:1]),
+        image_count=Coalesce(
+            Subquery(images.order_by().values('product').annotate(n=Count('pk')).values('n')), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.productimage'),
+        ),
+        migrations.RunPython(fill_image_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.24 on 2026-10-17 23:31
+
+from django.db import migrations, models
+
+
+def create_counter(apps, schema_editor):
+    apps.get_model('products', 'CatalogVersion').objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_category_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+import re
+
+from django.db import migrations
+
+# Frozen copies of the term-index schema and vocabulary rules from
+# products.search at the time of this migration.
+TERMS_TABLE = 'products_search_terms'
+TRIGRAM_TABLE = 'products_search_trigrams'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+FUZZY_MIN_LENGTH = 4
+
+CREATE_SQL = {
+    'sqlite': [
+        f"CREATE TABLE IF NOT EXISTS {TERMS_TABLE} (term TEXT PRIMARY KEY, grams INTEGER NOT NULL) WITHOUT ROWID",
+        f"CREATE TABLE IF NOT EXISTS {TRIGRAM_TABLE} "
+        f"(gram TEXT NOT NULL, term TEXT NOT NULL, PRIMARY KEY (gram, term)) WITHOUT ROWID",
+    ],
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        f"CREATE TABLE IF NOT EXISTS {TERMS_TABLE} (term text PRIMARY KEY)",
+        f"CREATE INDEX IF NOT EXISTS {TERMS_TABLE}_trgm ON {TERMS_TABLE} USING GIN (term gin_trgm_ops)",
+    ],
+}
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def create_term_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_SQL:
+        return
+    for statement in CREATE_SQL[vendor]:
+        schema_editor.execute(statement)
+
+    Product = apps.get_model('products', 'Product')
+    words = set()
+    for name, category in Product.objects.values_list('name', 'category__name').iterator():
+        words |= {
+            word.lower() for word in TOKEN_RE.findall(f'{name} {category}') if len(word) >= FUZZY_MIN_LENGTH
+        }
+    words = sorted(words)
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO {TERMS_TABLE} (term, grams) VALUES (%s, %s)",
+                [(word, len(trigrams(word))) for word in words],
+            )
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO {TRIGRAM_TABLE} (gram, term) VALUES (%s, %s)",
+                [(gram, word) for word in words for gram in sorted(trigrams(word))],
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO {TERMS_TABLE} (term) VALUES (%s) ON CONFLICT DO NOTHING", [(word,) for word in words]
+            )
+
+
+def drop_term_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        for table in (TRIGRAM_TABLE, TERMS_TABLE):
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_product_sku'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_term_index, drop_term_index),
+    ]
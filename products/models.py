@@ -1,5 +1,9 @@
+from decimal import Decimal, ROUND_HALF_UP
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Round
 from django.urls import reverse
+from django.utils import timezone
 from django.conf import settings
 
 
@@ -9,15 +13,59 @@ class Category(models.Model):
     image = models.ImageField(upload_to='categories/', null=True, blank=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name'], condition=models.Q(is_active=True), name='category_active_name_idx'),
+        ]
     
     def __str__(self):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+    def apply_discount(self, percentage):
+        """Set a discount on every product in the queryset in one UPDATE."""
+        percentage = Decimal(percentage)
+        updated = self.update(
+            discount_percentage=percentage,
+            effective_price=Round(F('price') * (100 - percentage) / 100, 2),
+            updated_at=timezone.now(),
+        )
+        # Price bands are counted on the effective price
+        from .facets import rebuild
+        from .snapshot import catalog_changed
+        rebuild()
+        catalog_changed()
+        return updated
+    
+    def sync_effective_price(self):
+        """Recompute the stored effective price after raw price/discount edits."""
+        updated = self.update(
+            effective_price=Round(F('price') - F('price') * F('discount_percentage') / 100, 2),
+            updated_at=timezone.now(),
+        )
+        from .facets import rebuild
+        from .snapshot import catalog_changed
+        rebuild()
+        catalog_changed()
+        return updated
+    
+    def sync_image_summary(self):
+        """Recompute primary_image and image_count from the ProductImage rows."""
+        images = ProductImage.objects.filter(product=OuterRef('pk'))
+        return self.update(
+            primary_image=Subquery(images.order_by('-is_primary', 'created_at').values('pk')[:1]),
+            image_count=Coalesce(
+                Subquery(images.order_by().values('product').annotate(n=Count('pk')).values('n')), 0
+            ),
+            updated_at=timezone.now(),
+        )
+
+
 class Product(models.Model):
     MATERIAL_CHOICES = [
         ('gold', 'Gold'),
@@ -29,34 +77,91 @@ class Product(models.Model):
     ]
     
     name = models.CharField(max_length=200)
+    # Supplier stock-keeping unit; the natural key for catalog imports
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    # Price after discount, kept in sync by save() and ProductQuerySet so
+    # listings can filter and sort on it in SQL.
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
     stock_quantity = models.PositiveIntegerField(default=0)
     material = models.CharField(max_length=20, choices=MATERIAL_CHOICES, default='artificial')
     size = models.CharField(max_length=50, blank=True)
     weight = models.CharField(max_length=50, blank=True)
     is_featured = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
+    # Maintained from the images by products.signals so listing cards can
+    # show a picture without querying ProductImage per product.
+    primary_image = models.ForeignKey(
+        'ProductImage', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+'
+    )
+    image_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Doubles as the product's cache version (core.templatetags.fragment_tags),
+    # so every write path, including queryset updates, must bump it.
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProductQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
+        # Every public listing reads active products only, optionally narrowed
+        # by category, featured flag or material, in one of the list sort
+        # orders with pk as the keyset tie-breaker. Boolean filters compile to
+        # a bare column test, so they live in the index conditions where the
+        # planner can match them, not in the key columns.
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_active=True), name='product_active_new_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], condition=models.Q(is_active=True), name='product_category_new_idx'),
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_active=True, is_featured=True), name='product_featured_new_idx'),
+            models.Index(fields=['material', '-created_at', '-id'], condition=models.Q(is_active=True), name='product_material_new_idx'),
+            models.Index(fields=['effective_price', 'id'], condition=models.Q(is_active=True), name='product_active_price_idx'),
+            models.Index(fields=['name', 'id'], condition=models.Q(is_active=True), name='product_active_name_idx'),
+        ]
     
     def __str__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        self.refresh_effective_price()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields) | {'updated_at'}
+            if {'price', 'discount_percentage'} & update_fields:
+                update_fields.add('effective_price')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which facet cell the row was counted in so a later save
+        # or delete can move it without re-reading the old values.
+        from .facets import FACET_FIELDS, facet_key
+        if FACET_FIELDS.issubset(field_names):
+            instance._loaded_facet_key = facet_key(instance)
+        # Likewise the stock level, so stock-only saves can tell a sell-out
+        if 'stock_quantity' in field_names:
+            instance._loaded_stock = instance.stock_quantity
+        return instance
+    
+    def refresh_effective_price(self):
+        # For writes that bypass save(), such as bulk_create/bulk_update
+        self.effective_price = self.discounted_price.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    
     def get_absolute_url(self):
         return reverse('products:detail', kwargs={'pk': self.pk})
     
     @property
     def discounted_price(self):
-        if self.discount_percentage > 0:
-            discount_amount = self.price * (self.discount_percentage / 100)
-            return self.price - discount_amount
-        return self.price
+        price = Decimal(self.price)
+        discount_percentage = Decimal(self.discount_percentage)
+        if discount_percentage > 0:
+            discount_amount = price * (discount_percentage / 100)
+            return price - discount_amount
+        return price
     
     @property
     def in_stock(self):
@@ -64,7 +169,8 @@ class Product(models.Model):
 
 
 class ProductImage(models.Model):
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
+    # Covered by productimage_order_idx
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images', db_index=False)
     image = models.ImageField(upload_to='products/')
     alt_text = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
@@ -72,6 +178,65 @@ class ProductImage(models.Model):
     
     class Meta:
         ordering = ['-is_primary', 'created_at']
+        indexes = [
+            models.Index(fields=['product', '-is_primary', 'created_at'], name='productimage_order_idx'),
+        ]
     
     def __str__(self):
         return f"{self.product.name} - Image"
+
+
+class FacetCount(models.Model):
+    """Number of active products in one (category, material, price band) cell."""
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='facet_counts')
+    material = models.CharField(max_length=20, choices=Product.MATERIAL_CHOICES)
+    price_band = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('category', 'material', 'price_band')
+    
+    def __str__(self):
+        return f"{self.category_id}/{self.material}/{self.price_band}: {self.count}"
+
+
+class RelatedProduct(models.Model):
+    """
+    One of a product's top co-purchased neighbours, written by
+    orders.recommendations. ``rank`` 0 is the strongest.
+    """
+    # Covered by relatedproduct_rank_uniq
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations', db_index=False)
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='relatedproduct_rank_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} ({self.score:.3f})"
+
+
+class CatalogVersion(models.Model):
+    """
+    Single-row counter bumped on every catalog write; workers poll it to
+    know when their in-process snapshot (products.snapshot) is stale.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+    
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1, updated_at=timezone.now()):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+    
+    def __str__(self):
+        return f"Catalog version {self.version}"
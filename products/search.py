@@ -0,0 +1,346 @@
+"""
+Full-text product search.
+
+Products are indexed by name, description and category name into an
+inverted index that lives next to the catalog tables: an FTS5 virtual table
+on SQLite and a GIN-indexed tsvector table on PostgreSQL. The index is kept
+current by the handlers in products.signals and queried through
+search_products(), which returns the filtered queryset annotated with a
+``search_rank`` relevance score.
+
+Misspellings are handled by a second, trigram index over the vocabulary of
+product and category names (plain tables on SQLite, pg_trgm on
+PostgreSQL). When a query finds too few products, spelling_correction()
+swaps each unknown word for its most similar indexed word and the caller
+searches again with the corrected query.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection as default_connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'products_search_index'
+TERMS_TABLE = 'products_search_terms'
+TRIGRAM_TABLE = 'products_search_trigrams'
+
+# Longer queries add nothing but planner work
+MAX_TERMS = 8
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Words shorter than this have too few trigrams to compare reliably
+FUZZY_MIN_LENGTH = 4
+
+# Minimum trigram similarity for a correction (pg_trgm's default threshold)
+FUZZY_SIMILARITY = 0.3
+
+
+def tokenize(query):
+    return [token.lower() for token in TOKEN_RE.findall(query or '')][:MAX_TERMS]
+
+
+def trigrams(word):
+    # Padded like pg_trgm, so similarities agree across backends
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SQLiteSearchBackend:
+    create_sql = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+        f"USING fts5(name, description, category, tokenize='porter unicode61')",
+        f"CREATE TABLE IF NOT EXISTS {TERMS_TABLE} (term TEXT PRIMARY KEY, grams INTEGER NOT NULL) WITHOUT ROWID",
+        f"CREATE TABLE IF NOT EXISTS {TRIGRAM_TABLE} "
+        f"(gram TEXT NOT NULL, term TEXT NOT NULL, PRIMARY KEY (gram, term)) WITHOUT ROWID",
+    ]
+    drop_sql = [f"DROP TABLE IF EXISTS {table}" for table in (SEARCH_TABLE, TERMS_TABLE, TRIGRAM_TABLE)]
+
+    def build_query(self, terms):
+        # Every term must match; the last one is treated as a prefix so
+        # partially typed words still find results.
+        parts = [f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*']
+        return ' '.join(parts)
+
+    def index_rows(self, cursor, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, category) VALUES (%s, %s, %s, %s)",
+            rows,
+        )
+
+    def remove_ids(self, cursor, ids):
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(pk,) for pk in ids])
+
+    def clear(self, cursor):
+        for table in (SEARCH_TABLE, TERMS_TABLE, TRIGRAM_TABLE):
+            cursor.execute(f"DELETE FROM {table}")
+
+    def index_terms(self, cursor, words):
+        words = sorted(words)
+        cursor.executemany(
+            f"INSERT OR IGNORE INTO {TERMS_TABLE} (term, grams) VALUES (%s, %s)",
+            [(word, len(trigrams(word))) for word in words],
+        )
+        cursor.executemany(
+            f"INSERT OR IGNORE INTO {TRIGRAM_TABLE} (gram, term) VALUES (%s, %s)",
+            [(gram, word) for word in words for gram in sorted(trigrams(word))],
+        )
+
+    def has_term(self, cursor, word):
+        cursor.execute(f"SELECT 1 FROM {TERMS_TABLE} WHERE term = %s", [word])
+        return cursor.fetchone() is not None
+
+    def similar_terms_sql(self, word):
+        grams = sorted(trigrams(word))
+        placeholders = ', '.join(['%s'] * len(grams))
+        sql = (
+            f"SELECT g.term, COUNT(*), t.grams FROM {TRIGRAM_TABLE} g "
+            f"JOIN {TERMS_TABLE} t ON t.term = g.term "
+            f"WHERE g.gram IN ({placeholders}) GROUP BY g.term, t.grams"
+        )
+        return sql, grams
+
+    def similar_terms(self, cursor, word, limit):
+        """Indexed words most similar to ``word``, as (similarity, term) pairs."""
+        sql, grams = self.similar_terms_sql(word)
+        cursor.execute(sql, grams)
+        scored = [
+            (shared / (len(grams) + count - shared), term)
+            for term, shared, count in cursor.fetchall()
+        ]
+        scored = [(score, term) for score, term in scored if score >= FUZZY_SIMILARITY]
+        return sorted(scored, key=lambda pair: (-pair[0], pair[1]))[:limit]
+
+    def filter(self, queryset, terms):
+        match = self.build_query(terms)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [match])
+        ).annotate(
+            # bm25() is lower-is-better; negate it so rank sorts like ts_rank
+            search_rank=RawSQL(
+                f"SELECT -bm25({SEARCH_TABLE}, 10.0, 1.0, 4.0) FROM {SEARCH_TABLE} "
+                f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = {table}.id",
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+
+class PostgresSearchBackend:
+    create_sql = [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        f"product_id bigint PRIMARY KEY REFERENCES products_product (id) "
+        f"ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+        f"document tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)",
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        f"CREATE TABLE IF NOT EXISTS {TERMS_TABLE} (term text PRIMARY KEY)",
+        f"CREATE INDEX IF NOT EXISTS {TERMS_TABLE}_trgm ON {TERMS_TABLE} USING GIN (term gin_trgm_ops)",
+    ]
+    drop_sql = [f"DROP TABLE IF EXISTS {table}" for table in (SEARCH_TABLE, TERMS_TABLE)]
+
+    def build_query(self, terms):
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def index_rows(self, cursor, rows):
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (product_id, document) VALUES (%s, "
+            f"setweight(to_tsvector('english', %s), 'A') || "
+            f"setweight(to_tsvector('english', %s), 'C') || "
+            f"setweight(to_tsvector('english', %s), 'B')) "
+            f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+            list(rows),
+        )
+
+    def remove_ids(self, cursor, ids):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE product_id = ANY(%s)", [list(ids)])
+
+    def clear(self, cursor):
+        cursor.execute(f"TRUNCATE {SEARCH_TABLE}, {TERMS_TABLE}")
+
+    def index_terms(self, cursor, words):
+        cursor.executemany(
+            f"INSERT INTO {TERMS_TABLE} (term) VALUES (%s) ON CONFLICT DO NOTHING",
+            [(word,) for word in sorted(words)],
+        )
+
+    def has_term(self, cursor, word):
+        cursor.execute(f"SELECT 1 FROM {TERMS_TABLE} WHERE term = %s", [word])
+        return cursor.fetchone() is not None
+
+    def similar_terms_sql(self, word):
+        # The % operator is what the trigram GIN index can answer
+        sql = (
+            f"SELECT term, similarity(term, %s) AS score FROM {TERMS_TABLE} "
+            f"WHERE term %% %s ORDER BY score DESC, term"
+        )
+        return sql, [word, word]
+
+    def similar_terms(self, cursor, word, limit):
+        # % applies pg_trgm.similarity_threshold, whose default is FUZZY_SIMILARITY
+        sql, params = self.similar_terms_sql(word)
+        cursor.execute(f"{sql} LIMIT %s", params + [limit])
+        return [(score, term) for term, score in cursor.fetchall() if score >= FUZZY_SIMILARITY]
+
+    def filter(self, queryset, terms):
+        match = self.build_query(terms)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT product_id FROM {SEARCH_TABLE} WHERE document @@ to_tsquery('english', %s)",
+                [match],
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT ts_rank(document, to_tsquery('english', %s)) FROM {SEARCH_TABLE} "
+                f"WHERE product_id = {table}.id",
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+
+class BasicSearchBackend:
+    """Unindexed fallback for databases without a full-text engine."""
+    create_sql = []
+    drop_sql = []
+
+    def index_rows(self, cursor, rows):
+        pass
+
+    def remove_ids(self, cursor, ids):
+        pass
+
+    def clear(self, cursor):
+        pass
+
+    def index_terms(self, cursor, words):
+        pass
+
+    def has_term(self, cursor, word):
+        return True
+
+    def similar_terms(self, cursor, word, limit):
+        return []
+
+    def filter(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) |
+                Q(description__icontains=term) |
+                Q(category__name__icontains=term)
+            )
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(connection=None):
+    connection = connection or default_connection
+    return BACKENDS.get(connection.vendor, BasicSearchBackend)()
+
+
+def document_rows(queryset):
+    return queryset.values_list('id', 'name', 'description', 'category__name').iterator(chunk_size=2000)
+
+
+def vocabulary(text):
+    """Words of ``text`` that spelling correction can suggest."""
+    return {word.lower() for word in TOKEN_RE.findall(text or '') if len(word) >= FUZZY_MIN_LENGTH}
+
+
+def collect_terms(rows, words):
+    """Pass document ``rows`` through, adding their name and category words to ``words``."""
+    for row in rows:
+        words.update(vocabulary(f'{row[1]} {row[3]}'))
+        yield row
+
+
+def index_products(products):
+    """(Re)index the given products; accepts a queryset or model instances."""
+    if hasattr(products, 'values_list'):
+        rows = document_rows(products)
+    else:
+        rows = [(p.pk, p.name, p.description, p.category.name) for p in products]
+    backend = get_backend()
+    words = set()
+    with default_connection.cursor() as cursor:
+        backend.index_rows(cursor, collect_terms(rows, words))
+        # Words are only ever added; a rebuild drops ones no longer used
+        backend.index_terms(cursor, words)
+
+
+def remove_products(ids):
+    ids = list(ids)
+    if ids:
+        with default_connection.cursor() as cursor:
+            get_backend().remove_ids(cursor, ids)
+
+
+def rebuild_index(queryset):
+    backend = get_backend()
+    words = set()
+    with default_connection.cursor() as cursor:
+        backend.clear(cursor)
+        backend.index_rows(cursor, collect_terms(document_rows(queryset), words))
+        backend.index_terms(cursor, words)
+
+
+def search_products(queryset, query):
+    """
+    Restrict ``queryset`` to products matching ``query`` and annotate each
+    row with ``search_rank`` (higher is more relevant). Further filters and
+    ordering can be chained on the result as usual.
+    """
+    terms = tokenize(query)
+    if not terms:
+        # Annotated like a real result so callers can still order by rank
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+    return get_backend().filter(queryset, terms)
+
+
+def correct_query(query):
+    """
+    ``query`` with each unknown word replaced by the most similar indexed
+    word, or None when there is nothing to correct.
+    """
+    terms = tokenize(query)
+    backend = get_backend()
+    corrected = []
+    with default_connection.cursor() as cursor:
+        for term in terms:
+            if len(term) < FUZZY_MIN_LENGTH or term.isdigit() or backend.has_term(cursor, term):
+                corrected.append(term)
+                continue
+            matches = backend.similar_terms(cursor, term, 1)
+            corrected.append(matches[0][1] if matches else term)
+    return ' '.join(corrected) if corrected != terms else None
+
+
+def spelling_correction(queryset, query, min_results=None):
+    """
+    The corrected query to search ``queryset`` with instead of ``query``,
+    or None. A correction is only offered when ``query`` itself finds fewer
+    than SEARCH_FUZZY_MIN_RESULTS products and the corrected one finds more.
+    """
+    if min_results is None:
+        min_results = getattr(settings, 'SEARCH_FUZZY_MIN_RESULTS', 3)
+    found = len(search_products(queryset, query).values_list('pk')[:min_results])
+    if found >= min_results:
+        return None
+    corrected = correct_query(query)
+    if corrected is None:
+        return None
+    if len(search_products(queryset, corrected).values_list('pk')[:found + 1]) <= found:
+        return None
+    return corrected
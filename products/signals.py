@@ -0,0 +1,80 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from core.imaging import PRODUCT_WIDTHS, schedule_derivatives
+
+from . import facets, search, snapshot
+from .models import Category, Product, ProductImage
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_delete, sender=Product)
+def remember_facet_key(sender, instance, raw=False, **kwargs):
+    # Rows loaded with only()/defer() missing a facet field were not keyed
+    # by from_db(); read the cell they are counted in before it changes.
+    if not raw and not instance._state.adding and not hasattr(instance, '_loaded_facet_key'):
+        instance._loaded_facet_key = facets.stored_key(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def update_facet_counts(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    new_key = facets.facet_key(instance)
+    facets.move(getattr(instance, '_loaded_facet_key', None), new_key)
+    instance._loaded_facet_key = new_key
+
+
+@receiver(post_delete, sender=Product)
+def remove_facet_counts(sender, instance, **kwargs):
+    facets.move(getattr(instance, '_loaded_facet_key', None), None)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, raw=False, **kwargs):
+    # The category name is part of every product document in it
+    if not created and not raw:
+        search.index_products(instance.products.all())
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def update_image_summary(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Product.objects.filter(pk=instance.product_id).sync_image_summary()
+
+
+@receiver(post_save, sender=ProductImage)
+def render_image_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_derivatives(instance.image, PRODUCT_WIDTHS)
+
+
+# RelatedProduct has no receiver: build_recommendations bumps once per build,
+# and without one Django deletes the old rows in a single statement
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def bump_catalog_version(sender, instance=None, update_fields=None, **kwargs):
+    loaded_stock = getattr(instance, '_loaded_stock', None)
+    if (sender is Product and update_fields and set(update_fields) <= snapshot.STOCK_FIELDS
+            and loaded_stock is not None):
+        snapshot.stock_changed({instance.pk: (loaded_stock, instance.stock_quantity)})
+    else:
+        snapshot.catalog_changed()
+    if sender is Product and 'stock_quantity' not in instance.get_deferred_fields():
+        instance._loaded_stock = instance.stock_quantity
@@ -0,0 +1,271 @@
+"""
+In-process catalog snapshot.
+
+Each worker keeps an immutable, compact copy of the active catalog (categories,
+products with their primary image and effective price, and co-purchase
+neighbours) and serves the hot read paths from it: the home page, the
+listing sidebars and related products. Every catalog write bumps
+CatalogVersion in the same transaction; workers compare it at most once per
+CATALOG_SNAPSHOT_POLL seconds and, when it moved, rebuild on a background
+thread while requests keep reading the previous snapshot. Only the first
+build, and reads inside a transaction (which must see their own writes),
+build in the request.
+
+Stock levels change with every order, so records carry availability
+(in_stock) rather than a count; stock-only writes go through stock_changed(),
+which bumps the version only when a product sells out or comes back.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.urls import reverse
+
+from .facets import price_band_for
+from .models import CatalogVersion, Category, Product, ProductImage, RelatedProduct
+
+
+class Record:
+    """Read-only attribute bag with fixed slots."""
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is read-only')
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def cache_version(self):
+        # Matches core.templatetags.fragment_tags so cached cards are shared
+        # between snapshot records and model instances.
+        return f'{self.model_label}:{self.id}:{self.updated_at.isoformat() if self.updated_at else ""}'
+
+
+class ImageRecord(Record):
+    __slots__ = ('id', 'image', 'alt_text')
+
+
+class CategoryRecord(Record):
+    __slots__ = ('id', 'name', 'description', 'updated_at', 'product_count', 'cover')
+    model_label = Category._meta.label_lower
+
+    def __str__(self):
+        return self.name
+
+
+class ProductRecord(Record):
+    __slots__ = (
+        'id', 'name', 'category', 'description', 'price', 'discount_percentage', 'effective_price',
+        'in_stock', 'material', 'is_featured', 'primary_image', 'image_count', 'created_at', 'updated_at',
+    )
+    model_label = Product._meta.label_lower
+    material_labels = dict(Product.MATERIAL_CHOICES)
+
+    def __str__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return reverse('products:detail', kwargs={'pk': self.id})
+
+    def get_material_display(self):
+        return self.material_labels.get(self.material, self.material)
+
+
+def category_queryset():
+    return Category.objects.filter(is_active=True).order_by('name')
+
+
+def product_queryset():
+    return Product.objects.filter(is_active=True).select_related('primary_image').order_by('-created_at', '-id')
+
+
+def related_queryset():
+    return RelatedProduct.objects.order_by('product_id', 'rank').values_list('product_id', 'related_id')
+
+
+def _digest(values):
+    return hashlib.md5(repr(list(values)).encode(), usedforsecurity=False).hexdigest()
+
+
+class CatalogSnapshot:
+    def __init__(self, version):
+        self.version = version
+        image_field = ProductImage._meta.get_field('image')
+
+        categories = {category.pk: category for category in category_queryset()}
+        rows = {}
+        for product in product_queryset().iterator(chunk_size=2000):
+            if product.category_id not in categories:
+                continue
+            values = {
+                name: getattr(product, name) for name in ProductRecord.__slots__
+                if name not in ('category', 'primary_image')
+            }
+            image = product.primary_image
+            values['primary_image'] = image and ImageRecord(
+                id=image.pk, image=image_field.attr_class(None, image_field, image.image.name), alt_text=image.alt_text,
+            )
+            rows.setdefault(product.category_id, []).append(values)
+
+        self.categories = tuple(
+            CategoryRecord(
+                id=category.pk, name=category.name, description=category.description,
+                updated_at=category.updated_at, product_count=len(rows.get(category.pk, ())),
+                cover=rows[category.pk][0]['primary_image'] if category.pk in rows else None,
+            )
+            for category in categories.values()
+        )
+        self.categories_by_id = {category.id: category for category in self.categories}
+        self.by_category = {
+            category_id: tuple(ProductRecord(category=self.categories_by_id[category_id], **values) for values in values_list)
+            for category_id, values_list in rows.items()
+        }
+        self.products = {record.id: record for records in self.by_category.values() for record in records}
+        # Newest first, like the product_active_new_idx order
+        self.recent = tuple(sorted(self.products.values(), key=lambda p: (p.created_at, p.id), reverse=True))
+        self.featured = tuple(p for p in self.recent if p.is_featured)
+
+        related = {}
+        for product_id, related_id in related_queryset().iterator(chunk_size=5000):
+            if product_id in self.products and related_id in self.products:
+                related.setdefault(product_id, []).append(self.products[related_id])
+        self.related = {product_id: tuple(records) for product_id, records in related.items()}
+
+        # Page cache tag versions (tag_version) that only move when what a
+        # page shows does: one per category's listing, one for all listings,
+        # one for the sidebar facets and one for the category list.
+        self.listing_versions = {
+            category_id: _digest(record.cache_version for record in records)
+            for category_id, records in self.by_category.items()
+        }
+        self.listing_version = _digest(sorted(self.listing_versions.items()))
+        self.facets_version = _digest(sorted(Counter(
+            (p.category.id, p.material, price_band_for(p.effective_price)) for p in self.products.values()
+        ).items()))
+        self.categories_version = _digest(
+            (category.cache_version, category.product_count, category.cover and category.cover.id)
+            for category in self.categories
+        )
+
+        # Deletes only show in the version row's timestamp
+        stamps = [record.updated_at for record in (*self.products.values(), *self.categories)]
+        stamps += CatalogVersion.objects.filter(pk=1).values_list('updated_at', flat=True)
+        self.last_modified = max(stamps, default=None)
+
+    def category(self, pk):
+        return self.categories_by_id.get(pk)
+
+    def tag_version(self, tag):
+        """Current version of a page cache tag (core.middleware); None once gone."""
+        kind, _, pk = tag.partition(':')
+        if kind == 'catalog':
+            return self.version
+        if kind == 'listing':
+            return self.listing_versions.get(int(pk)) if pk else self.listing_version
+        if kind == 'facets':
+            return self.facets_version
+        if kind == 'categories':
+            return self.categories_version
+        if kind in ('recent', 'featured'):
+            return [product.cache_version for product in getattr(self, kind)[:int(pk)]]
+        if kind == 'category':
+            category = self.category(int(pk))
+            return category and category.cache_version
+        product = self.products.get(int(pk))
+        if product is None:
+            return None
+        if kind == 'related':
+            return [related.cache_version for related in self.related_products(product.id, product.category.id)]
+        return product.cache_version
+
+    def related_products(self, product_id, category_id, limit=4):
+        """Co-purchase neighbours, topped up from the product's category."""
+        picked = list(self.related.get(product_id, ())[:limit])
+        seen = {product_id, *(p.id for p in picked)}
+        for product in self.by_category.get(category_id, ()):
+            if len(picked) >= limit:
+                break
+            if product.id not in seen:
+                picked.append(product)
+        return picked
+
+
+# Fields a stock-only write touches (see stock_changed)
+STOCK_FIELDS = frozenset({'stock_quantity', 'updated_at'})
+
+_snapshot = None
+_checked_at = 0.0
+_building = False
+_lock = threading.Lock()
+
+
+def _poll_interval():
+    return getattr(settings, 'CATALOG_SNAPSHOT_POLL', 5)
+
+
+def _build_in_background(version):
+    global _snapshot, _building
+    try:
+        snapshot = CatalogSnapshot(version)
+        with _lock:
+            _snapshot = snapshot
+    finally:
+        with _lock:
+            _building = False
+        connections.close_all()
+
+
+def get_snapshot():
+    """This worker's snapshot; a newer catalog version starts a rebuild."""
+    global _snapshot, _checked_at, _building
+    if _snapshot is not None and time.monotonic() - _checked_at < _poll_interval():
+        return _snapshot
+    with _lock:
+        if _snapshot is not None and time.monotonic() - _checked_at < _poll_interval():
+            return _snapshot
+        version = CatalogVersion.current()
+        _checked_at = time.monotonic()
+        if _snapshot is None or (_snapshot.version != version and connection.in_atomic_block):
+            # Nothing to serve yet, or a transaction that must read its own
+            # uncommitted writes, which another thread cannot see
+            _snapshot = CatalogSnapshot(version)
+        elif _snapshot.version != version and not _building:
+            _building = True
+            threading.Thread(
+                target=_build_in_background, args=(version,), name='catalog-snapshot', daemon=True
+            ).start()
+        return _snapshot
+
+
+def expire():
+    """Make this worker re-check the version on its next read."""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def catalog_changed():
+    """Record a catalog write; call inside the writing transaction."""
+    CatalogVersion.bump()
+    transaction.on_commit(expire)
+
+
+def stock_changed(levels):
+    """
+    Record stock-only writes, {product id: (stock before, stock after)}; call
+    inside the writing transaction. The snapshot only shows availability, so
+    the version moves, once the write commits, only when a product sells out
+    or comes back into stock. The levels come from the writer: the snapshot
+    may be stale, and rebuilding it here would read uncommitted stock while
+    the writer holds its row locks.
+    """
+    if any((before > 0) != (after > 0) for before, after in levels.values()):
+        transaction.on_commit(catalog_changed)
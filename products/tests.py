@@ -1,3 +1,592 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils.http import http_date
+
+from core.pagination import CursorPaginator
+from core.scale_data import generate
+from . import autocomplete, search, snapshot
+from .facets import aggregate_cells
+from .management.commands.import_catalog import Command as ImportCatalogCommand
+from .models import CatalogVersion, Category, FacetCount, Product, ProductImage
+from .views import ProductByCategoryView, ProductDetailView, ProductListView, ProductSearchView
+
+# Catalog tables whose full scans the plan checks reject
+CATALOG_TABLES = (
+    'products_product', 'products_category', 'products_productimage', 'products_facetcount',
+    'products_relatedproduct', 'products_catalogversion', 'products_search_terms', 'products_search_trigrams',
+)
+
+
+def seed_catalog(categories=40, products=4000, users=200, orders=2000, seed=1):
+    # The same skewed data set the benchmarks use, at test size
+    return generate(categories=categories, products=products, users=users, orders=orders, seed=seed)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN on the querysets the catalog views build and fails when any
+    of them reads a catalog table with a full scan instead of an index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog()
+        cls.category = Category.objects.filter(is_active=True).first()
+        cls.product = Product.objects.filter(is_active=True, category=cls.category).first()
+
+    def explain(self, queryset):
+        return self.explain_sql(*queryset.query.sql_with_params())
+
+    def explain_sql(self, sql, params):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+                return json.loads(plan) if isinstance(plan, str) else plan
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            scans, nodes = [], [plan[0]['Plan']]
+            while nodes:
+                node = nodes.pop()
+                if node.get('Node Type') == 'Seq Scan' and node.get('Relation Name') in CATALOG_TABLES:
+                    scans.append(node['Relation Name'])
+                nodes.extend(node.get('Plans', []))
+            return scans
+        return [
+            detail for detail in plan
+            if detail.startswith('SCAN ') and 'USING' not in detail
+            and detail.split()[1] in CATALOG_TABLES
+        ]
+
+    def assertIndexed(self, queryset, ordered=False):
+        plan = self.explain(queryset)
+        self.assertEqual(self.full_scans(plan), [], f'Full scan in plan: {plan}\nSQL: {queryset.query}')
+        if ordered and connection.vendor == 'sqlite':
+            # Sorting every matching row defeats LIMIT just like a full scan
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, f'Sort in plan: {plan}')
+
+    def view_queryset(self, view_class, query=None, **kwargs):
+        request = RequestFactory().get('/', query or {})
+        request.user = AnonymousUser()
+        view = view_class()
+        view.setup(request, **kwargs)
+        return view.get_queryset()
+
+    def test_product_list(self):
+        for query in [
+            {},
+            {'category': self.category.pk},
+            {'material': 'gold'},
+            {'sort': 'price'},
+            {'sort': '-price'},
+            {'sort': 'name'},
+            {'min_price': '100', 'max_price': '249.99', 'sort': 'price'},
+            {'category': self.category.pk, 'material': 'silver'},
+        ]:
+            with self.subTest(query=query):
+                self.assertIndexed(self.view_queryset(ProductListView, query)[:13], ordered=True)
+        # Relevance order is computed per match, so only the lookup is checked
+        self.assertIndexed(self.view_queryset(ProductListView, {'search': 'jewelry'})[:13])
+
+    def test_category_and_search_views(self):
+        self.assertIndexed(self.view_queryset(ProductByCategoryView, category_id=self.category.pk)[:13], ordered=True)
+        self.assertIndexed(self.view_queryset(ProductSearchView, {'q': 'handcrafted'})[:13])
+
+    def test_listings_read_categories_and_images_without_per_row_queries(self):
+        for view_class, query, kwargs in [
+            (ProductListView, {'material': 'gold'}, {}),
+            (ProductByCategoryView, {}, {'category_id': self.category.pk}),
+        ]:
+            with self.subTest(view=view_class.__name__):
+                queryset = self.view_queryset(view_class, query, **kwargs)
+                # The page itself plus one prefetch of its categories
+                with self.assertNumQueries(2):
+                    rows = [(product.category.name, product.primary_image) for product in queryset[:12]]
+                self.assertEqual(len(rows), 12)
+
+    def test_cursor_pages(self):
+        for ordering in (['-created_at'], ['effective_price'], ['name']):
+            with self.subTest(ordering=ordering):
+                queryset = Product.objects.filter(is_active=True)
+                paginator = CursorPaginator(queryset, ordering, 12)
+                last = paginator.page().object_list[-1]
+                values = [getattr(last, name) for name, descending in paginator.fields]
+                self.assertIndexed(
+                    queryset.filter(paginator._seek(values)).order_by(*paginator._ordering())[:13], ordered=True
+                )
+
+    def test_catalog_snapshot(self):
+        # Whole-catalog reads, but each must walk an index in its own order
+        for queryset in (snapshot.category_queryset(), snapshot.product_queryset(), snapshot.related_queryset()):
+            with self.subTest(model=queryset.model.__name__):
+                self.assertIndexed(queryset, ordered=True)
+        self.assertIndexed(CatalogVersion.objects.filter(pk=1))
+
+    def test_product_detail(self):
+        self.assertIndexed(self.view_queryset(ProductDetailView, pk=self.product.pk).filter(pk=self.product.pk))
+
+    def test_images_and_facets(self):
+        ids = list(Product.objects.values_list('id', flat=True)[:12])
+        self.assertIndexed(ProductImage.objects.filter(product_id__in=ids))
+        self.assertIndexed(FacetCount.objects.filter(category=self.category, material='gold', price_band=1))
+        self.assertIndexed(aggregate_cells(Product.objects.filter(is_active=True, category=self.category)))
+
+    def test_fuzzy_terms(self):
+        self.assertEqual(search.correct_query('neckless'), 'necklaces')
+        backend = search.get_backend()
+        if hasattr(backend, 'similar_terms_sql'):
+            plan = self.explain_sql(*backend.similar_terms_sql('neckless'))
+            self.assertEqual(self.full_scans(plan), [], f'Full scan in plan: {plan}')
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rings = Category.objects.create(name='Rings')
+        necklaces = Category.objects.create(name='Necklaces')
+        cls.gold_ring = Product.objects.create(
+            name='Gold Ring', category=rings, description='A plain band', price=300, stock_quantity=5, material='gold',
+        )
+        cls.silver_band = Product.objects.create(
+            name='Silver Band', category=rings, description='Goes well with a gold ring', price=80,
+            stock_quantity=5, material='silver',
+        )
+        cls.pendant = Product.objects.create(
+            name='Pearl Pendant', category=necklaces, description='On a fine chain', price=120,
+            stock_quantity=5, material='other',
+        )
+
+    def search(self, query):
+        return list(search.search_products(Product.objects.all(), query).order_by('-search_rank', 'pk'))
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('gold'), [self.gold_ring, self.silver_band])
+
+    def test_every_term_must_match_and_the_last_is_a_prefix(self):
+        self.assertEqual(self.search('gold ri'), [self.gold_ring, self.silver_band])
+        self.assertEqual(self.search('silver gold'), [self.silver_band])
+        self.assertEqual(self.search('neck'), [self.pendant])  # category name
+        self.assertEqual(self.search(' - '), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.pendant.name = 'Pearl Choker'
+        self.pendant.save()
+        self.assertEqual(self.search('choker'), [self.pendant])
+        self.assertEqual(self.search('pendant'), [])
+        self.gold_ring.delete()
+        self.assertEqual(self.search('gold'), [self.silver_band])
+
+    def test_list_view_orders_by_relevance(self):
+        response = self.client.get('/products/', {'search': 'gold'})
+        self.assertEqual(list(response.context['products']), [self.gold_ring, self.silver_band])
+        # Punctuation-only queries have no terms
+        self.assertEqual(self.client.get('/products/', {'search': ' - '}).status_code, 200)
+
+
+class FacetCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rings = Category.objects.create(name='Rings')
+        cls.chains = Category.objects.create(name='Chains')
+        cls.ring = Product.objects.create(
+            name='Gold Ring', category=cls.rings, description='', price=300, stock_quantity=5, material='gold',
+        )
+        cls.chain = Product.objects.create(
+            name='Silver Chain', category=cls.chains, description='', price=80, stock_quantity=5, material='silver',
+        )
+
+    def assertCountsMatch(self):
+        expected = {
+            (category_id, material, band): n
+            for category_id, material, band, n in aggregate_cells(Product.objects.filter(is_active=True))
+        }
+        stored = {
+            (category_id, material, band): n
+            for category_id, material, band, n in FacetCount.objects.filter(count__gt=0).values_list(
+                'category_id', 'material', 'price_band', 'count'
+            )
+        }
+        self.assertEqual(stored, expected)
+
+    def test_counts_follow_create_edit_and_delete(self):
+        self.assertCountsMatch()
+        Product.objects.create(
+            name='Gold Band', category=self.rings, description='', price=320, stock_quantity=5, material='gold',
+        )
+        self.assertCountsMatch()
+        self.ring.price = 1200
+        self.ring.save()
+        self.assertCountsMatch()
+        self.chain.is_active = False
+        self.chain.save()
+        self.assertCountsMatch()
+        self.ring.delete()
+        self.assertCountsMatch()
+
+    def test_counts_follow_edits_to_deferred_instances(self):
+        ring = Product.objects.only('name').get(pk=self.ring.pk)
+        ring.category = self.chains
+        ring.save()
+        self.assertCountsMatch()
+        chain = Product.objects.defer('material').get(pk=self.chain.pk)
+        chain.material = 'gold'
+        chain.save(update_fields=['material'])
+        self.assertCountsMatch()
+        Product.objects.only('name').get(pk=self.chain.pk).delete()
+        self.assertCountsMatch()
+
+
+class ImageSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Rings')
+        cls.product = Product.objects.create(
+            name='Gold Ring', category=category, description='', price=300, stock_quantity=5, material='gold',
+        )
+
+    def summary(self):
+        self.product.refresh_from_db(fields=['primary_image', 'image_count'])
+        return self.product.primary_image, self.product.image_count
+
+    def test_summary_follows_image_saves_and_deletes(self):
+        self.assertEqual(self.summary(), (None, 0))
+        first = ProductImage.objects.create(product=self.product, image='products/first.jpg')
+        self.assertEqual(self.summary(), (first, 1))
+        second = ProductImage.objects.create(product=self.product, image='products/second.jpg')
+        self.assertEqual(self.summary(), (first, 2))
+        # A primary image wins over upload order
+        second.is_primary = True
+        second.save()
+        self.assertEqual(self.summary(), (second, 2))
+        second.delete()
+        self.assertEqual(self.summary(), (first, 1))
+        first.delete()
+        self.assertEqual(self.summary(), (None, 0))
+
+    def test_sync_repairs_a_stale_summary(self):
+        image = ProductImage.objects.create(product=self.product, image='products/first.jpg')
+        Product.objects.filter(pk=self.product.pk).update(primary_image=None, image_count=0)
+        Product.objects.all().sync_image_summary()
+        self.assertEqual(self.summary(), (image, 1))
+
+
+def rebuilt_snapshot():
+    # Versions restart with every test's rollback, so drop what an earlier
+    # test left behind rather than trusting the version check
+    snapshot._snapshot = None
+    return snapshot.get_snapshot()
+
+
+class SnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Rings')
+        cls.product = Product.objects.create(
+            name='Gold Ring', category=category, description='', price=300, stock_quantity=2, material='gold',
+        )
+
+    def test_stock_only_writes_move_the_version_when_availability_changes(self):
+        self.assertTrue(rebuilt_snapshot().products[self.product.pk].in_stock)
+        version = CatalogVersion.current()
+        self.product.stock_quantity = 1
+        self.product.save(update_fields=['stock_quantity'])
+        self.assertEqual(CatalogVersion.current(), version)
+
+        self.product.stock_quantity = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save(update_fields=['stock_quantity'])
+        self.assertEqual(CatalogVersion.current(), version + 1)
+        snapshot.expire()
+        self.assertFalse(snapshot.get_snapshot().products[self.product.pk].in_stock)
+
+        self.product.name = 'Gold Band'
+        self.product.save()
+        self.assertEqual(CatalogVersion.current(), version + 2)
+
+
+class BackgroundRebuildTests(TransactionTestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Rings')
+        self.product = Product.objects.create(
+            name='Gold Ring', category=category, description='', price=300, stock_quantity=2, material='gold',
+        )
+
+    def test_rebuild_runs_in_the_background_while_the_old_snapshot_serves(self):
+        old = rebuilt_snapshot()
+        self.product.name = 'Gold Band'
+        self.product.save()  # commits, which expires this worker's snapshot
+
+        release = threading.Event()
+
+        class HeldSnapshot(snapshot.CatalogSnapshot):
+            def __init__(self, version):
+                release.wait(5)
+                super().__init__(version)
+
+        with mock.patch.object(snapshot, 'CatalogSnapshot', HeldSnapshot):
+            self.assertIs(snapshot.get_snapshot(), old)
+            snapshot.expire()
+            self.assertIs(snapshot.get_snapshot(), old)
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name == 'catalog-snapshot':
+                    thread.join()
+        snapshot.expire()
+        current = snapshot.get_snapshot()
+        self.assertEqual(current.version, CatalogVersion.current())
+        self.assertEqual(current.products[self.product.pk].name, 'Gold Band')
+
+    def test_autocomplete_index_is_rebuilt_in_the_background(self):
+        rebuilt_snapshot()
+        autocomplete._index = None
+        old = autocomplete.get_index()
+        autocomplete._popularity_at -= autocomplete._popularity_ttl()
+
+        release = threading.Event()
+        build_index = autocomplete.build_index
+
+        def held_build(catalog):
+            release.wait(5)
+            return build_index(catalog)
+
+        with mock.patch.object(autocomplete, 'build_index', held_build):
+            self.assertIs(autocomplete.get_index(), old)
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name == 'autocomplete-index':
+                    thread.join()
+        self.assertIsNot(autocomplete.get_index(), old)
+
+
+@override_settings(CATALOG_SNAPSHOT_POLL=0)
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Rings')
+        cls.product = Product.objects.create(
+            name='Gold Ring', category=cls.category, description='', price=300, stock_quantity=5, material='gold',
+        )
+
+    def setUp(self):
+        rebuilt_snapshot()
+
+    def test_malformed_filters_are_rejected(self):
+        for query in ({'category': 'abc'}, {'min_price': 'abc'}, {'max_price': 'x'}, {'max_price': 'NaN'}):
+            for path in ('/products/api/products/', '/products/api/search/'):
+                with self.subTest(path=path, query=query):
+                    response = self.client.get(path, {'q': 'gold', **query})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(next(iter(query)), response.json()['error'])
+        response = self.client.get('/products/api/products/', {'category': self.category.pk, 'max_price': '499.99'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.product.pk])
+
+    def test_cursors_only_page_the_sort_they_came_from(self):
+        Product.objects.create(
+            name='Gold Band', category=self.category, description='', price=120, stock_quantity=5, material='gold',
+        )
+        first = self.client.get('/products/api/products/', {'limit': 1}).json()
+        cursor = parse_qs(urlsplit(first['next']).query)['cursor'][0]
+        following = self.client.get('/products/api/products/', {'limit': 1, 'cursor': cursor})
+        self.assertEqual(len(following.json()['results']), 1)
+        for sort in ('price', '-price', 'name'):
+            with self.subTest(sort=sort):
+                response = self.client.get('/products/api/products/', {'limit': 1, 'sort': sort, 'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', response.json()['error'])
+
+    def test_unchanged_resources_answer_conditional_gets_with_304(self):
+        for path in ('/products/api/products/', '/products/api/categories/', f'/products/api/products/{self.product.pk}/'):
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+                self.assertEqual(
+                    self.client.get(path, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+                )
+
+    def test_edits_change_the_validators(self):
+        path = f'/products/api/products/{self.product.pk}/'
+        etag = self.client.get(path)['ETag']
+        list_etag = self.client.get('/products/api/products/')['ETag']
+        self.product.price = 320
+        self.product.save()
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/products/api/products/', HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+        old = http_date(self.product.updated_at.timestamp() - 60)
+        self.assertEqual(self.client.get(path, HTTP_IF_MODIFIED_SINCE=old).status_code, 200)
+
+    def test_exact_stock_levels_are_not_versioned_by_the_catalog(self):
+        response = self.client.get('/products/api/products/', {'fields': 'id,stock_quantity'})
+        self.assertFalse(response.has_header('ETag'))
+
+
+@override_settings(CATALOG_SNAPSHOT_POLL=0)
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth import get_user_model
+        from orders.models import Order, OrderItem
+
+        rings = Category.objects.create(name='Gold Rings')
+        cls.ring = Product.objects.create(
+            name='Gold Ring', category=rings, description='', price=300, stock_quantity=5, material='gold',
+        )
+        cls.bangle = Product.objects.create(
+            name='Gold Bangle', category=rings, description='', price=300, stock_quantity=5, material='silver',
+        )
+        user = get_user_model().objects.create_user('shopper', password='x')
+        order = Order.objects.create(user=user, total_amount=900, shipping_address='Home')
+        OrderItem.objects.create(order=order, product=cls.bangle, quantity=3, price=300)
+
+    def setUp(self):
+        rebuilt_snapshot()
+        autocomplete._index = None
+        autocomplete._popularity = None
+
+    def labels(self, query):
+        return [suggestion.label for suggestion in autocomplete.suggest(query)]
+
+    def test_suggestions_match_any_word_and_rank_by_units_sold(self):
+        # The category sums its products; the gold material only counts the ring
+        self.assertEqual(self.labels('go'), ['Gold Rings', 'Gold Bangle', 'Gold Ring', 'Gold'])
+        self.assertEqual(self.labels('ban'), ['Gold Bangle'])
+        self.assertEqual(self.labels('rin'), ['Gold Rings', 'Gold Ring'])
+
+    def test_catalog_edits_reuse_the_cached_ranking(self):
+        self.labels('gold')
+        self.ring.name = 'Gold Band'
+        self.ring.save()
+        with mock.patch.object(autocomplete, 'popularity') as popularity:
+            self.assertIn('Gold Band', self.labels('band'))
+        popularity.assert_not_called()
+
+
+class ImportCatalogTests(TestCase):
+    HEADER = 'sku,name,category,price,material,stock_quantity\n'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def feed(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalog', path, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def assertFacetsMatch(self):
+        self.assertEqual(
+            set(FacetCount.objects.filter(count__gt=0).values_list('category_id', 'material', 'price_band', 'count')),
+            set(aggregate_cells(Product.objects.filter(is_active=True))),
+        )
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        path = self.feed('feed.csv', self.HEADER + (
+            'R1,Gold Ring,Rings,300,gold,5\n'
+            'R2,,Rings,300,gold,5\n'
+            'R3,Silver Ring,Rings,cheap,silver,5\n'
+            'R4,Tin Ring,Rings,10,tin,5\n'
+        ))
+        stdout, stderr = self.run_import(path)
+        self.assertEqual(stderr.splitlines(), [
+            'Row 2: missing name', "Row 3: invalid price 'cheap'", "Row 4: unknown material 'tin'",
+        ])
+        self.assertIn('1 created, 0 updated, 0 unchanged, 0 images, 3 invalid', stdout)
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['R1'])
+
+    def test_values_the_database_would_refuse_are_invalid_rows(self):
+        path = self.feed('feed.csv', self.HEADER + (
+            'R1,Gold Ring,Rings,300,gold,-5\n'
+            'R2,Gold Band,Rings,NaN,gold,5\n'
+            'R3,Gold Chain,Rings,Infinity,gold,5\n'
+            'R4,Gold Anklet,Rings,123456789012,gold,5\n'
+            'R5,Gold Bangle,Rings,19.999,gold,5\n'
+        ))
+        stdout, stderr = self.run_import(path)
+        self.assertEqual(stderr.splitlines(), [
+            "Row 1: invalid stock_quantity -5", "Row 2: invalid price Decimal('NaN')",
+            "Row 3: invalid price Decimal('Infinity')", 'Row 4: price 123456789012.00 does not fit 10 digits',
+        ])
+        self.assertEqual(list(Product.objects.values_list('sku', 'price')), [('R5', Decimal('20.00'))])
+
+    def test_undecodable_rows_are_skipped_and_checkpointed(self):
+        path = os.path.join(self.directory, 'feed.jsonl')
+        with open(path, 'wb') as f:
+            f.write(b'{"sku": "R1", "name": "Gold Ring", "category": "Rings", "price": 300}\n')
+            f.write(b'{"sku": "R2", "name": \n')
+            f.write(b'["R3", "Gold Band"]\n')
+            f.write(b'"R4"\n')
+            f.write(b'{"sku": "R5", "name": "Gold \xff Chain", "category": "Rings", "price": 80}\n')
+            f.write(b'{"sku": "R6", "name": "Gold Chain", "category": "Rings", "price": 80}\n')
+        stdout, stderr = self.run_import(path, '--batch-size', '2')
+        self.assertEqual([line.split(':')[0] for line in stderr.splitlines()], ['Row 2', 'Row 3', 'Row 4', 'Row 5'])
+        self.assertIn('2 created, 0 updated, 0 unchanged, 0 images, 4 invalid', stdout)
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+        csv_path = os.path.join(self.directory, 'feed.csv')
+        with open(csv_path, 'wb') as f:
+            f.write(self.HEADER.encode() + b'R7,Gold \xff Ring,Rings,300,gold,5\nR8,Gold Ring,Rings,300,gold,5\n')
+        stdout, stderr = self.run_import(csv_path)
+        self.assertEqual(stderr.splitlines(), ['Row 1: not valid UTF-8'])
+        self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ['R1', 'R6', 'R8'])
+
+    def test_interrupted_import_resumes_from_its_checkpoint(self):
+        path = self.feed('feed.csv', self.HEADER + ''.join(
+            f'R{n},Ring {n},{"Rings" if n % 2 else "Bands"},{100 * n},gold,5\n' for n in range(1, 6)
+        ))
+        write_batch = ImportCatalogCommand.write_batch
+        written = []
+
+        def crash_on_second_batch(command, batch, pool):
+            if written:
+                raise RuntimeError('connection lost')
+            written.append(batch)
+            return write_batch(command, batch, pool)
+
+        with mock.patch.object(ImportCatalogCommand, 'write_batch', crash_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                self.run_import(path, '--batch-size', '2')
+        self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ['R1', 'R2'])
+        # Facet counts are kept per batch, so they hold after the crash
+        self.assertFacetsMatch()
+        self.assertTrue(os.path.exists(f'{path}.checkpoint'))
+
+        version = CatalogVersion.current()
+        stdout, stderr = self.run_import(path, '--batch-size', '2')
+        self.assertIn('Resuming after row 2', stdout)
+        self.assertIn('Imported 3 rows', stdout)
+        self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ['R1', 'R2', 'R3', 'R4', 'R5'])
+        self.assertFacetsMatch()
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+        # One version bump for the whole run, not one per batch
+        self.assertEqual(CatalogVersion.current(), version + 1)
+
+    def test_reimporting_json_lines_leaves_rows_unchanged(self):
+        path = self.feed('feed.jsonl', json.dumps(
+            {'sku': 'R1', 'name': 'Gold Ring', 'category': 'Rings', 'price': 12.3, 'discount_percentage': 10.1}
+        ) + '\n')
+        self.run_import(path)
+        product = Product.objects.get(sku='R1')
+        self.assertEqual((product.price, product.discount_percentage), (Decimal('12.30'), Decimal('10.10')))
+        stdout, stderr = self.run_import(path)
+        self.assertIn('0 created, 0 updated, 1 unchanged', stdout)
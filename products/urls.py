@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'products'
 
@@ -8,4 +8,9 @@ urlpatterns = [
     path('<int:pk>/', views.ProductDetailView.as_view(), name='detail'),
     path('category/<int:category_id>/', views.ProductByCategoryView.as_view(), name='by_category'),
     path('search/', views.ProductSearchView.as_view(), name='search'),
-]
\ No newline at end of file
+    path('api/products/', api.ProductListAPIView.as_view(), name='api_list'),
+    path('api/products/<int:pk>/', api.ProductDetailAPIView.as_view(), name='api_detail'),
+    path('api/categories/', api.CategoryListAPIView.as_view(), name='api_categories'),
+    path('api/search/', api.SearchAPIView.as_view(), name='api_search'),
+    path('api/autocomplete/', api.AutocompleteAPIView.as_view(), name='api_autocomplete'),
+]
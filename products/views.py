@@ -1,61 +1,98 @@
 from django.shortcuts import render, get_object_or_404
 from django.views.generic import ListView, DetailView
-from django.db.models import Q
 from django.core.paginator import Paginator
+from core.middleware import tag_page
+from core.pagination import CursorPaginationMixin
 from .models import Product, Category
+from .facets import facet_context
+from .search import search_products, spelling_correction
+from .snapshot import get_snapshot
 
 
-class ProductListView(ListView):
+# Price sorts use the stored discounted price
+SORT_OPTIONS = {
+    'price': 'effective_price',
+    '-price': '-effective_price',
+    'name': 'name',
+    '-name': '-name',
+    'created_at': 'created_at',
+    '-created_at': '-created_at',
+}
+
+
+def filter_products(queryset, params):
+    """Apply the listing's search, filter and sort parameters to ``queryset``."""
+    # Search functionality
+    search_query = params.get('search')
+    if search_query:
+        queryset = search_products(queryset, search_query)
+    
+    # Category filtering
+    category_id = params.get('category')
+    if category_id:
+        queryset = queryset.filter(category_id=category_id)
+        
+    # Material filtering
+    material = params.get('material')
+    if material:
+        queryset = queryset.filter(material=material)
+        
+    # Price filtering
+    min_price = params.get('min_price')
+    max_price = params.get('max_price')
+    if min_price:
+        queryset = queryset.filter(effective_price__gte=min_price)
+    if max_price:
+        queryset = queryset.filter(effective_price__lte=max_price)
+        
+    # Sorting; searches default to relevance order
+    sort_by = params.get('sort')
+    if sort_by in SORT_OPTIONS:
+        queryset = queryset.order_by(SORT_OPTIONS[sort_by])
+    elif search_query:
+        queryset = queryset.order_by('-search_rank', '-created_at')
+        
+    return queryset
+
+
+class ProductListView(CursorPaginationMixin, ListView):
     model = Product
     template_name = 'products/product_list.html'
     context_object_name = 'products'
     paginate_by = 12
+    cursor_estimate_total = True
     
     def get_queryset(self):
-        queryset = Product.objects.filter(is_active=True).select_related('category').prefetch_related('images')
-        
-        # Search functionality
-        search_query = self.request.GET.get('search')
-        if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) | 
-                Q(description__icontains=search_query) |
-                Q(category__name__icontains=search_query)
-            )
-        
-        # Category filtering
-        category_id = self.request.GET.get('category')
-        if category_id:
-            queryset = queryset.filter(category_id=category_id)
-            
-        # Material filtering
-        material = self.request.GET.get('material')
-        if material:
-            queryset = queryset.filter(material=material)
-            
-        # Price filtering
-        min_price = self.request.GET.get('min_price')
-        max_price = self.request.GET.get('max_price')
-        if min_price:
-            queryset = queryset.filter(price__gte=min_price)
-        if max_price:
-            queryset = queryset.filter(price__lte=max_price)
-            
-        # Sorting
-        sort_by = self.request.GET.get('sort', '-created_at')
-        if sort_by in ['price', '-price', 'name', '-name', 'created_at', '-created_at']:
-            queryset = queryset.order_by(sort_by)
-            
-        return queryset
+        # Categories are prefetched rather than joined so the listing can be
+        # read in order from a single products index; the primary image is a
+        # LEFT JOIN, which keeps products as the driving table.
+        queryset = Product.objects.filter(is_active=True).select_related('primary_image').prefetch_related('category')
+        params = self.request.GET.copy()
+        self.corrected_query = None
+        if params.get('search') and not params.get('exact'):
+            self.corrected_query = spelling_correction(Product.objects.filter(is_active=True), params['search'])
+            if self.corrected_query:
+                params['search'] = self.corrected_query
+        return filter_products(queryset, params)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.filter(is_active=True)
+        context['categories'] = get_snapshot().categories
         context['materials'] = Product.MATERIAL_CHOICES
         context['search_query'] = self.request.GET.get('search', '')
+        context['corrected_query'] = self.corrected_query
+        context['search_param'] = 'search'
+        search_results = None
+        if context['search_query']:
+            search_results = search_products(
+                Product.objects.filter(is_active=True), self.corrected_query or context['search_query']
+            )
+        context.update(facet_context(self.request.GET, context['categories'], search_results))
         context['selected_category'] = self.request.GET.get('category', '')
         context['selected_material'] = self.request.GET.get('material', '')
-        context['sort_by'] = self.request.GET.get('sort', '-created_at')
+        context['sort_by'] = self.request.GET.get('sort', '' if context['search_query'] else '-created_at')
+        category = context['selected_category']
+        tag_page(self.request, f'listing:{category}' if category.isdigit() else 'listing', 'facets', 'categories')
         return context
 
 
@@ -65,57 +102,79 @@ class ProductDetailView(DetailView):
     context_object_name = 'product'
     
     def get_queryset(self):
-        return Product.objects.filter(is_active=True).select_related('category').prefetch_related('images')
+        return Product.objects.filter(is_active=True).select_related('category', 'primary_image').prefetch_related('images')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Get related products from same category
-        context['related_products'] = Product.objects.filter(
-            category=self.object.category,
-            is_active=True
-        ).exclude(pk=self.object.pk)[:4]
+        # Co-purchase neighbours topped up from the same category
+        context['related_products'] = get_snapshot().related_products(self.object.pk, self.object.category_id)
+        tag_page(
+            self.request,
+            f'product:{self.object.pk}', f'category:{self.object.category_id}', f'related:{self.object.pk}',
+        )
         return context
 
 
-class ProductByCategoryView(ListView):
+class ProductByCategoryView(CursorPaginationMixin, ListView):
     model = Product
     template_name = 'products/product_list.html'
     context_object_name = 'products'
     paginate_by = 12
     
     def get_queryset(self):
-        self.category = get_object_or_404(Category, pk=self.kwargs['category_id'])
+        self.category = get_snapshot().category(self.kwargs['category_id']) or get_object_or_404(
+            Category, pk=self.kwargs['category_id']
+        )
         return Product.objects.filter(
-            category=self.category,
+            category_id=self.category.pk,
             is_active=True
-        ).select_related('category').prefetch_related('images').order_by('-created_at')
+        ).select_related('primary_image').prefetch_related('category').order_by('-created_at')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['category'] = self.category
-        context['categories'] = Category.objects.filter(is_active=True)
+        context['categories'] = get_snapshot().categories
         context['materials'] = Product.MATERIAL_CHOICES
+        context['selected_category'] = str(self.category.pk)
+        context.update(facet_context({'category': context['selected_category']}, context['categories']))
+        tag_page(self.request, f'category:{self.category.pk}', f'listing:{self.category.pk}', 'facets', 'categories')
         return context
 
 
-class ProductSearchView(ListView):
+class ProductSearchView(CursorPaginationMixin, ListView):
     model = Product
-    template_name = 'products/search_results.html'
+    template_name = 'products/product_list.html'
     context_object_name = 'products'
     paginate_by = 12
     
     def get_queryset(self):
         search_query = self.request.GET.get('q', '')
+        self.corrected_query = None
+        if search_query and not self.request.GET.get('exact'):
+            self.corrected_query = spelling_correction(Product.objects.filter(is_active=True), search_query)
+            search_query = self.corrected_query or search_query
         if search_query:
-            return Product.objects.filter(
-                Q(name__icontains=search_query) | 
-                Q(description__icontains=search_query) |
-                Q(category__name__icontains=search_query),
-                is_active=True
-            ).select_related('category').prefetch_related('images').order_by('-created_at')
+            queryset = search_products(
+                Product.objects.filter(is_active=True),
+                search_query
+            ).select_related('primary_image').prefetch_related('category')
+            sort_by = self.request.GET.get('sort')
+            if sort_by in SORT_OPTIONS:
+                return queryset.order_by(SORT_OPTIONS[sort_by])
+            return queryset.order_by('-search_rank', '-created_at')
         return Product.objects.none()
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search_query'] = self.request.GET.get('q', '')
+        context['corrected_query'] = self.corrected_query
+        context['search_param'] = 'q'
+        context['categories'] = get_snapshot().categories
+        context['materials'] = Product.MATERIAL_CHOICES
+        context['sort_by'] = self.request.GET.get('sort', '')
+        if context['search_query']:
+            search_results = search_products(
+                Product.objects.filter(is_active=True), self.corrected_query or context['search_query']
+            )
+            context.update(facet_context({}, context['categories'], search_results))
         return context